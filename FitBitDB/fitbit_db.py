@@ -9,12 +9,13 @@ import datetime
 from sqlalchemy import Column, Integer, Date, Float, Time
 
 import Fit
+import HealthDB
 import utilities
 
 
 logger = logging.getLogger(__name__)
 
-FitBitDB = utilities.DB.create('fitbit', 2, "Database for storing health data from FitBit.")
+FitBitDB = HealthDB.DbRegistry.create('fitbit', 2, "Database for storing health data from FitBit.")
 Attributes = utilities.DbObject.create('attributes', FitBitDB, 1, base=utilities.KeyValueObject, doc="key-value data from a FitBit device.")
 
 
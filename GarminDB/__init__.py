@@ -6,9 +6,12 @@ __license__ = "GPL"
 
 # flake8: noqa
 
-from GarminDB.garmin_db import GarminDB, Attributes, Device, DeviceInfo, File, Weight, Stress, Sleep, SleepEvents, RestingHeartRate, DailySummary
+from GarminDB.garmin_db import GarminDB, Attributes, Device, DeviceInfo, File, Weight, Stress, Sleep, SleepEvents, SleepHypnogram, RestingHeartRate, DailySummary
 from GarminDB.monitoring_db import MonitoringDB, MonitoringInfo, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring, \
-    MonitoringRespirationRate, MonitoringPulseOx
-from GarminDB.activities_db import ActivitiesDB, ActivitiesLocationSegment, Activities, ActivityLaps, ActivityRecords, SportActivities, StepsActivities, \
-    PaddleActivities, CycleActivities
-from GarminDB.garmin_summary_db import GarminSummaryDB, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary, IntensityHR
+    MonitoringRespirationRate, MonitoringPulseOx, MonitoringRollup, MonitoringRollup15Min, MonitoringRollupHour, MonitoringRollupDay, MonitoringRollups, \
+    MonitoringPartitioned, MonitoringPartitions
+from GarminDB.activities_db import ActivitiesDB, ActivitiesLocationSegment, ActivitiesLocationIndex, Activities, ActivityLaps, ActivityRecords, ActivityTracks, \
+    AutoCourses, ActivityRoutes, SportActivities, StepsActivities, PaddleActivities, CycleActivities
+from GarminDB.garmin_summary_db import GarminSummaryDB, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary, IntensityHR, DirtyDays, Coverage, \
+    TrainingLoad, Calendar
+from GarminDB.unified_db import UnifiedDB
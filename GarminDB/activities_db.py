@@ -6,20 +6,24 @@ __license__ = "GPL"
 
 import logging
 import datetime
-from sqlalchemy import Column, String, Float, Integer, DateTime, Time, ForeignKey, PrimaryKeyConstraint, desc, literal_column
+import enum
+from sqlalchemy import Column, String, Float, Integer, DateTime, Time, LargeBinary, ForeignKey, PrimaryKeyConstraint, desc, literal_column, \
+    Table, MetaData, Index, select, func, and_, text
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
+import HealthDB
 import utilities
+import GarminDB.track_geometry as track_geometry
 
 
 logger = logging.getLogger(__name__)
 
-ActivitiesDB = utilities.DB.create('garmin_activities', 13, "Database for storing activities data.")
+ActivitiesDB = HealthDB.DbRegistry.create('garmin_activities', 13, "Database for storing activities data.")
 
 
-class ActivitiesLocationSegment(utilities.DbObject):
+class ActivitiesLocationSegment(HealthDB.UpsertDbObject):
     """Object representing a databse object for storing location segnment from an activity."""
 
     # degrees
@@ -49,28 +53,153 @@ class ActivitiesLocationSegment(utilities.DbObject):
         self.stop_long = stop_location.long_deg
 
 
+class ActivitiesLocationIndex(object):
+    """A SQLite R-tree index of activity start points, stop points, and bounding boxes."""
+
+    class Kind(enum.IntEnum):
+        """The type of location stored in an index entry."""
+
+        start = 0
+        stop = 1
+        bounds = 2
+
+    # Each entry's id is the activity's location id times the number of kinds plus the kind.
+    kinds = len(Kind)
+
+    # Declared outside of the DB's metadata since R-tree virtual tables can't be created by create_all.
+    rtree = Table(
+        'activities_location_rtree', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('min_lat', Float),
+        Column('max_lat', Float),
+        Column('min_long', Float),
+        Column('max_long', Float)
+    )
+    # R-tree ids are integers and activity ids are strings that may not be numbers, this gives each activity an integer id.
+    location_ids = Table(
+        'activities_location_ids', MetaData(),
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('activity_id', String, unique=True, nullable=False),
+        sqlite_autoincrement=True
+    )
+
+    @classmethod
+    def _supported(cls, session):
+        return session.get_bind().dialect.name == 'sqlite'
+
+    @classmethod
+    def _s_location_id(cls, session, activity_id):
+        location_id = session.execute(select([cls.location_ids.c.id]).where(cls.location_ids.c.activity_id == activity_id)).scalar()
+        if location_id is None:
+            location_id = session.execute(cls.location_ids.insert().values(activity_id=activity_id)).inserted_primary_key[0]
+        return location_id
+
+    @classmethod
+    def create(cls, db):
+        """Create the index if it doesn't exist and populate it from existing activities."""
+        with db.managed_session() as session:
+            if not cls._supported(session):
+                return
+            # Indexes created before activities had location ids are rebuilt.
+            if session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name=:name"), {'name': cls.location_ids.name}).first() is None:
+                logger.info("Creating location index %s", cls.rtree.name)
+                cls.location_ids.create(session.connection())
+                session.execute(text(f'CREATE VIRTUAL TABLE IF NOT EXISTS {cls.rtree.name} USING rtree(id, min_lat, max_lat, min_long, max_long)'))
+                cls.s_rebuild(session)
+                session.commit()
+
+    @classmethod
+    def s_rebuild(cls, session):
+        """Rebuild the whole index from the activities and activity records tables."""
+        session.execute(cls.rtree.delete())
+        for activity_id_col in [Activities.activity_id, ActivityRecords.activity_id]:
+            session.execute(cls.location_ids.insert().prefix_with('OR IGNORE').from_select(['activity_id'], select([activity_id_col]).distinct()))
+        col_names = ['id', 'min_lat', 'max_lat', 'min_long', 'max_long']
+        location_id = cls.location_ids.c.id * cls.kinds
+        activities = Activities.__table__.join(cls.location_ids, cls.location_ids.c.activity_id == Activities.activity_id)
+        for kind, lat_col, long_col in [(cls.Kind.start, Activities.start_lat, Activities.start_long), (cls.Kind.stop, Activities.stop_lat, Activities.stop_long)]:
+            points = select([location_id + int(kind), lat_col, lat_col, long_col, long_col]).select_from(activities).where(and_(lat_col.isnot(None), long_col.isnot(None)))
+            session.execute(cls.rtree.insert().from_select(col_names, points))
+        bounds = (
+            select([location_id + int(cls.Kind.bounds),
+                    func.min(ActivityRecords.position_lat), func.max(ActivityRecords.position_lat),
+                    func.min(ActivityRecords.position_long), func.max(ActivityRecords.position_long)])
+            .select_from(ActivityRecords.__table__.join(cls.location_ids, cls.location_ids.c.activity_id == ActivityRecords.activity_id))
+            .where(and_(ActivityRecords.position_lat.isnot(None), ActivityRecords.position_long.isnot(None)))
+            .group_by(cls.location_ids.c.id)
+        )
+        session.execute(cls.rtree.insert().from_select(col_names, bounds))
+
+    @classmethod
+    def s_update(cls, session, activity_id):
+        """Update the index entries for a single activity."""
+        if not cls._supported(session):
+            return
+        session.flush()
+        activity = session.query(Activities).filter(Activities.activity_id == str(activity_id)).one_or_none()
+        if activity is None:
+            return
+        first_id = cls._s_location_id(session, str(activity_id)) * cls.kinds
+        session.execute(cls.rtree.delete().where(cls.rtree.c.id.between(first_id, first_id + cls.kinds - 1)))
+        entries = []
+        if activity.start_lat is not None and activity.start_long is not None:
+            entries.append((cls.Kind.start, activity.start_lat, activity.start_lat, activity.start_long, activity.start_long))
+        if activity.stop_lat is not None and activity.stop_long is not None:
+            entries.append((cls.Kind.stop, activity.stop_lat, activity.stop_lat, activity.stop_long, activity.stop_long))
+        bounds = (
+            session.query(func.min(ActivityRecords.position_lat), func.max(ActivityRecords.position_lat),
+                          func.min(ActivityRecords.position_long), func.max(ActivityRecords.position_long))
+            .filter(ActivityRecords.activity_id == str(activity_id))
+            .filter(ActivityRecords.position_lat.isnot(None)).filter(ActivityRecords.position_long.isnot(None))
+            .one()
+        )
+        if bounds[0] is not None:
+            entries.append((cls.Kind.bounds,) + tuple(bounds))
+        elif len(entries) == 2:
+            entries.append((cls.Kind.bounds, min(entries[0][1], entries[1][1]), max(entries[0][1], entries[1][1]),
+                            min(entries[0][3], entries[1][3]), max(entries[0][3], entries[1][3])))
+        if entries:
+            session.execute(cls.rtree.insert(), [
+                {'id' : first_id + kind, 'min_lat' : min_lat, 'max_lat' : max_lat, 'min_long' : min_long, 'max_long' : max_long}
+                for kind, min_lat, max_lat, min_long, max_long in entries
+            ])
+
+    @classmethod
+    def activity_ids_query(cls, min_lat, max_lat, min_long, max_long, kind):
+        """Return a select of the ids of activities with an index entry of the given kind that intersects the bounding box."""
+        return (
+            select([cls.location_ids.c.activity_id])
+            .select_from(cls.rtree.join(cls.location_ids, cls.location_ids.c.id == cls.rtree.c.id / cls.kinds))
+            .where(and_(cls.rtree.c.max_lat >= min_lat, cls.rtree.c.min_lat <= max_lat, cls.rtree.c.max_long >= min_long, cls.rtree.c.min_long <= max_long))
+            .where(cls.rtree.c.id % cls.kinds == int(kind))
+        )
+
+
 class Activities(ActivitiesDB.Base, ActivitiesLocationSegment):
     """Class represents a databse table that contains data about recorded activities."""
 
     __tablename__ = 'activities'
 
     db = ActivitiesDB
-    table_version = 3
+    table_version = 4
+    # Indexes for the columns activities are looked up by were added.
+    table_migrations = {3 : HealthDB.SchemaMigrations.create_indexes()}
+    marks_dirty_days = True
 
     activity_id = Column(String, primary_key=True)
     name = Column(String)
     description = Column(String)
-    type = Column(String)
+    type = Column(String, index=True)
     #
-    course_id = Column(Integer)
+    course_id = Column(Integer, index=True)
     #
-    start_time = Column(DateTime)
+    start_time = Column(DateTime, index=True)
     stop_time = Column(DateTime)
     elapsed_time = Column(Time, nullable=False, default=datetime.time.min)
     moving_time = Column(Time, nullable=False, default=datetime.time.min)
     #
-    sport = Column(String)
-    sub_sport = Column(String)
+    sport = Column(String, index=True)
+    sub_sport = Column(String, index=True)
     # kms or miles
     distance = Column(Float)
     #
@@ -123,14 +252,86 @@ class Activities(ActivitiesDB.Base, ActivitiesLocationSegment):
             return session.query(cls).filter(cls.course_id == course_id).order_by(cls.avg_speed).limit(1).one_or_none()
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for the time range."""
-        stats = {
-            'activities'            : cls.s_row_count_for_period(session, start_ts, end_ts),
-            'activities_calories'   : cls.s_get_col_sum(session, cls.calories, start_ts, end_ts),
-            'activities_distance'   : cls.s_get_col_sum(session, cls.distance, start_ts, end_ts),
+    def setup(cls, db):
+        """Initialize the table and the location index built from it."""
+        super().setup(db)
+        ActivitiesLocationIndex.create(db)
+
+    @classmethod
+    def s_get_in_bounding_box(cls, session, min_lat, max_lat, min_long, max_long, kind=ActivitiesLocationIndex.Kind.start):
+        """Return all activities with a start point, stop point, or bounds (depending on kind) in the bounding box given in degrees."""
+        activity_ids = ActivitiesLocationIndex.activity_ids_query(min_lat, max_lat, min_long, max_long, kind)
+        return session.query(cls).filter(cls.activity_id.in_(activity_ids)).order_by(cls.start_time).all()
+
+    @classmethod
+    def get_in_bounding_box(cls, db, min_lat, max_lat, min_long, max_long, kind=ActivitiesLocationIndex.Kind.start):
+        """Return all activities with a start point, stop point, or bounds (depending on kind) in the bounding box given in degrees."""
+        with db.managed_session() as session:
+            return cls.s_get_in_bounding_box(session, min_lat, max_lat, min_long, max_long, kind)
+
+    @classmethod
+    def s_get_near(cls, session, location, radius, kind=ActivitiesLocationIndex.Kind.start):
+        """Return all activities that start or stop within radius meters of a location, or whose bounds overlap the radius (depending on kind)."""
+        activities = cls.s_get_in_bounding_box(session, *track_geometry.bounding_box(location.lat_deg, location.long_deg, radius), kind)
+        if kind == ActivitiesLocationIndex.Kind.bounds:
+            return activities
+        prefix = kind.name
+        return [
+            activity for activity in activities
+            if track_geometry.distance(location.lat_deg, location.long_deg, getattr(activity, prefix + '_lat'), getattr(activity, prefix + '_long')) <= radius
+        ]
+
+    @classmethod
+    def get_near(cls, db, location, radius, kind=ActivitiesLocationIndex.Kind.start):
+        """Return all activities that start or stop within radius meters of a location, or whose bounds overlap the radius (depending on kind)."""
+        with db.managed_session() as session:
+            return cls.s_get_near(session, location, radius, kind)
+
+    @classmethod
+    def _auto_course_filter(cls, auto_course_id):
+        return cls.activity_id.in_(select([ActivityRoutes.activity_id]).where(ActivityRoutes.auto_course_id == auto_course_id))
+
+    @classmethod
+    def get_by_auto_course_id(cls, db, auto_course_id):
+        """Return all activities records for activities on the matching auto course."""
+        with db.managed_session() as session:
+            return session.query(cls).filter(cls._auto_course_filter(auto_course_id)).order_by(cls.start_time).all()
+
+    @classmethod
+    def get_fastest_by_auto_course_id(cls, db, auto_course_id):
+        """Return an activities record for the activity on the matching auto course with the fastest speed."""
+        with db.managed_session() as session:
+            return session.query(cls).filter(cls._auto_course_filter(auto_course_id)).order_by(desc(cls.avg_speed)).limit(1).one_or_none()
+
+    @classmethod
+    def get_slowest_by_auto_course_id(cls, db, auto_course_id):
+        """Return an activities record for the activity on the matching auto course with the slowest speed."""
+        with db.managed_session() as session:
+            return session.query(cls).filter(cls._auto_course_filter(auto_course_id)).order_by(cls.avg_speed).limit(1).one_or_none()
+
+    @classmethod
+    def s_get_started_since(cls, session, start_ts):
+        """Return (activity_id, start_time, training_effect) tuples, in order of start time, for the activities started since a time."""
+        return session.query(cls.activity_id, cls.start_time, cls.training_effect).filter(cls.start_time >= start_ts).order_by(cls.start_time).all()
+
+    @classmethod
+    def s_get_hr_records(cls, session, start_ts):
+        """Return (activity_id, timestamp, hr) tuples, in order of activity and time, for the heart rate records of the activities started since a time."""
+        return (
+            session.query(ActivityRecords.activity_id, ActivityRecords.timestamp, ActivityRecords.hr)
+            .filter(ActivityRecords.activity_id.in_(session.query(cls.activity_id).filter(cls.start_time >= start_ts)))
+            .filter(ActivityRecords.timestamp.isnot(None)).filter(ActivityRecords.hr.isnot(None))
+            .order_by(ActivityRecords.activity_id, ActivityRecords.timestamp).all()
+        )
+
+    @classmethod
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
+        return {
+            'activities'            : (cls.activity_id, 'count'),
+            'activities_calories'   : (cls.calories, 'sum'),
+            'activities_distance'   : (cls.distance, 'sum'),
         }
-        return stats
 
 
 class ActivityLaps(ActivitiesDB.Base, ActivitiesLocationSegment):
@@ -189,13 +390,15 @@ class ActivityLaps(ActivitiesDB.Base, ActivitiesLocationSegment):
         self.start_long = start_location.long_deg
 
 
-class ActivityRecords(ActivitiesDB.Base, utilities.DbObject):
+class ActivityRecords(ActivitiesDB.Base, HealthDB.UpsertDbObject):
     """Encapsilates record for a single point in time from an activity."""
 
     __tablename__ = 'activity_records'
 
     db = ActivitiesDB
-    table_version = 3
+    table_version = 4
+    # The activity id and timestamp index was added.
+    table_migrations = {3 : HealthDB.SchemaMigrations.create_indexes()}
 
     activity_id = Column(String, ForeignKey('activities.activity_id'))
     record = Column(Integer)
@@ -211,7 +414,10 @@ class ActivityRecords(ActivitiesDB.Base, utilities.DbObject):
     speed = Column(Float)           # kmph or mph
     temperature = Column(Float)     # C or F
 
-    __table_args__ = (PrimaryKeyConstraint("activity_id", "record"),)
+    __table_args__ = (
+        PrimaryKeyConstraint("activity_id", "record"),
+        Index('activity_records_activity_id_timestamp', 'activity_id', 'timestamp'),
+    )
 
     @classmethod
     def s_get_activity(cls, session, activity_id):
@@ -229,7 +435,221 @@ class ActivityRecords(ActivitiesDB.Base, utilities.DbObject):
         self.position_long = location.long_deg
 
 
-class SportActivities(utilities.DbObject):
+class ActivityTracks(ActivitiesDB.Base, HealthDB.UpsertDbObject):
+    """Simplified tracks for an activity at several levels of detail."""
+
+    __tablename__ = 'activity_tracks'
+
+    db = ActivitiesDB
+    table_version = 1
+
+    # Douglas-Peucker tolerance in meters for each level of detail, from most to least detailed.
+    level_tolerances = [2.0, 10.0, 50.0]
+
+    activity_id = Column(String, ForeignKey('activities.activity_id'))
+    level = Column(Integer)
+    tolerance = Column(Float)
+    points = Column(Integer)
+    # record numbers of the points kept at this level as packed uint32
+    records = Column(LargeBinary)
+    # lat, long pairs in degrees as packed float32
+    positions = Column(LargeBinary)
+
+    __table_args__ = (PrimaryKeyConstraint("activity_id", "level"),)
+
+    @classmethod
+    def s_get_from_dict(cls, session, values_dict):
+        """Return a single ActivityTracks instance for the given activity and level."""
+        return session.query(cls).filter(cls.activity_id == values_dict['activity_id']).filter(cls.level == values_dict['level']).one_or_none()
+
+    @classmethod
+    def s_create_from_records(cls, session, activity_id):
+        """Create the simplified tracks for an activity from its records."""
+        positions = (
+            session.query(ActivityRecords.record, ActivityRecords.position_lat, ActivityRecords.position_long)
+            .filter(ActivityRecords.activity_id == activity_id)
+            .filter(ActivityRecords.position_lat.isnot(None)).filter(ActivityRecords.position_long.isnot(None))
+            .order_by(ActivityRecords.record).all()
+        )
+        if len(positions) == 0:
+            return
+        records, lats, longs = (list(values) for values in zip(*positions))
+        for level, tolerance in enumerate(cls.level_tolerances):
+            indices = track_geometry.simplify(lats, longs, tolerance)
+            track = {
+                'activity_id'   : activity_id,
+                'level'         : level,
+                'tolerance'     : tolerance,
+                'points'        : len(indices),
+                'records'       : track_geometry.pack_indices([records[index] for index in indices]),
+                'positions'     : track_geometry.pack_positions([lats[index] for index in indices], [longs[index] for index in indices]),
+            }
+            cls.s_insert_or_update(session, track)
+
+    @classmethod
+    def create_missing(cls, db):
+        """Create simplified tracks for all activities with records but no tracks."""
+        with db.managed_session() as session:
+            activity_ids = (
+                session.query(ActivityRecords.activity_id).distinct()
+                .filter(ActivityRecords.activity_id.notin_(session.query(cls.activity_id)))
+                .all()
+            )
+            for (activity_id,) in activity_ids:
+                cls.s_create_from_records(session, activity_id)
+            session.commit()
+
+    @classmethod
+    def s_get_track(cls, session, activity_id, level=0):
+        """Return the simplified track for an activity as a list of (lat, long) tuples or None if there is no track."""
+        track = session.query(cls).filter(cls.activity_id == activity_id).filter(cls.level == level).one_or_none()
+        if track is not None:
+            return track_geometry.unpack_positions(track.positions)
+
+    @classmethod
+    def get_track(cls, db, activity_id, level=0):
+        """Return the simplified track for an activity as a list of (lat, long) tuples or None if there is no track."""
+        with db.managed_session() as session:
+            return cls.s_get_track(session, activity_id, level)
+
+    @classmethod
+    def s_get_tracks(cls, session, activity_ids, level=len(level_tolerances) - 1):
+        """Return a dict of simplified tracks keyed by activity id for a list of activities."""
+        tracks = session.query(cls.activity_id, cls.positions).filter(cls.activity_id.in_(activity_ids)).filter(cls.level == level).all()
+        return {activity_id : track_geometry.unpack_positions(positions) for activity_id, positions in tracks}
+
+    @classmethod
+    def s_get_track_records(cls, session, activity_id, level=0):
+        """Return the activity records retained in the simplified track for an activity or None if there is no track."""
+        track = session.query(cls.records).filter(cls.activity_id == activity_id).filter(cls.level == level).one_or_none()
+        if track is not None:
+            records = track_geometry.unpack_indices(track.records)
+            # keep the number of bound parameters per query under SQLite's limit
+            chunk_size = 500
+            return [
+                record
+                for start in range(0, len(records), chunk_size)
+                for record in session.query(ActivityRecords).filter(ActivityRecords.activity_id == activity_id)
+                .filter(ActivityRecords.record.in_(records[start:start + chunk_size])).order_by(ActivityRecords.record).all()
+            ]
+
+
+class AutoCourses(ActivitiesDB.Base, HealthDB.UpsertDbObject):
+    """Courses found by clustering activities that follow the same route."""
+
+    __tablename__ = 'auto_courses'
+
+    db = ActivitiesDB
+    table_version = 1
+
+    auto_course_id = Column(Integer, primary_key=True)
+    sport = Column(String)
+    # geohash cell, at ActivityRoutes.start_cell_precision, that the course starts in
+    start_cell = Column(String, index=True)
+    # space separated geohash cells of the first activity on the course
+    cells = Column(String)
+    activities = Column(Integer)
+
+    @classmethod
+    def get_with_activities(cls, db, sport=None, min_activities=2):
+        """Return all auto courses with at least min_activities activities, optionally only for the given sports."""
+        with db.managed_session() as session:
+            query = session.query(cls).filter(cls.activities >= min_activities)
+            if sport is not None:
+                query = query.filter(cls.sport.in_(sport))
+            return query.order_by(cls.auto_course_id).all()
+
+
+def _delete_activity_routes(connection, table_object):
+    connection.execute(table_object.__table__.delete())
+    connection.execute(AutoCourses.__table__.delete())
+
+
+class ActivityRoutes(ActivitiesDB.Base, HealthDB.UpsertDbObject):
+    """Route signatures for activities used to cluster activities into auto courses."""
+
+    __tablename__ = 'activity_routes'
+
+    db = ActivitiesDB
+    table_version = 2
+    # Courses used to mix sports, drop the routes and courses so that they are matched again by sport.
+    table_migrations = {1 : _delete_activity_routes}
+
+    # Geohash precision 7 cells are about 150m by 150m.
+    cell_precision = 7
+    # Auto courses are candidates if they start in the same or a neighboring precision 6 cell, about 1.2km by 0.6km.
+    start_cell_precision = 6
+    # The track level the signature is built from.
+    track_level = 1
+    # The minimum Jaccard similarity of route cells for an activity to be on an auto course.
+    match_similarity = 0.7
+
+    activity_id = Column(String, ForeignKey('activities.activity_id'), primary_key=True)
+    start_cell = Column(String, index=True)
+    # space separated geohash cells that the activity passed through
+    cells = Column(String)
+    auto_course_id = Column(Integer, ForeignKey('auto_courses.auto_course_id'), index=True)
+
+    @classmethod
+    def __match_auto_course(cls, session, sport, lat, long, cells):
+        candidates = (
+            session.query(AutoCourses).filter(AutoCourses.sport == sport)
+            .filter(AutoCourses.start_cell.in_(track_geometry.geohash_neighbors(lat, long, cls.start_cell_precision))).all()
+        )
+        best_similarity = 0.0
+        best_auto_course = None
+        for auto_course in candidates:
+            similarity = track_geometry.jaccard_similarity(cells, auto_course.cells.split())
+            if similarity > best_similarity:
+                best_similarity = similarity
+                best_auto_course = auto_course
+        if best_similarity >= cls.match_similarity:
+            return best_auto_course
+
+    @classmethod
+    def s_update(cls, session, activity_id):
+        """Create the route signature for an activity from its simplified track and add it to a matching or new auto course."""
+        if cls.s_exists(session, {'activity_id' : activity_id}):
+            return
+        positions = ActivityTracks.s_get_track(session, activity_id, cls.track_level)
+        if not positions:
+            return
+        lats, longs = zip(*positions)
+        cells = track_geometry.route_signature(lats, longs, cls.cell_precision)
+        # Only activities of the same sport share a course.
+        activity = Activities.s_get(session, activity_id)
+        sport = activity.sport if activity else None
+        auto_course = cls.__match_auto_course(session, sport, lats[0], longs[0], cells)
+        if auto_course is None:
+            auto_course = AutoCourses(sport=sport, start_cell=track_geometry.geohashes(lats[:1], longs[:1], cls.start_cell_precision)[0],
+                                      cells=' '.join(cells), activities=0)
+            session.add(auto_course)
+            session.flush()
+        auto_course.activities += 1
+        route = {
+            'activity_id'       : activity_id,
+            'start_cell'        : auto_course.start_cell,
+            'cells'             : ' '.join(cells),
+            'auto_course_id'    : auto_course.auto_course_id,
+        }
+        session.add(cls(**route))
+
+    @classmethod
+    def create_missing(cls, db):
+        """Create route signatures for all activities with tracks but no route signature, oldest activities first."""
+        with db.managed_session() as session:
+            activity_ids = (
+                session.query(ActivityTracks.activity_id).join(Activities, Activities.activity_id == ActivityTracks.activity_id)
+                .filter(ActivityTracks.level == cls.track_level)
+                .filter(ActivityTracks.activity_id.notin_(session.query(cls.activity_id)))
+                .order_by(Activities.start_time).all()
+            )
+            for (activity_id,) in activity_ids:
+                cls.s_update(session, activity_id)
+            session.commit()
+
+
+class SportActivities(HealthDB.UpsertDbObject):
     """Base class for all sport based activity tables."""
 
     @declared_attr
@@ -258,6 +678,12 @@ class SportActivities(utilities.DbObject):
         filter = literal_column(f'{Activities.course_id} == {course_id}')
         cls.create_join_view(db, f'course_{course_id}_view', selectable, Activities, filter, Activities.start_time.desc())
 
+    @classmethod
+    def _create_auto_course_view(cls, db, selectable, auto_course_id):
+        filter = literal_column(f'{Activities.activity_id} IN (SELECT {ActivityRoutes.activity_id.name} FROM {ActivityRoutes.__tablename__} '
+                                f'WHERE {ActivityRoutes.auto_course_id.name} == {auto_course_id})')
+        cls.create_join_view(db, f'auto_course_{auto_course_id}_view', selectable, Activities, filter, Activities.start_time.desc())
+
     @classmethod
     def create_view(cls, db):
         """Create a database view for a sport based activity type."""
@@ -363,9 +789,9 @@ class StepsActivities(ActivitiesDB.Base, SportActivities):
         cls._create_sport_view(db, cls._view_selectable(), "hiking")
 
     @classmethod
-    def create_course_view(cls, db, course_id):
+    def _course_view_selectable(cls):
         # The query fails to genarate sql when using the func.round clause.
-        selectable = [
+        return [
             Activities.activity_id.label('activity_id'),
             Activities.name.label('name'),
             Activities.description.label('description'),
@@ -399,7 +825,16 @@ class StepsActivities(ActivitiesDB.Base, SportActivities):
             Activities.training_effect.label('training_effect'),
             Activities.anaerobic_training_effect.label('anaerobic_training_effect')
         ]
-        cls._create_course_view(db, selectable, course_id)
+
+    @classmethod
+    def create_course_view(cls, db, course_id):
+        """Create a database view of all steps activities for a Garmin Connect course."""
+        cls._create_course_view(db, cls._course_view_selectable(), course_id)
+
+    @classmethod
+    def create_auto_course_view(cls, db, auto_course_id):
+        """Create a database view of all steps activities on an auto course."""
+        cls._create_auto_course_view(db, cls._course_view_selectable(), auto_course_id)
 
 
 class PaddleActivities(ActivitiesDB.Base, SportActivities):
@@ -8,11 +8,13 @@ import os
 import datetime
 import logging
 import re
-from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, PrimaryKeyConstraint
+import struct
+from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, LargeBinary, ForeignKey, func, PrimaryKeyConstraint, Index
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import Fit
 import Fit.conversions as conversions
+import HealthDB
 import utilities
 
 
@@ -27,7 +29,7 @@ class GarminDbError_IdNotFound(GarminDbError):
     """File id not found"""
 
 
-GarminDB = utilities.DB.create('garmin', 14, "Database for storing health data from a Garmin device.")
+GarminDB = HealthDB.DbRegistry.create('garmin', 14, "Database for storing health data from a Garmin device.")
 
 
 class Attributes(GarminDB.Base, utilities.KeyValueObject):
@@ -49,7 +51,7 @@ class Attributes(GarminDB.Base, utilities.KeyValueObject):
         return (cls.measurements_type(db) == Fit.field_enums.DisplayMeasure.metric)
 
 
-class Device(GarminDB.Base, utilities.DbObject):
+class Device(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a Garmin device."""
 
     __tablename__ = 'devices'
@@ -78,17 +80,19 @@ class Device(GarminDB.Base, utilities.DbObject):
         return '%s%06d' % (serial_number, device_type.value)
 
 
-class DeviceInfo(GarminDB.Base, utilities.DbObject):
+class DeviceInfo(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a Garmin device info message from a FIT file."""
 
     __tablename__ = 'device_info'
 
     db = GarminDB
-    table_version = 4
+    table_version = 5
+    # The file id and serial number indexes were added.
+    table_migrations = {4 : HealthDB.SchemaMigrations.create_indexes()}
     view_version = 6
 
     timestamp = Column(DateTime, nullable=False)
-    file_id = Column(String, ForeignKey('files.id'))
+    file_id = Column(String, ForeignKey('files.id'), index=True)
     serial_number = Column(Integer, ForeignKey('devices.serial_number'), nullable=False)
     software_version = Column(String)
     cum_operating_time = Column(Time, nullable=False, default=datetime.time.min)
@@ -97,6 +101,7 @@ class DeviceInfo(GarminDB.Base, utilities.DbObject):
 
     __table_args__ = (
         PrimaryKeyConstraint('timestamp', 'serial_number'),
+        Index('device_info_serial_number_timestamp', 'serial_number', 'timestamp'),
     )
 
     @classmethod
@@ -121,13 +126,15 @@ class DeviceInfo(GarminDB.Base, utilities.DbObject):
         cls.create_join_view(db, cls._get_default_view_name(), cols, Device, order_by=cls.timestamp.desc())
 
 
-class File(GarminDB.Base, utilities.DbObject):
+class File(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a data file."""
 
     __tablename__ = 'files'
 
     db = GarminDB
-    table_version = 3
+    table_version = 4
+    # The type index was added.
+    table_migrations = {3 : HealthDB.SchemaMigrations.create_indexes()}
     view_version = 4
 
     fit_file_types_prefix = 'fit_'
@@ -135,7 +142,7 @@ class File(GarminDB.Base, utilities.DbObject):
 
     id = Column(String, primary_key=True)
     name = Column(String, unique=True)
-    type = Column(Enum(FileType), nullable=False)
+    type = Column(Enum(FileType), nullable=False, index=True)
     serial_number = Column(Integer, ForeignKey('devices.serial_number'))
 
     @classmethod
@@ -175,53 +182,54 @@ class File(GarminDB.Base, utilities.DbObject):
         return id
 
 
-class Weight(GarminDB.Base, utilities.DbObject):
+class Weight(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a weight entry."""
 
     __tablename__ = 'weight'
 
     db = GarminDB
     table_version = 1
+    marks_dirty_days = True
 
     day = Column(Date, primary_key=True)
     weight = Column(Float, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'weight_avg': cls.s_get_col_avg(session, cls.weight, start_ts, end_ts, True),
-            'weight_min': cls.s_get_col_min(session, cls.weight, start_ts, end_ts, True),
-            'weight_max': cls.s_get_col_max(session, cls.weight, start_ts, end_ts)
+            'weight_avg': (cls.weight, 'avg', True),
+            'weight_min': (cls.weight, 'min', True),
+            'weight_max': (cls.weight, 'max')
         }
 
 
-class Stress(GarminDB.Base, utilities.DbObject):
+class Stress(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a stress reading."""
 
     __tablename__ = 'stress'
 
     db = GarminDB
     table_version = 1
+    marks_dirty_days = True
 
     timestamp = Column(DateTime, primary_key=True, unique=True)
     stress = Column(Integer, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
-        return {
-            'stress_avg': cls.s_get_col_avg(session, cls.stress, start_ts, end_ts, True),
-        }
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
+        return {'stress_avg': (cls.stress, 'avg', True)}
 
 
-class Sleep(GarminDB.Base, utilities.DbObject):
+class Sleep(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a sleep session."""
 
     __tablename__ = 'sleep'
 
     db = GarminDB
     table_version = 1
+    marks_dirty_days = True
 
     day = Column(Date, primary_key=True)
     start = Column(DateTime)
@@ -233,19 +241,19 @@ class Sleep(GarminDB.Base, utilities.DbObject):
     awake = Column(Time, nullable=False, default=datetime.time.min)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'sleep_avg'     : cls.s_get_time_col_avg(session, cls.total_sleep, start_ts, end_ts),
-            'sleep_min'     : cls.s_get_time_col_min(session, cls.total_sleep, start_ts, end_ts),
-            'sleep_max'     : cls.s_get_time_col_max(session, cls.total_sleep, start_ts, end_ts),
-            'rem_sleep_avg' : cls.s_get_time_col_avg(session, cls.rem_sleep, start_ts, end_ts),
-            'rem_sleep_min' : cls.s_get_time_col_min(session, cls.rem_sleep, start_ts, end_ts),
-            'rem_sleep_max' : cls.s_get_time_col_max(session, cls.rem_sleep, start_ts, end_ts),
+            'sleep_avg'     : (cls.total_sleep, 'time_avg'),
+            'sleep_min'     : (cls.total_sleep, 'time_min'),
+            'sleep_max'     : (cls.total_sleep, 'time_max'),
+            'rem_sleep_avg' : (cls.rem_sleep, 'time_avg'),
+            'rem_sleep_min' : (cls.rem_sleep, 'time_min'),
+            'rem_sleep_max' : (cls.rem_sleep, 'time_max'),
         }
 
 
-class SleepEvents(GarminDB.Base, utilities.DbObject):
+class SleepEvents(GarminDB.Base, HealthDB.UpsertDbObject):
     """Table that stores events recorded druing sleep."""
 
     __tablename__ = 'sleep_events'
@@ -267,35 +275,88 @@ class SleepEvents(GarminDB.Base, utilities.DbObject):
             return values[0][0]
 
 
-class RestingHeartRate(GarminDB.Base, utilities.DbObject):
+class SleepHypnogram(GarminDB.Base, HealthDB.UpsertDbObject):
+    """Table that stores all sleep events for a night in a single compact row."""
+
+    __tablename__ = 'sleep_hypnogram'
+
+    db = GarminDB
+    table_version = 1
+
+    # The index of a stage in this list is the value stored in the stages array.
+    stages = ['unmeasurable', 'deep_sleep', 'light_sleep', 'rem_sleep', 'awake', 'more_awake']
+
+    day = Column(Date, primary_key=True)
+    start = Column(DateTime)
+    # stage indexes as packed uint8
+    stage_array = Column(LargeBinary)
+    # stage durations in seconds as packed uint32
+    duration_array = Column(LargeBinary)
+
+    @classmethod
+    def from_events(cls, day, events):
+        """Return a dict of hypnogram values for a day from a list of sleep event dicts sorted by timestamp."""
+        return {
+            'day'               : day,
+            'start'             : events[0]['timestamp'] if events else None,
+            'stage_array'       : struct.pack(f'<{len(events)}B', *[cls.stages.index(event['event']) for event in events]),
+            'duration_array'    : struct.pack(f'<{len(events)}I', *[int(conversions.time_to_secs(event['duration'])) for event in events]),
+        }
+
+    @classmethod
+    def s_get_events(cls, session, day):
+        """Return the sleep events for a day as a list of (timestamp, stage, duration in seconds) tuples."""
+        hypnogram = cls.s_get(session, day)
+        if hypnogram is None:
+            return []
+        count = len(hypnogram.stage_array)
+        stages = struct.unpack(f'<{count}B', hypnogram.stage_array)
+        durations = struct.unpack(f'<{count}I', hypnogram.duration_array)
+        events = []
+        timestamp = hypnogram.start
+        for stage, duration in zip(stages, durations):
+            events.append((timestamp, cls.stages[stage], duration))
+            timestamp += datetime.timedelta(seconds=duration)
+        return events
+
+    @classmethod
+    def get_events(cls, db, day):
+        """Return the sleep events for a day as a list of (timestamp, stage, duration in seconds) tuples."""
+        with db.managed_session() as session:
+            return cls.s_get_events(session, day)
+
+
+class RestingHeartRate(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a daily resting heart rate reading."""
 
     __tablename__ = 'resting_hr'
 
     db = GarminDB
     table_version = 1
+    marks_dirty_days = True
     _col_units = {'resting_heart_rate': 'bpm'}
 
     day = Column(Date, primary_key=True)
     resting_heart_rate = Column(Float)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'rhr_avg': cls.s_get_col_avg(session, cls.resting_heart_rate, start_ts, end_ts, ignore_le_zero=True),
-            'rhr_min': cls.s_get_col_min(session, cls.resting_heart_rate, start_ts, end_ts, ignore_le_zero=True),
-            'rhr_max': cls.s_get_col_max(session, cls.resting_heart_rate, start_ts, end_ts),
+            'rhr_avg': (cls.resting_heart_rate, 'avg', True),
+            'rhr_min': (cls.resting_heart_rate, 'min', True),
+            'rhr_max': (cls.resting_heart_rate, 'max'),
         }
 
 
-class DailySummary(GarminDB.Base, utilities.DbObject):
+class DailySummary(GarminDB.Base, HealthDB.UpsertDbObject):
     """Class representing a Garmin daily summary."""
 
     __tablename__ = 'daily_summary'
 
     db = GarminDB
     table_version = 4
+    marks_dirty_days = True
     _col_units = {'hr_min': 'bpm', 'hr_max': 'bpm', 'rhr': 'bpm'}
 
     day = Column(Date, primary_key=True)
@@ -374,47 +435,56 @@ class DailySummary(GarminDB.Base, utilities.DbObject):
         return func.round((cls.floors_up * 100) / cls.floors_goal)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'rhr_avg'                   : cls.s_get_col_avg(session, cls.rhr, start_ts, end_ts),
-            'rhr_min'                   : cls.s_get_col_min(session, cls.rhr, start_ts, end_ts),
-            'rhr_max'                   : cls.s_get_col_max(session, cls.rhr, start_ts, end_ts),
-            'stress_avg'                : cls.s_get_col_avg(session, cls.stress_avg, start_ts, end_ts),
-            'steps'                     : cls.s_get_col_sum(session, cls.steps, start_ts, end_ts),
-            'steps_goal'                : cls.s_get_col_sum(session, cls.step_goal, start_ts, end_ts),
-            'floors'                    : cls.s_get_col_sum(session, cls.floors_up, start_ts, end_ts),
-            'floors_goal'               : cls.s_get_col_sum(session, cls.floors_goal, start_ts, end_ts),
-            'intensity_time'            : cls.s_get_time_col_avg(session, cls.intensity_time, start_ts, end_ts),
-            'moderate_activity_time'    : cls.s_get_time_col_avg(session, cls.moderate_activity_time, start_ts, end_ts),
-            'vigorous_activity_time'    : cls.s_get_time_col_sum(session, cls.vigorous_activity_time, start_ts, end_ts),
-            'intensity_time_goal'       : cls.s_get_time_col_avg(session, cls.intensity_time_goal, start_ts, end_ts),
-            'calories_goal'             : cls.s_get_col_sum(session, cls.calories_goal, start_ts, end_ts),
-            'calories_avg'              : cls.s_get_col_avg(session, cls.calories_total, start_ts, end_ts),
-            'calories_bmr_avg'          : cls.s_get_col_avg(session, cls.calories_bmr, start_ts, end_ts),
-            'calories_active_avg'       : cls.s_get_col_avg(session, cls.calories_active, start_ts, end_ts),
-            'calories_consumed_avg'     : cls.s_get_col_avg(session, cls.calories_consumed, start_ts, end_ts),
-            'hydration_goal'            : cls.s_get_col_sum(session, cls.hydration_goal, start_ts, end_ts),
-            'hydration_avg'             : cls.s_get_col_avg(session, cls.hydration_intake, start_ts, end_ts),
-            'hydration_intake'          : cls.s_get_col_sum(session, cls.hydration_intake, start_ts, end_ts),
-            'sweat_loss_avg'            : cls.s_get_col_avg(session, cls.sweat_loss, start_ts, end_ts),
-            'sweat_loss'                : cls.s_get_col_sum(session, cls.sweat_loss, start_ts, end_ts),
-            'spo2_avg'                  : cls.s_get_col_avg(session, cls.spo2_avg, start_ts, end_ts),
-            'spo2_min'                  : cls.s_get_col_min(session, cls.spo2_min, start_ts, end_ts),
-            'rr_waking_avg'             : cls.s_get_col_avg(session, cls.rr_waking_avg, start_ts, end_ts),
-            'rr_max'                    : cls.s_get_col_max(session, cls.rr_max, start_ts, end_ts),
-            'rr_min'                    : cls.s_get_col_min(session, cls.rr_min, start_ts, end_ts),
+            'rhr_avg'                   : (cls.rhr, 'avg'),
+            'rhr_min'                   : (cls.rhr, 'min'),
+            'rhr_max'                   : (cls.rhr, 'max'),
+            'stress_avg'                : (cls.stress_avg, 'avg'),
+            'steps'                     : (cls.steps, 'sum'),
+            'steps_goal'                : (cls.step_goal, 'sum'),
+            'floors'                    : (cls.floors_up, 'sum'),
+            'floors_goal'               : (cls.floors_goal, 'sum'),
+            'intensity_time'            : (cls.intensity_time, 'time_avg'),
+            'moderate_activity_time'    : (cls.moderate_activity_time, 'time_avg'),
+            'vigorous_activity_time'    : (cls.vigorous_activity_time, 'time_sum'),
+            'intensity_time_goal'       : (cls.intensity_time_goal, 'time_avg'),
+            'calories_goal'             : (cls.calories_goal, 'sum'),
+            'calories_avg'              : (cls.calories_total, 'avg'),
+            'calories_bmr_avg'          : (cls.calories_bmr, 'avg'),
+            'calories_active_avg'       : (cls.calories_active, 'avg'),
+            'calories_consumed_avg'     : (cls.calories_consumed, 'avg'),
+            'hydration_goal'            : (cls.hydration_goal, 'sum'),
+            'hydration_avg'             : (cls.hydration_intake, 'avg'),
+            'hydration_intake'          : (cls.hydration_intake, 'sum'),
+            'sweat_loss_avg'            : (cls.sweat_loss, 'avg'),
+            'sweat_loss'                : (cls.sweat_loss, 'sum'),
+            'spo2_avg'                  : (cls.spo2_avg, 'avg'),
+            'spo2_min'                  : (cls.spo2_min, 'min'),
+            'rr_waking_avg'             : (cls.rr_waking_avg, 'avg'),
+            'rr_max'                    : (cls.rr_max, 'max'),
+            'rr_min'                    : (cls.rr_min, 'min'),
         }
 
     @classmethod
-    def get_daily_stats(cls, session, day_ts):
-        """Return a dictionary of aggregate statistics for the given day."""
-        stats = cls.get_stats(session, day_ts, day_ts + datetime.timedelta(1))
+    def __daily_stats(cls, stats, day_ts):
         # intensity_time_goal is a weekly goal, so the daily value is 1/7 of the weekly goal
-        stats['intensity_time_goal'] = cls._time_from_secs(cls._secs_from_time(stats['intensity_time_goal']) / 7)
+        stats['intensity_time_goal'] = conversions.secs_to_dt_time(int(conversions.time_to_secs(stats['intensity_time_goal']) / 7))
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def get_daily_stats(cls, session, day_ts):
+        """Return a dictionary of aggregate statistics for the given day."""
+        return cls.__daily_stats(cls.get_stats(session, day_ts, day_ts + datetime.timedelta(1)), day_ts)
+
+    @classmethod
+    def s_get_days_stats(cls, session, days):
+        """Return a dict of day to a dictionary of aggregate statistics for each of the days, computed with one query."""
+        days_stats = cls.s_get_col_stats_per_day(session, cls._stats_spec(), days)
+        return {day : cls.__daily_stats(stats, day) for day, stats in days_stats.items()}
+
     @classmethod
     def get_monthly_stats(cls, session, first_day_ts, last_day_ts):
         """Return a dictionary of aggregate statistics for the given month."""
@@ -424,15 +494,16 @@ class DailySummary(GarminDB.Base, utilities.DbObject):
         second_week_end = first_day_ts + datetime.timedelta(14)
         third_week_end = first_day_ts + datetime.timedelta(21)
         fourth_week_end = first_day_ts + datetime.timedelta(28)
+        weeks_spec = {
+            'first_week'    : (cls.intensity_time_goal, 'time_avg', cls.during(first_day_ts, first_week_end)),
+            'second_week'   : (cls.intensity_time_goal, 'time_avg', cls.during(first_week_end, second_week_end)),
+            'third_week'    : (cls.intensity_time_goal, 'time_avg', cls.during(second_week_end, third_week_end)),
+            'fourth_week'   : (cls.intensity_time_goal, 'time_avg', cls.during(third_week_end, fourth_week_end)),
+        }
+        weeks = cls.s_get_col_stats(session, weeks_spec, first_day_ts, fourth_week_end)
         stats['intensity_time_goal'] = Fit.conversions.add_time(
-            Fit.conversions.add_time(
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, first_day_ts, first_week_end),
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, first_week_end, second_week_end)
-            ),
-            Fit.conversions.add_time(
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, second_week_end, third_week_end),
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, third_week_end, fourth_week_end)
-            )
+            Fit.conversions.add_time(weeks['first_week'], weeks['second_week']),
+            Fit.conversions.add_time(weeks['third_week'], weeks['fourth_week'])
         )
         stats['first_day'] = first_day_ts
         return stats
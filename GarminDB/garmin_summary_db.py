@@ -5,16 +5,21 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 import logging
-from sqlalchemy import Column, Integer, Date, DateTime
+import datetime
+import math
+from sqlalchemy import Column, Integer, Float, String, Date, DateTime, and_, func
+from sqlalchemy.orm import aliased
 
+import Fit.conversions as conversions
 import HealthDB
 import utilities
+from GarminDB.activities_db import Activities
 
 
 logger = logging.getLogger(__name__)
 
-GarminSummaryDB = utilities.DB.create('garmin_summary', 8, "Database for storing health summary data from a Garmin device.")
-Summary = utilities.DbObject.create('summary', GarminSummaryDB, 1, base=utilities.KeyValueObject)
+GarminSummaryDB = HealthDB.DbRegistry.create('garmin_summary', 8, "Database for storing health summary data from a Garmin device.")
+Summary = utilities.DbObject.create('summary', GarminSummaryDB, 1, base=HealthDB.UpsertKeyValueObject)
 
 
 class YearsSummary(GarminSummaryDB.Base, HealthDB.SummaryBase):
@@ -57,7 +62,9 @@ class WeeksSummary(GarminSummaryDB.Base, HealthDB.SummaryBase):
     __tablename__ = 'weeks_summary'
 
     db = GarminSummaryDB
-    table_version = 4
+    table_version = 5
+    # Weeks used to start on the day of the year, now they are ISO weeks.
+    table_migrations = {4 : HealthDB.SchemaMigrations.delete_rows()}
     view_version = HealthDB.SummaryBase.view_version
 
     first_day = Column(Date, primary_key=True)
@@ -68,24 +75,133 @@ class WeeksSummary(GarminSummaryDB.Base, HealthDB.SummaryBase):
         cls.create_weeks_view(db)
 
 
+def _add_days_summary_counts(connection, table_object):
+    # Rows saved before don't have counts, drop them so that the summaries are regenerated in full.
+    HealthDB.SchemaMigrations.add_columns('hr_count', 'inactive_hr_count')(connection, table_object)
+    connection.execute(table_object.__table__.delete())
+
+
 class DaysSummary(GarminSummaryDB.Base, HealthDB.SummaryBase):
-    """A table holding summarized data with one row per day."""
+    """A table holding summarized data with one row per day. Weeks, months, and years are rolled up from it."""
 
     __tablename__ = 'days_summary'
 
     db = GarminSummaryDB
-    table_version = 4
+    table_version = 6
+    # Stress averages were weighted by a count that mixed days and readings, now they are weighted by days.
+    table_migrations = {4 : _add_days_summary_counts, 5 : HealthDB.SchemaMigrations.copy_table()}
     view_version = HealthDB.SummaryBase.view_version
 
     day = Column(Date, primary_key=True)
+    # The number of values the averages from tables with many rows per day are over.
+    hr_count = Column(Integer)
+    inactive_hr_count = Column(Integer)
+
+    # How the values of the days combine into the values of longer periods. Averages are weighted by the count column, if
+    # they have one, or else by the days that have a value. Like the time aggregates, time columns ignore zero times.
+    rollup_spec = {
+        'hr_avg'                    : ('avg', 'hr_count'),
+        'hr_min'                    : ('min', None),
+        'hr_max'                    : ('max', None),
+        'rhr_avg'                   : ('avg', None),
+        'rhr_min'                   : ('min', None),
+        'rhr_max'                   : ('max', None),
+        'inactive_hr_avg'           : ('avg', 'inactive_hr_count'),
+        'inactive_hr_min'           : ('min', None),
+        'inactive_hr_max'           : ('max', None),
+        'weight_avg'                : ('avg', None),
+        'weight_min'                : ('min', None),
+        'weight_max'                : ('max', None),
+        'intensity_time'            : ('time_sum', None),
+        'moderate_activity_time'    : ('time_sum', None),
+        'vigorous_activity_time'    : ('time_sum', None),
+        'intensity_time_goal'       : ('time_sum', None),
+        'steps'                     : ('sum', None),
+        'steps_goal'                : ('sum', None),
+        'floors'                    : ('sum', None),
+        'floors_goal'               : ('sum', None),
+        'sleep_avg'                 : ('time_avg', None),
+        'sleep_min'                 : ('time_min', None),
+        'sleep_max'                 : ('time_max', None),
+        'rem_sleep_avg'             : ('time_avg', None),
+        'rem_sleep_min'             : ('time_min', None),
+        'rem_sleep_max'             : ('time_max', None),
+        'stress_avg'                : ('avg', None),
+        'calories_avg'              : ('avg', None),
+        'calories_bmr_avg'          : ('avg', None),
+        'calories_active_avg'       : ('avg', None),
+        'calories_goal'             : ('sum', None),
+        'calories_consumed_avg'     : ('avg', None),
+        'activities'                : ('count', None),
+        'activities_calories'       : ('sum', None),
+        'activities_distance'       : ('sum', None),
+        'hydration_goal'            : ('sum', None),
+        'hydration_avg'             : ('avg', None),
+        'hydration_intake'          : ('sum', None),
+        'sweat_loss_avg'            : ('avg', None),
+        'sweat_loss'                : ('sum', None),
+        'spo2_avg'                  : ('avg', None),
+        'spo2_min'                  : ('min', None),
+        'rr_waking_avg'             : ('avg', None),
+        'rr_max'                    : ('max', None),
+        'rr_min'                    : ('min', None),
+    }
 
     @classmethod
     def create_view(cls, db):
         """Create the default database view for the table."""
         cls.create_days_view(db)
 
+    @classmethod
+    def s_get_days_values(cls, session, first_day, end_day):
+        """Return a dict of day to a dict of the column values of the rows from first_day up to, but not including, end_day."""
+        rows = session.query(cls).filter(cls.day >= first_day).filter(cls.day < end_day).all()
+        return {row.day : {col_name : getattr(row, col_name) for col_name in cls.col_names} for row in rows}
 
-class IntensityHR(GarminSummaryDB.Base, utilities.DbObject):
+    @classmethod
+    def __rollup_value(cls, aggregate, weighted_values):
+        # weighted_values is a list of (value, count) tuples for the days that have a value.
+        if aggregate.startswith('time_'):
+            weighted_values = [(conversions.time_to_secs(value), count) for value, count in weighted_values if conversions.time_to_secs(value) > 0]
+            secs = cls.__rollup_value(aggregate[len('time_'):], weighted_values)
+            return conversions.secs_to_dt_time(int(secs)) if secs is not None else datetime.time.min
+        if aggregate == 'avg':
+            weighted_values = [(value, count) for value, count in weighted_values if count]
+        if not weighted_values:
+            return 0 if aggregate == 'count' else None
+        values = [value for value, _ in weighted_values]
+        if aggregate in ['sum', 'count']:
+            return sum(values)
+        if aggregate == 'min':
+            return min(values)
+        if aggregate == 'max':
+            return max(values)
+        return sum([value * count for value, count in weighted_values]) / sum([count for _, count in weighted_values])
+
+    @classmethod
+    def rollup(cls, days_values, first_day, end_day):
+        """
+        Return a dict of the summary values of the period from first_day up to, but not including, end_day.
+
+        Parameters:
+        ----------
+            days_values (dict): day to a dict of the values of a DaysSummary row, days without data can be left out
+            first_day (date): the first day of the period, a week, month, or year
+            end_day (date): the day after the period
+
+        """
+        period_days = [days_values[day] for day in (first_day + datetime.timedelta(index) for index in range((end_day - first_day).days)) if day in days_values]
+        values = {'first_day' : first_day}
+        for col_name, (aggregate, count_col_name) in cls.rollup_spec.items():
+            weighted_values = [
+                (day_values[col_name], day_values.get(count_col_name, 1) if count_col_name else 1)
+                for day_values in period_days if day_values.get(col_name) is not None
+            ]
+            values[col_name] = cls.__rollup_value(aggregate, weighted_values)
+        return values
+
+
+class IntensityHR(GarminSummaryDB.Base, HealthDB.UpsertDbObject):
     """Monitoring heart rate values that fall within a intensity period."""
 
     __tablename__ = 'intensity_hr'
@@ -98,10 +214,271 @@ class IntensityHR(GarminSummaryDB.Base, utilities.DbObject):
     heart_rate = Column(Integer, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
+        inactive = and_(cls.intensity == 0, cls.heart_rate > 0)
         return {
-            'inactive_hr_avg' : cls.s_get_col_avg_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
-            'inactive_hr_min' : cls.s_get_col_min_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
-            'inactive_hr_max' : cls.s_get_col_max_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
+            'inactive_hr_avg'   : (cls.heart_rate, 'avg', inactive),
+            'inactive_hr_min'   : (cls.heart_rate, 'min', inactive),
+            'inactive_hr_max'   : (cls.heart_rate, 'max', inactive),
+            'inactive_hr_count' : (cls.heart_rate, 'count', inactive),
         }
+
+
+class DirtyDays(GarminSummaryDB.Base, HealthDB.UpsertDbObject):
+    """A table holding the days that data was imported for since the summaries were last generated."""
+
+    __tablename__ = 'dirty_days'
+
+    db = GarminSummaryDB
+    table_version = 1
+
+    day = Column(Date, primary_key=True)
+
+    @classmethod
+    def __save_days(cls, db, days):
+        logger.info("Marking %d days for summary regeneration", len(days))
+        cls.insert_or_update_many(db, [{'day' : day} for day in days])
+
+    @classmethod
+    def save(cls, db):
+        """Save the days recorded by DirtyDayRecorder and forget them."""
+        days = HealthDB.DirtyDayRecorder.days()
+        if days:
+            cls.__save_days(db, days)
+        HealthDB.DirtyDayRecorder.clear()
+
+    @classmethod
+    def saving(cls, db):
+        """Return a context that saves the days recorded by DirtyDayRecorder as the data they are for is committed, so that a failed import keeps them."""
+        return HealthDB.DirtyDayRecorder.save_on_commit(lambda days: cls.__save_days(db, days))
+
+    @classmethod
+    def get_dirty_days(cls, db):
+        """Return the days whose summaries need to be regenerated in order."""
+        with db.managed_session() as session:
+            return [row[0] for row in session.query(cls.day).order_by(cls.day).all()]
+
+    @classmethod
+    def delete_days(cls, db, days=None):
+        """Delete the given days, or all days if none are given, once their summaries have been regenerated."""
+        with db.managed_session() as session:
+            if days is None:
+                session.query(cls).delete(synchronize_session=False)
+                return
+            days = list(days)
+            for start in range(0, len(days), cls.max_statement_variables):
+                session.query(cls).filter(cls.day.in_(days[start:start + cls.max_statement_variables])).delete(synchronize_session=False)
+
+
+class Coverage(GarminSummaryDB.Base, HealthDB.UpsertDbObject):
+    """A table holding the runs of consecutive days that tables of source data have rows for."""
+
+    __tablename__ = 'coverage'
+
+    db = GarminSummaryDB
+    table_version = 1
+
+    table_name = Column(String, primary_key=True)
+    first_day = Column(Date, primary_key=True)
+    last_day = Column(Date, nullable=False)
+    days = Column(Integer, nullable=False)
+
+    @classmethod
+    def update(cls, db, source_db, table_object):
+        """Replace the runs saved for a table with its current runs of days, found with one query of the table."""
+        runs = table_object.get_day_runs(source_db)
+        with db.managed_session() as session:
+            session.query(cls).filter(cls.table_name == table_object.__tablename__).delete(synchronize_session=False)
+            cls.s_insert_or_update_many(session, [
+                {'table_name' : table_object.__tablename__, 'first_day' : first_day, 'last_day' : last_day, 'days' : days} for first_day, last_day, days in runs
+            ])
+
+    @classmethod
+    def get_runs(cls, db, table_object, year=None):
+        """Return a list of (first_day, last_day) tuples, in order, for the runs of days a table has rows for, limited to a year if given."""
+        with db.managed_session() as session:
+            rows = session.query(cls.first_day, cls.last_day).filter(cls.table_name == table_object.__tablename__).order_by(cls.first_day).all()
+        if year is None:
+            return [(first_day, last_day) for first_day, last_day in rows]
+        first_of_year = datetime.date(year, 1, 1)
+        last_of_year = datetime.date(year, 12, 31)
+        return [(max(first_day, first_of_year), min(last_day, last_of_year)) for first_day, last_day in rows if first_day <= last_of_year and last_day >= first_of_year]
+
+    @classmethod
+    def get_gaps(cls, db, table_object, year=None):
+        """Return a list of (first_day, last_day) tuples, in order, for the runs of days missing between the days a table has rows for."""
+        runs = cls.get_runs(db, table_object, year)
+        return [(previous_run[1] + datetime.timedelta(1), next_run[0] - datetime.timedelta(1)) for previous_run, next_run in zip(runs, runs[1:])]
+
+    @classmethod
+    def get_month_days(cls, db, table_object):
+        """Return a dict, in order, of the first day of each month a table has rows for to the number of days in the month with rows."""
+        month_days = {}
+        for first_day, last_day in cls.get_runs(db, table_object):
+            while first_day <= last_day:
+                month = first_day.replace(day=1)
+                next_month = (month + datetime.timedelta(32)).replace(day=1)
+                month_last_day = min(last_day, next_month - datetime.timedelta(1))
+                month_days[month] = month_days.get(month, 0) + (month_last_day - first_day).days + 1
+                first_day = next_month
+        return month_days
+
+
+class TrainingLoad(GarminSummaryDB.Base, HealthDB.UpsertDbObject):
+    """A table holding the daily training load from activities and its acute (ATL) and chronic (CTL) exponentially weighted averages."""
+
+    __tablename__ = 'training_load'
+
+    db = GarminSummaryDB
+    table_version = 1
+
+    # Time constants, in days, of the acute and chronic training load averages.
+    atl_days = 7
+    ctl_days = 42
+    # Gaps between records, like pauses, count toward TRIMP for no longer than this.
+    max_record_interval = datetime.timedelta(minutes=1)
+    # The load per point of training effect for activities without heart rate records.
+    training_effect_load = 25.0
+
+    day = Column(Date, primary_key=True)
+    activities = Column(Integer, nullable=False)
+    load = Column(Float, nullable=False)
+    atl = Column(Float, nullable=False)
+    ctl = Column(Float, nullable=False)
+    # training stress balance, ctl - atl
+    tsb = Column(Float, nullable=False)
+
+    @classmethod
+    def trimp(cls, hr_records, resting_hr, max_hr):
+        """Return Banister's TRIMP for a list of (timestamp, hr) tuples, in order of time, from an activity."""
+        trimp = 0.0
+        for (timestamp, hr), (next_timestamp, _) in zip(hr_records, hr_records[1:]):
+            minutes = min(next_timestamp - timestamp, cls.max_record_interval).total_seconds() / 60
+            hr_reserve = min(max((hr - resting_hr) / (max_hr - resting_hr), 0.0), 1.0)
+            trimp += minutes * hr_reserve * 0.64 * math.exp(1.92 * hr_reserve)
+        return trimp
+
+    @classmethod
+    def __s_get_day_loads(cls, act_session, start_day, resting_hr, max_hr):
+        # A dict of day to the summed load and the number of activities for the days with activities since a day.
+        start_ts = datetime.datetime.combine(start_day, datetime.time.min)
+        activities_hr_records = {}
+        for activity_id, timestamp, hr in Activities.s_get_hr_records(act_session, start_ts):
+            activities_hr_records.setdefault(activity_id, []).append((timestamp, hr))
+        day_loads = {}
+        for activity_id, start_time, training_effect in Activities.s_get_started_since(act_session, start_ts):
+            hr_records = activities_hr_records.get(activity_id, [])
+            if len(hr_records) > 1:
+                load = cls.trimp(hr_records, resting_hr, max_hr)
+            else:
+                load = (training_effect or 0.0) * cls.training_effect_load
+            day_load, day_activities = day_loads.get(start_time.date(), (0.0, 0))
+            day_loads[start_time.date()] = (day_load + load, day_activities + 1)
+        return day_loads
+
+    @classmethod
+    def update(cls, db, act_db, first_day=None, end_day=None, resting_hr=60, max_hr=185):
+        """
+        Update the training load from the first day with new activities, or for all days if not given, through end_day or today.
+
+        The saved days before the first day are kept and the averages of the last of them are carried forward, so only the
+        activities since the first day are read.
+        """
+        with db.managed_session() as session:
+            previous = None if first_day is None else session.query(cls).filter(cls.day < first_day).order_by(cls.day.desc()).first()
+            if previous is None:
+                start_day, atl, ctl = datetime.date.min, 0.0, 0.0
+            else:
+                start_day, atl, ctl = previous.day + datetime.timedelta(1), previous.atl, previous.ctl
+            with act_db.managed_session() as act_session:
+                day_loads = cls.__s_get_day_loads(act_session, start_day, resting_hr, max_hr)
+            session.query(cls).filter(cls.day >= start_day).delete(synchronize_session=False)
+            if previous is None:
+                if not day_loads:
+                    return
+                start_day = min(day_loads)
+            end_day = max([end_day or datetime.date.today()] + list(day_loads))
+            atl_weight = 1.0 - math.exp(-1.0 / cls.atl_days)
+            ctl_weight = 1.0 - math.exp(-1.0 / cls.ctl_days)
+            rows = []
+            for days in range((end_day - start_day).days + 1):
+                day = start_day + datetime.timedelta(days)
+                load, activities = day_loads.get(day, (0.0, 0))
+                atl += (load - atl) * atl_weight
+                ctl += (load - ctl) * ctl_weight
+                rows.append({'day' : day, 'activities' : activities, 'load' : load, 'atl' : atl, 'ctl' : ctl, 'tsb' : ctl - atl})
+            logger.info("Updating training load for %d days from %s", len(rows), start_day)
+            cls.s_insert_or_update_many(session, rows)
+
+
+class Calendar(GarminSummaryDB.Base, HealthDB.UpsertDbObject):
+    """A table of days and the periods, ISO week, month, quarter, and year, that each day belongs to."""
+
+    __tablename__ = 'calendar'
+
+    db = GarminSummaryDB
+    table_version = 1
+
+    # The column with the first day of the period for each of the periods that summaries are rolled up for.
+    period_cols = {
+        'weeks'     : 'week_start',
+        'months'    : 'month_start',
+        'years'     : 'year_start'
+    }
+
+    day = Column(Date, primary_key=True)
+    year = Column(Integer, nullable=False)
+    quarter = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    day_of_year = Column(Integer, nullable=False)
+    iso_year = Column(Integer, nullable=False)
+    iso_week = Column(Integer, nullable=False)
+    # the Monday that the ISO week starts on
+    week_start = Column(Date, nullable=False, index=True)
+    month_start = Column(Date, nullable=False, index=True)
+    year_start = Column(Date, nullable=False, index=True)
+
+    @classmethod
+    def __day_values(cls, day):
+        iso_year, iso_week, iso_weekday = day.isocalendar()
+        return {
+            'day'           : day,
+            'year'          : day.year,
+            'quarter'       : (day.month - 1) // 3 + 1,
+            'month'         : day.month,
+            'day_of_year'   : day.timetuple().tm_yday,
+            'iso_year'      : iso_year,
+            'iso_week'      : iso_week,
+            'week_start'    : day - datetime.timedelta(iso_weekday - 1),
+            'month_start'   : day.replace(day=1),
+            'year_start'    : day.replace(month=1, day=1)
+        }
+
+    @classmethod
+    def s_update(cls, session, first_day, last_day):
+        """Add the days from first_day through last_day, extended to whole years and ISO weeks, that the table doesn't have yet."""
+        first_day = datetime.date(first_day.year, 1, 1)
+        first_day -= datetime.timedelta(first_day.weekday())
+        last_day = datetime.date(last_day.year, 12, 31)
+        last_day += datetime.timedelta(6 - last_day.weekday())
+        saved_first_day, saved_last_day = session.query(func.min(cls.day), func.max(cls.day)).one()
+        if saved_first_day is not None:
+            # Keep the days contiguous so that the last day of each period is in the table.
+            first_day = min(first_day, saved_first_day)
+            last_day = max(last_day, saved_last_day)
+        days = [first_day + datetime.timedelta(index) for index in range((last_day - first_day).days + 1)]
+        if saved_first_day is not None:
+            days = [day for day in days if day < saved_first_day or day > saved_last_day]
+        if days:
+            logger.info("Adding %d days to the calendar", len(days))
+            cls.s_insert_or_update_many(session, [cls.__day_values(day) for day in days])
+
+    @classmethod
+    def s_get_periods(cls, session, period, days_query):
+        """Return a list of (first_day, end_day) tuples, in order, for the weeks, months, or years that contain the days a query returns."""
+        period_col = getattr(cls, cls.period_cols[period])
+        days = aliased(cls)
+        first_days_query = session.query(getattr(days, cls.period_cols[period])).filter(days.day.in_(days_query))
+        rows = session.query(period_col, func.max(cls.day)).filter(period_col.in_(first_days_query)).group_by(period_col).order_by(period_col).all()
+        return [(first_day, last_day + datetime.timedelta(1)) for first_day, last_day in rows]
@@ -7,19 +7,48 @@ __license__ = "GPL"
 
 import logging
 import datetime
-from sqlalchemy import Column, Integer, DateTime, Time, Float, Enum, FLOAT, UniqueConstraint, PrimaryKeyConstraint
+import re
+from sqlalchemy import Column, Integer, DateTime, Time, Float, Enum, FLOAT, UniqueConstraint, PrimaryKeyConstraint, MetaData, Table, func, select, text, and_
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import Fit
-import utilities
+import HealthDB
 
 
 logger = logging.getLogger(__name__)
 
-MonitoringDB = utilities.DB.create('garmin_monitoring', 6, "Database for storing daily health monitoring data from a Garmin device.")
+MonitoringDB = HealthDB.DbRegistry.create('garmin_monitoring', 6, "Database for storing daily health monitoring data from a Garmin device.")
 
 
-class MonitoringInfo(MonitoringDB.Base, utilities.DbObject):
+class MonitoringPartitioned(HealthDB.UpsertDbObject):
+    """Base class for minute level monitoring tables that can be split into one table per year."""
+
+    @classmethod
+    def _s_upsert_table(cls, session, values):
+        if MonitoringPartitions.s_is_partitioned(session, cls):
+            return MonitoringPartitions.s_get_partition(session, cls, values['timestamp'].year)
+        return cls.__table__
+
+    @classmethod
+    def _s_insert_or_update_fallback(cls, session, values_dict, ignore_none, ignore_zero):
+        if not MonitoringPartitions.s_is_partitioned(session, cls):
+            return super()._s_insert_or_update_fallback(session, values_dict, ignore_none, ignore_zero)
+        # The table is a view that the ORM can't write to, find and update or insert the row in the year's partition instead.
+        table = cls._s_upsert_table(session, values_dict)
+        values = {key : value for key, value in values_dict.items() if key in table.columns and not (ignore_none and value is None)}
+        primary_key_names = cls._primary_key_names()
+        # Missing primary key values match NULL like they do for the ORM.
+        key_match = and_(*[table.columns[name] == values_dict.get(name) for name in primary_key_names])
+        session.flush()
+        if session.execute(select([table.columns[primary_key_names[0]]]).where(key_match)).first() is None:
+            session.execute(table.insert().values(values))
+            return
+        update_values = {key : value for key, value in values.items() if key not in primary_key_names and not (ignore_zero and value == 0)}
+        if update_values:
+            session.execute(table.update().where(key_match).values(update_values))
+
+
+class MonitoringInfo(MonitoringDB.Base, HealthDB.UpsertDbObject):
     """Class representing data from a health monitoring file."""
 
     __tablename__ = 'monitoring_info'
@@ -49,34 +78,38 @@ class MonitoringInfo(MonitoringDB.Base, utilities.DbObject):
         return cls.get_col_avg_of_max_per_day(db, cls.resting_metabolic_rate, day_ts, day_ts + datetime.timedelta(1))
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
-        stats = {
-            'calories_bmr_avg' : cls.s_get_col_avg(session, cls.resting_metabolic_rate, start_ts, end_ts),
-        }
-        return stats
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
+        return {'calories_bmr_avg' : (cls.resting_metabolic_rate, 'avg')}
 
 
-class MonitoringHeartRate(MonitoringDB.Base, utilities.DbObject):
+class MonitoringHeartRate(MonitoringDB.Base, MonitoringPartitioned):
     """Class that reprsents a database table holding resting heart rate data."""
 
     __tablename__ = 'monitoring_hr'
 
     db = MonitoringDB
     table_version = 1
+    marks_dirty_days = True
 
     timestamp = Column(DateTime, primary_key=True)
     heart_rate = Column(Integer, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'hr_avg' : cls.s_get_col_avg(session, cls.heart_rate, start_ts, end_ts, True),
-            'hr_min' : cls.s_get_col_min(session, cls.heart_rate, start_ts, end_ts, True),
-            'hr_max' : cls.s_get_col_max(session, cls.heart_rate, start_ts, end_ts),
+            'hr_avg'    : (cls.heart_rate, 'avg', True),
+            'hr_min'    : (cls.heart_rate, 'min', True),
+            'hr_max'    : (cls.heart_rate, 'max'),
+            'hr_count'  : (cls.heart_rate, 'count', True),
         }
 
+    @classmethod
+    def s_get_heart_rates(cls, session, start_ts, end_ts):
+        """Return (timestamp, heart_rate) tuples in time order for the time period."""
+        return session.query(cls.timestamp, cls.heart_rate).filter(cls.during(start_ts, end_ts)).order_by(cls.timestamp).all()
+
     @classmethod
     def get_resting_heartrate(cls, db, wake_ts):
         """Return a resting heart rate value for the day specified."""
@@ -84,13 +117,14 @@ class MonitoringHeartRate(MonitoringDB.Base, utilities.DbObject):
         return cls.get_col_min(db, cls.heart_rate, start_ts, wake_ts, True)
 
 
-class MonitoringIntensity(MonitoringDB.Base, utilities.DbObject):
+class MonitoringIntensity(MonitoringDB.Base, MonitoringPartitioned):
     """Class representing monitoring data about cardio minutes."""
 
     __tablename__ = 'monitoring_intensity'
 
     db = MonitoringDB
     table_version = 1
+    marks_dirty_days = True
 
     timestamp = Column(DateTime, primary_key=True)
     moderate_activity_time = Column(Time, nullable=False, default=datetime.time.min)
@@ -110,22 +144,23 @@ class MonitoringIntensity(MonitoringDB.Base, utilities.DbObject):
         return cls._time_from_secs(2 * cls._secs_from_time(cls.vigorous_activity_time) + cls._secs_from_time(cls.moderate_activity_time))
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'intensity_time'            : cls.s_get_time_col_sum(session, cls.intensity_time, start_ts, end_ts),
-            'moderate_activity_time'    : cls.s_get_time_col_sum(session, cls.moderate_activity_time, start_ts, end_ts),
-            'vigorous_activity_time'    : cls.s_get_time_col_sum(session, cls.vigorous_activity_time, start_ts, end_ts),
+            'intensity_time'            : (cls.intensity_time, 'time_sum'),
+            'moderate_activity_time'    : (cls.moderate_activity_time, 'time_sum'),
+            'vigorous_activity_time'    : (cls.vigorous_activity_time, 'time_sum'),
         }
 
 
-class MonitoringClimb(MonitoringDB.Base, utilities.DbObject):
+class MonitoringClimb(MonitoringDB.Base, MonitoringPartitioned):
     """Class representing monitoring data about elvation gained."""
 
     __tablename__ = 'monitoring_climb'
 
     db = MonitoringDB
     table_version = 1
+    marks_dirty_days = True
 
     feet_to_floors = 10
     meters_to_floors = 3
@@ -142,9 +177,7 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DbObject):
     )
 
     @classmethod
-    def get_stats(cls, session, func, start_ts, end_ts, measurement_system):
-        """Return a dict of stats for table entries within the time span."""
-        cum_ascent = func(session, cls.cum_ascent, start_ts, end_ts)
+    def __floors_stats(cls, cum_ascent, measurement_system):
         if cum_ascent:
             if measurement_system is Fit.field_enums.DisplayMeasure.metric:
                 floors = cum_ascent / cls.feet_to_floors
@@ -154,6 +187,11 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DbObject):
             floors = 0
         return {'floors' : floors}
 
+    @classmethod
+    def get_stats(cls, session, func, start_ts, end_ts, measurement_system):
+        """Return a dict of stats for table entries within the time span."""
+        return cls.__floors_stats(func(session, cls.cum_ascent, start_ts, end_ts), measurement_system)
+
     @classmethod
     def get_daily_stats(cls, session, day_ts, measurement_system):
         """Return a dict of stats for table entries for the given day."""
@@ -161,6 +199,12 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DbObject):
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def s_get_days_stats(cls, session, days, measurement_system):
+        """Return a dict of day to a dict of stats for each of the days, computed with one query."""
+        days_stats = cls.s_get_col_stats_per_day(session, {'cum_ascent' : (cls.cum_ascent, 'max')}, days)
+        return {day : dict(cls.__floors_stats(stats['cum_ascent'], measurement_system), day=day) for day, stats in days_stats.items()}
+
     @classmethod
     def get_weekly_stats(cls, session, first_day_ts, measurement_system):
         """Return a dict of stats for table entries for the week day."""
@@ -179,18 +223,19 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DbObject):
     def get_yearly_stats(cls, session, year, measurement_system):
         """Return a dict of stats for table entries for the year."""
         first_day_ts = datetime.datetime(year, 1, 1)
-        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, first_day_ts + datetime.timedelta(365), measurement_system)
+        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, datetime.datetime(year + 1, 1, 1), measurement_system)
         stats['first_day'] = first_day_ts
         return stats
 
 
-class Monitoring(MonitoringDB.Base, utilities.DbObject):
+class Monitoring(MonitoringDB.Base, MonitoringPartitioned):
     """A table containing monitoring data."""
 
     __tablename__ = 'monitoring'
 
     db = MonitoringDB
     table_version = 2
+    marks_dirty_days = True
 
     timestamp = Column(DateTime, nullable=False)
     activity_type = Column(Enum(Fit.field_enums.ActivityType))
@@ -205,11 +250,19 @@ class Monitoring(MonitoringDB.Base, utilities.DbObject):
 
     __table_args__ = (PrimaryKeyConstraint("timestamp", "activity_type"),)
 
+    # the activity types whose active calories are counted in calories_active_avg
+    active_calories_types = [Fit.field_enums.ActivityType.running, Fit.field_enums.ActivityType.cycling, Fit.field_enums.ActivityType.walking]
+
     @classmethod
     def s_get_from_dict(cls, session, values_dict):
         """Return a single DeviceInfo instance for the given id."""
         return session.query(cls).filter(cls.timestamp == values_dict['timestamp']).filter(cls.activity_type == values_dict['activity_type']).one_or_none()
 
+    @classmethod
+    def s_get_intensities(cls, session, start_ts, end_ts):
+        """Return (timestamp, intensity) tuples in time order for the rows in the time period that have an intensity."""
+        return session.query(cls.timestamp, cls.intensity).filter(cls.during(start_ts, end_ts)).filter(cls.intensity.isnot(None)).order_by(cls.timestamp).all()
+
     @classmethod
     def get_active_calories(cls, session, activity_type, start_ts, end_ts):
         """Return the total calories burned during activity during the indicated period."""
@@ -221,11 +274,7 @@ class Monitoring(MonitoringDB.Base, utilities.DbObject):
         """Return a dict of stats for table entries within the time span."""
         return {
             'steps': func(session, cls.steps, start_ts, end_ts),
-            'calories_active_avg': (
-                cls.get_active_calories(session, Fit.field_enums.ActivityType.running, start_ts, end_ts)
-                + cls.get_active_calories(session, Fit.field_enums.ActivityType.cycling, start_ts, end_ts)
-                + cls.get_active_calories(session, Fit.field_enums.ActivityType.walking, start_ts, end_ts)
-            )
+            'calories_active_avg': sum([cls.get_active_calories(session, activity_type, start_ts, end_ts) for activity_type in cls.active_calories_types])
         }
 
     @classmethod
@@ -235,6 +284,22 @@ class Monitoring(MonitoringDB.Base, utilities.DbObject):
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def s_get_days_stats(cls, session, days):
+        """Return a dict of day to a dict of stats for each of the days, computed with one query."""
+        stats_spec = {'steps' : (cls.steps, 'max')}
+        for activity_type in cls.active_calories_types:
+            stats_spec[activity_type.name] = (cls.active_calories, 'max', cls.activity_type == activity_type)
+        days_stats = cls.s_get_col_stats_per_day(session, stats_spec, days)
+        return {
+            day : {
+                'day'                   : day,
+                'steps'                 : stats['steps'],
+                'calories_active_avg'   : sum([stats[activity_type.name] or 0 for activity_type in cls.active_calories_types])
+            }
+            for day, stats in days_stats.items()
+        }
+
     @classmethod
     def get_weekly_stats(cls, session, first_day_ts):
         """Return a dict of stats for table entries for the given week."""
@@ -250,7 +315,7 @@ class Monitoring(MonitoringDB.Base, utilities.DbObject):
         return stats
 
 
-class MonitoringRespirationRate(MonitoringDB.Base, utilities.DbObject):
+class MonitoringRespirationRate(MonitoringDB.Base, MonitoringPartitioned):
     """Class that represents a database table holding respiration rate measured in breaths per minute."""
 
     __tablename__ = 'monitoring_rr'
@@ -262,16 +327,16 @@ class MonitoringRespirationRate(MonitoringDB.Base, utilities.DbObject):
     rr = Column(Float, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'rr_avg' : cls.s_get_col_avg(session, cls.rr, start_ts, end_ts, True),
-            'rr_min' : cls.s_get_col_min(session, cls.rr, start_ts, end_ts, True),
-            'rr_max' : cls.s_get_col_max(session, cls.rr, start_ts, end_ts),
+            'rr_avg' : (cls.rr, 'avg', True),
+            'rr_min' : (cls.rr, 'min', True),
+            'rr_max' : (cls.rr, 'max'),
         }
 
 
-class MonitoringPulseOx(MonitoringDB.Base, utilities.DbObject):
+class MonitoringPulseOx(MonitoringDB.Base, MonitoringPartitioned):
     """Class that represents a database table holding pulse ox measurements in percent."""
 
     __tablename__ = 'monitoring_pulse_ox'
@@ -283,10 +348,304 @@ class MonitoringPulseOx(MonitoringDB.Base, utilities.DbObject):
     pulse_ox = Column(Float, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
+        """Return the aggregate statistics that get_stats computes."""
         return {
-            'pulse_ox_avg' : cls.s_get_col_avg(session, cls.pulse_ox, start_ts, end_ts, True),
-            'pulse_ox_min' : cls.s_get_col_min(session, cls.pulse_ox, start_ts, end_ts, True),
-            'pulse_ox_max' : cls.s_get_col_max(session, cls.pulse_ox, start_ts, end_ts),
+            'pulse_ox_avg' : (cls.pulse_ox, 'avg', True),
+            'pulse_ox_min' : (cls.pulse_ox, 'min', True),
+            'pulse_ox_max' : (cls.pulse_ox, 'max'),
         }
+
+
+class MonitoringRollup(HealthDB.UpsertDbObject):
+    """Base class for tables holding monitoring data aggregated into fixed size time buckets."""
+
+    # start of the time bucket
+    timestamp = Column(DateTime, primary_key=True)
+    hr_min = Column(Integer)
+    hr_max = Column(Integer)
+    hr_avg = Column(Float)
+    hr_count = Column(Integer)
+    # steps taken during the bucket across all activity types
+    steps = Column(Integer)
+    moderate_activity_time = Column(Time, nullable=False, default=datetime.time.min)
+    vigorous_activity_time = Column(Time, nullable=False, default=datetime.time.min)
+    # meters or feet gained or lost during the bucket
+    ascent = Column(Float)
+    descent = Column(Float)
+
+    @hybrid_property
+    def intensity_time(self):
+        """Return the total cardio minutes, moderate and vigorous, with vigorous counted double."""
+        return Fit.conversions.add_time(self.moderate_activity_time, self.vigorous_activity_time, 2)
+
+    @classmethod
+    def bucket(cls, timestamp):
+        """Return the start of the bucket that a timestamp falls in."""
+        day_start = datetime.datetime.combine(timestamp.date(), datetime.time.min)
+        secs = int((timestamp - day_start).total_seconds())
+        return day_start + datetime.timedelta(seconds=(secs - (secs % cls.bucket_secs)))
+
+
+class MonitoringRollup15Min(MonitoringDB.Base, MonitoringRollup):
+    """Monitoring data aggregated into 15 minute buckets."""
+
+    __tablename__ = 'monitoring_rollup_15min'
+
+    db = MonitoringDB
+    table_version = 1
+    bucket_secs = 15 * 60
+
+
+class MonitoringRollupHour(MonitoringDB.Base, MonitoringRollup):
+    """Monitoring data aggregated into hourly buckets."""
+
+    __tablename__ = 'monitoring_rollup_hour'
+
+    db = MonitoringDB
+    table_version = 1
+    bucket_secs = 60 * 60
+
+
+class MonitoringRollupDay(MonitoringDB.Base, MonitoringRollup):
+    """Monitoring data aggregated into daily buckets."""
+
+    __tablename__ = 'monitoring_rollup_day'
+
+    db = MonitoringDB
+    table_version = 1
+    bucket_secs = 24 * 60 * 60
+
+
+class MonitoringRollups(object):
+    """Maintains the monitoring rollup tables from the minute level monitoring tables."""
+
+    tables = [MonitoringRollup15Min, MonitoringRollupHour, MonitoringRollupDay]
+
+    @classmethod
+    def __cumulative_deltas(cls, rows):
+        """Turn (timestamp, key, value) rows with values that are cumulative per key over a day into (timestamp, delta) tuples."""
+        last_values = {}
+        deltas = []
+        for timestamp, key, value in rows:
+            if value is None:
+                continue
+            last_value = last_values.get(key, 0)
+            if value > last_value:
+                deltas.append((timestamp, value - last_value))
+                last_values[key] = value
+        return deltas
+
+    @classmethod
+    def __get_bucket(cls, buckets, bucket_ts):
+        if bucket_ts not in buckets:
+            buckets[bucket_ts] = {
+                'timestamp' : bucket_ts, 'hr_min' : None, 'hr_max' : None, 'hr_sum' : 0, 'hr_count' : 0, 'steps' : 0,
+                'moderate_secs' : 0, 'vigorous_secs' : 0, 'ascent' : 0.0, 'descent' : 0.0
+            }
+        return buckets[bucket_ts]
+
+    @classmethod
+    def __day_rollups(cls, session, day):
+        start_ts = datetime.datetime.combine(day, datetime.time.min)
+        end_ts = start_ts + datetime.timedelta(1)
+        hr_rows = (
+            session.query(MonitoringHeartRate.timestamp, MonitoringHeartRate.heart_rate)
+            .filter(MonitoringHeartRate.timestamp >= start_ts).filter(MonitoringHeartRate.timestamp < end_ts)
+            .filter(MonitoringHeartRate.heart_rate > 0).all()
+        )
+        steps_rows = (
+            session.query(Monitoring.timestamp, Monitoring.activity_type, Monitoring.steps)
+            .filter(Monitoring.timestamp >= start_ts).filter(Monitoring.timestamp < end_ts)
+            .order_by(Monitoring.timestamp).all()
+        )
+        intensity_rows = (
+            session.query(MonitoringIntensity.timestamp, MonitoringIntensity.moderate_activity_time, MonitoringIntensity.vigorous_activity_time)
+            .filter(MonitoringIntensity.timestamp >= start_ts).filter(MonitoringIntensity.timestamp < end_ts).all()
+        )
+        climb_rows = (
+            session.query(MonitoringClimb.timestamp, MonitoringClimb.cum_ascent, MonitoringClimb.cum_descent)
+            .filter(MonitoringClimb.timestamp >= start_ts).filter(MonitoringClimb.timestamp < end_ts)
+            .order_by(MonitoringClimb.timestamp).all()
+        )
+        steps_deltas = cls.__cumulative_deltas(steps_rows)
+        ascent_deltas = cls.__cumulative_deltas([(timestamp, None, cum_ascent) for timestamp, cum_ascent, _ in climb_rows])
+        descent_deltas = cls.__cumulative_deltas([(timestamp, None, cum_descent) for timestamp, _, cum_descent in climb_rows])
+        rollups = {}
+        for table in cls.tables:
+            buckets = {}
+            for timestamp, heart_rate in hr_rows:
+                bucket = cls.__get_bucket(buckets, table.bucket(timestamp))
+                bucket['hr_min'] = heart_rate if bucket['hr_min'] is None else min(bucket['hr_min'], heart_rate)
+                bucket['hr_max'] = heart_rate if bucket['hr_max'] is None else max(bucket['hr_max'], heart_rate)
+                bucket['hr_sum'] += heart_rate
+                bucket['hr_count'] += 1
+            for timestamp, steps in steps_deltas:
+                cls.__get_bucket(buckets, table.bucket(timestamp))['steps'] += steps
+            for timestamp, moderate_activity_time, vigorous_activity_time in intensity_rows:
+                bucket = cls.__get_bucket(buckets, table.bucket(timestamp))
+                bucket['moderate_secs'] += Fit.conversions.time_to_secs(moderate_activity_time) if moderate_activity_time else 0
+                bucket['vigorous_secs'] += Fit.conversions.time_to_secs(vigorous_activity_time) if vigorous_activity_time else 0
+            for timestamp, ascent in ascent_deltas:
+                cls.__get_bucket(buckets, table.bucket(timestamp))['ascent'] += ascent
+            for timestamp, descent in descent_deltas:
+                cls.__get_bucket(buckets, table.bucket(timestamp))['descent'] += descent
+            rollups[table] = [
+                {
+                    'timestamp'                 : bucket['timestamp'],
+                    'hr_min'                    : bucket['hr_min'],
+                    'hr_max'                    : bucket['hr_max'],
+                    'hr_avg'                    : (bucket['hr_sum'] / bucket['hr_count']) if bucket['hr_count'] else None,
+                    'hr_count'                  : bucket['hr_count'],
+                    'steps'                     : bucket['steps'],
+                    'moderate_activity_time'    : Fit.conversions.secs_to_dt_time(bucket['moderate_secs']),
+                    'vigorous_activity_time'    : Fit.conversions.secs_to_dt_time(bucket['vigorous_secs']),
+                    'ascent'                    : bucket['ascent'],
+                    'descent'                   : bucket['descent'],
+                }
+                for bucket in buckets.values()
+            ]
+        return rollups
+
+    @classmethod
+    def s_update(cls, session, days):
+        """Recompute the rollup buckets for the given days from the monitoring tables."""
+        session.flush()
+        for day in sorted(days):
+            start_ts = datetime.datetime.combine(day, datetime.time.min)
+            end_ts = start_ts + datetime.timedelta(1)
+            for table, rows in cls.__day_rollups(session, day).items():
+                session.query(table).filter(table.timestamp >= start_ts).filter(table.timestamp < end_ts).delete(synchronize_session=False)
+                if rows:
+                    session.execute(table.__table__.insert(), rows)
+
+    @classmethod
+    def create_missing(cls, db):
+        """
+        Compute the rollups for the days with monitoring data after the last rolled up day.
+
+        Importing monitoring data keeps the rollups of the days it imports up to date, so this only has work to do for data
+        imported before rollups were supported. Call it before importing so that all of that data is rolled up once.
+        """
+        with db.managed_session() as session:
+            latest_day_ts = session.query(func.max(MonitoringRollupDay.timestamp)).scalar()
+            days = set()
+            for table in [MonitoringHeartRate, Monitoring]:
+                query = session.query(func.date(table.timestamp)).distinct()
+                if latest_day_ts is not None:
+                    query = query.filter(table.timestamp >= latest_day_ts + datetime.timedelta(1))
+                days.update(datetime.datetime.strptime(day, '%Y-%m-%d').date() for (day,) in query.all())
+            cls.s_update(session, days)
+            session.commit()
+
+
+class MonitoringPartitions(object):
+    """Splits the minute level monitoring tables into one table per year behind a UNION ALL view with the original table name."""
+
+    tables = [Monitoring, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, MonitoringRespirationRate, MonitoringPulseOx]
+    metadata = MetaData()
+    # (engine, table name) -> set of years with partitions or None if the table isn't partitioned
+    __partition_years = {}
+
+    @classmethod
+    def partition_name(cls, table, year):
+        """Return the name of a table's partition for a year."""
+        return f'{table.__tablename__}_{year}'
+
+    @classmethod
+    def partition_table(cls, table, year):
+        """Return the Core table for a table's partition for a year."""
+        name = cls.partition_name(table, year)
+        if name not in cls.metadata.tables:
+            Table(name, cls.metadata, *[col.copy() for col in table.__table__.columns])
+            HealthDB.QueryCache.table_aliases[name] = table.__tablename__
+        return cls.metadata.tables[name]
+
+    @classmethod
+    def __s_years(cls, session, table):
+        key = (session.get_bind(), table.__tablename__)
+        if key not in cls.__partition_years:
+            years = None
+            if session.get_bind().dialect.name == 'sqlite':
+                table_type = session.execute(text("SELECT type FROM sqlite_master WHERE name = :name"), {'name' : table.__tablename__}).scalar()
+                if table_type == 'view':
+                    names = session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"), {'prefix' : table.__tablename__ + '_%'})
+                    name_re = re.compile(table.__tablename__ + r'_(\d{4})$')
+                    years = {int(match.group(1)) for match in (name_re.match(name) for (name,) in names) if match}
+            cls.__partition_years[key] = years
+        return cls.__partition_years[key]
+
+    @classmethod
+    def __s_set_years(cls, session, table, years):
+        cls.__partition_years[(session.get_bind(), table.__tablename__)] = years
+
+    @classmethod
+    def __s_create_view(cls, session, table, years):
+        session.execute(text(f'DROP VIEW IF EXISTS {table.__tablename__}'))
+        partitions = ' UNION ALL '.join(f'SELECT * FROM {cls.partition_name(table, year)}' for year in sorted(years))
+        session.execute(text(f'CREATE VIEW {table.__tablename__} AS {partitions}'))
+
+    @classmethod
+    def s_is_partitioned(cls, session, table):
+        """Return True if the table has been split into per year partitions."""
+        return cls.__s_years(session, table) is not None
+
+    @classmethod
+    def s_get_partition(cls, session, table, year):
+        """Return the partition of a partitioned table for a year, creating it if needed."""
+        partition = cls.partition_table(table, year)
+        years = cls.__s_years(session, table)
+        if year not in years:
+            partition.create(session.connection(), checkfirst=True)
+            years.add(year)
+            cls.__s_create_view(session, table, years)
+        return partition
+
+    @classmethod
+    def create(cls, db, tables=None):
+        """Move the rows of the monitoring tables, or the tables passed in, that aren't partitioned yet into per year partitions."""
+        with db.managed_session() as session:
+            if session.get_bind().dialect.name != 'sqlite':
+                logger.warning("Monitoring partitions are only supported on SQLite")
+                return
+            for table in (tables or cls.tables):
+                if cls.s_is_partitioned(session, table):
+                    continue
+                years = {int(year) for (year,) in session.query(func.strftime('%Y', table.timestamp)).distinct().all() if year is not None}
+                if not years:
+                    continue
+                logger.info("Partitioning %s into years %r", table.__tablename__, sorted(years))
+                col_names = [col.name for col in table.__table__.columns]
+                for year in years:
+                    partition = cls.partition_table(table, year)
+                    partition.create(session.connection(), checkfirst=True)
+                    query = select([table.__table__]).where(func.strftime('%Y', table.timestamp) == str(year))
+                    session.execute(partition.insert().from_select(col_names, query))
+                session.execute(text(f'DROP TABLE {table.__tablename__}'))
+                cls.__s_create_view(session, table, years)
+                cls.__s_set_years(session, table, years)
+            session.commit()
+
+    @classmethod
+    def delete_year(cls, db, year):
+        """Delete a year of monitoring data and its rollups, dropping the year's partitions if the tables are partitioned."""
+        start_ts = datetime.datetime(year, 1, 1)
+        end_ts = datetime.datetime(year + 1, 1, 1)
+        with db.managed_session() as session:
+            for table in cls.tables:
+                years = cls.__s_years(session, table)
+                if years is None:
+                    session.query(table).filter(table.timestamp >= start_ts).filter(table.timestamp < end_ts).delete(synchronize_session=False)
+                elif year in years:
+                    years.discard(year)
+                    if years:
+                        cls.__s_create_view(session, table, years)
+                    else:
+                        # The last partition is going away, go back to an unpartitioned table.
+                        session.execute(text(f'DROP VIEW {table.__tablename__}'))
+                        table.__table__.create(session.connection())
+                        cls.__s_set_years(session, table, None)
+                    session.execute(text(f'DROP TABLE {cls.partition_name(table, year)}'))
+            for table in MonitoringRollups.tables:
+                session.query(table).filter(table.timestamp >= start_ts).filter(table.timestamp < end_ts).delete(synchronize_session=False)
+            session.commit()
@@ -0,0 +1,140 @@
+"""Functions for simplifying and packing activity tracks."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import numpy as np
+
+
+earth_radius_meters = 6371008.8
+
+
+def project(lats, longs):
+    """Return x and y arrays in meters for arrays of lat and long degrees using an equirectangular projection centered on the track."""
+    lats_rad = np.radians(lats)
+    longs_rad = np.radians(longs)
+    x = (longs_rad - longs_rad[0]) * np.cos(np.mean(lats_rad)) * earth_radius_meters
+    y = (lats_rad - lats_rad[0]) * earth_radius_meters
+    return (x, y)
+
+
+def _segment_distances(x, y, start, end):
+    """Return the distances of the points between start and end to the line segment from start to end."""
+    px = x[start + 1:end]
+    py = y[start + 1:end]
+    dx = x[end] - x[start]
+    dy = y[end] - y[start]
+    length_squared = dx * dx + dy * dy
+    if length_squared == 0.0:
+        return np.hypot(px - x[start], py - y[start])
+    t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length_squared, 0.0, 1.0)
+    return np.hypot(px - (x[start] + t * dx), py - (y[start] + t * dy))
+
+
+def simplify(lats, longs, tolerance):
+    """Return the indices of the points kept by a Douglas-Peucker simplification of the track with the given tolerance in meters."""
+    count = len(lats)
+    if count < 3:
+        return np.arange(count)
+    x, y = project(np.asarray(lats, dtype=np.float64), np.asarray(longs, dtype=np.float64))
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(x, y, start, end)
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def pack_positions(lats, longs):
+    """Pack arrays of lat and long degrees into a compact blob."""
+    return np.column_stack((lats, longs)).astype('<f4').tobytes()
+
+
+def unpack_positions(blob):
+    """Unpack a positions blob into a list of (lat, long) tuples."""
+    return [tuple(position) for position in np.frombuffer(blob, dtype='<f4').reshape(-1, 2).tolist()]
+
+
+def pack_indices(indices):
+    """Pack an array of record numbers into a compact blob."""
+    return np.asarray(indices).astype('<u4').tobytes()
+
+
+def unpack_indices(blob):
+    """Unpack a blob of record numbers into a list of ints."""
+    return np.frombuffer(blob, dtype='<u4').tolist()
+
+
+def distance(lat1, long1, lat2, long2):
+    """Return the great circle distance in meters between two points given in degrees."""
+    lat1, long1, lat2, long2 = np.radians([lat1, long1, lat2, long2])
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((long2 - long1) / 2.0) ** 2
+    return float(2.0 * earth_radius_meters * np.arcsin(np.sqrt(a)))
+
+
+def bounding_box(lat, long, radius):
+    """Return a (min_lat, max_lat, min_long, max_long) tuple in degrees that contains a circle of radius meters around a point."""
+    lat_delta = float(np.degrees(radius / earth_radius_meters))
+    long_delta = lat_delta / max(float(np.cos(np.radians(lat))), 1e-6)
+    return (lat - lat_delta, lat + lat_delta, long - long_delta, long + long_delta)
+
+
+geohash_base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohashes(lats, longs, precision):
+    """Return a list of geohash strings of the given precision for arrays of lat and long degrees."""
+    lats = np.asarray(lats, dtype=np.float64)
+    longs = np.asarray(longs, dtype=np.float64)
+    bits = precision * 5
+    long_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    # scale each coordinate to an integer cell index, then interleave the bits starting with longitude
+    long_index = np.clip(((longs + 180.0) / 360.0 * (1 << long_bits)).astype(np.int64), 0, (1 << long_bits) - 1)
+    lat_index = np.clip(((lats + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    codes = np.zeros(len(lats), dtype=np.int64)
+    for bit in range(bits):
+        if bit % 2 == 0:
+            value = (long_index >> (long_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_index >> (lat_bits - 1 - bit // 2)) & 1
+        codes = (codes << 1) | value
+    return [''.join(geohash_base32[(code >> (5 * (precision - 1 - char))) & 0x1f] for char in range(precision)) for code in codes.tolist()]
+
+
+def route_signature(lats, longs, precision):
+    """Return the sequence of geohash cells that a track passes through with consecutive repeats removed."""
+    cells = []
+    for cell in geohashes(lats, longs, precision):
+        if not cells or cells[-1] != cell:
+            cells.append(cell)
+    return cells
+
+
+def jaccard_similarity(cells1, cells2):
+    """Return the Jaccard similarity of two collections of cells."""
+    set1 = set(cells1)
+    set2 = set(cells2)
+    union = len(set1 | set2)
+    return (len(set1 & set2) / union) if union > 0 else 0.0
+
+
+def geohash_neighbors(lat, long, precision):
+    """Return the geohash cell of the given precision that contains a point and the eight cells that surround it."""
+    bits = precision * 5
+    cell_height = 180.0 / (1 << (bits // 2))
+    cell_width = 360.0 / (1 << ((bits + 1) // 2))
+    offsets = [-1, 0, 1]
+    lats = [lat + lat_offset * cell_height for lat_offset in offsets for _ in offsets]
+    longs = [long + long_offset * cell_width for _ in offsets for long_offset in offsets]
+    return list(set(geohashes(lats, longs, precision)))
@@ -0,0 +1,82 @@
+"""A single SQLite connection with all of the GarminDB databases attached."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+from sqlalchemy import create_engine, event, MetaData, select
+from sqlalchemy.orm import sessionmaker
+
+import HealthDB
+from GarminDB.garmin_db import GarminDB
+from GarminDB.monitoring_db import MonitoringDB
+from GarminDB.activities_db import ActivitiesDB
+from GarminDB.garmin_summary_db import GarminSummaryDB
+
+
+logger = logging.getLogger(__name__)
+
+
+class UnifiedDB(object):
+    """
+    A SQLite connection that ATTACHes the GarminDB database files under their database names.
+
+    Queries can join tables across databases and INSERT ... SELECT between them without leaving SQLite. Unqualified table names
+    resolve to the first attached database that has the table, so ORM classes from the garmin, monitoring, activities, and garmin
+    summary databases work as is. Use table() to get a schema qualified table for names that appear in more than one database.
+    """
+
+    db_classes = [GarminDB, MonitoringDB, ActivitiesDB, GarminSummaryDB, HealthDB.SummaryDB]
+    metadata = MetaData()
+    tables = {}
+
+    def __init__(self, db_params, debug_level=0):
+        """Return a new UnifiedDB instance, creating and checking the individual databases as needed."""
+        if db_params.db_type != 'sqlite':
+            raise ValueError(f'UnifiedDB requires SQLite databases not {db_params.db_type}')
+        self.db_params = db_params
+        self.dbs = [db_class(db_params, debug_level) for db_class in self.db_classes]
+        self.engine = create_engine('sqlite://', echo=(debug_level > 1))
+        event.listen(self.engine, 'connect', self.__attach)
+
+    def __attach(self, dbapi_connection, connection_record):
+        for db in self.dbs:
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS {db.db_name}', (db._sqlite_path(db.db_params),))
+
+    def managed_session(self):
+        """Return a session with automatic commit, rollback, and cleanup."""
+        return sessionmaker(self.engine, expire_on_commit=False).begin()
+
+    @classmethod
+    def table(cls, table_object):
+        """Return a Core table for a database object's table qualified with the name of the database it belongs to."""
+        key = (table_object.db.db_name, table_object.__tablename__)
+        table = cls.tables.get(key)
+        if table is None:
+            table = table_object.__table__.tometadata(cls.metadata, schema=table_object.db.db_name)
+            cls.tables[key] = table
+        return table
+
+    @classmethod
+    def s_copy_table(cls, session, from_table_object, to_table_object, keys=None):
+        """
+        Copy the rows of one table into another with INSERT ... SELECT, replacing rows with matching primary keys.
+
+        Parameters:
+        ----------
+            keys (list): if given, only copy the rows with these values of the first primary key column, else copy all rows
+
+        """
+        from_table = cls.table(from_table_object)
+        to_table = cls.table(to_table_object)
+        col_names = [col.name for col in to_table.columns if col.name in from_table.columns]
+        query = select([from_table.columns[col_name] for col_name in col_names])
+        if keys is None:
+            session.execute(to_table.insert().prefix_with('OR REPLACE').from_select(col_names, query))
+            return
+        key_col = list(from_table.primary_key.columns)[0]
+        keys = list(keys)
+        for start in range(0, len(keys), from_table_object.max_statement_variables):
+            keys_query = query.where(key_col.in_(keys[start:start + from_table_object.max_statement_variables]))
+            session.execute(to_table.insert().prefix_with('OR REPLACE').from_select(col_names, keys_query))
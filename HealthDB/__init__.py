@@ -6,5 +6,15 @@ __license__ = "GPL"
 
 # flake8: noqa
 
+from HealthDB.schema_migrations import SchemaMigrations
+from HealthDB.db_registry import DbRegistry, RegisteredDb
+from HealthDB.db_object import DbObject
+from HealthDB.dirty_day_recorder import DirtyDayRecorder
+from HealthDB.upsert_db_object import UpsertDbObject, UpsertKeyValueObject
 from HealthDB.summary_base import SummaryBase
 from HealthDB.summary_db import SummaryDB, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary
+from HealthDB.summary_sink import SummarySink
+from HealthDB.sqlite_profile import SqliteProfile
+from HealthDB.index_advisor import IndexAdvisor
+from HealthDB.db_maintenance import DbMaintenance
+from HealthDB.query_cache import QueryCache
@@ -0,0 +1,96 @@
+"""Keep SQLite databases compact, their query planner statistics current, and report where the space goes."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import sqlite3
+
+
+logger = logging.getLogger(__name__)
+
+
+class DbMaintenance(object):
+    """Maintenance operations for SQLite databases."""
+
+    @classmethod
+    def __execute(cls, db, statement):
+        # Run outside of a session, VACUUM can't run inside a transaction.
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(statement)
+            rows = cursor.fetchall()
+            connection.commit()
+            return rows
+        finally:
+            connection.close()
+
+    @classmethod
+    def __pragma(cls, db, pragma):
+        return cls.__execute(db, f'PRAGMA {pragma}')[0][0]
+
+    @classmethod
+    def optimize(cls, db):
+        """Gather the statistics the query planner uses to choose indexes."""
+        cls.__execute(db, 'ANALYZE')
+        cls.__execute(db, 'PRAGMA optimize')
+
+    @classmethod
+    def vacuum(cls, db):
+        """Return the free pages to the file system, incrementally if the database was created with incremental auto vacuum."""
+        if cls.__pragma(db, 'auto_vacuum') == 2:
+            cls.__execute(db, 'PRAGMA incremental_vacuum')
+        else:
+            cls.__execute(db, 'VACUUM')
+
+    @classmethod
+    def integrity_check(cls, db):
+        """Return a list of the problems found in the database, empty if there are none."""
+        return [row[0] for row in cls.__execute(db, 'PRAGMA integrity_check') if row[0] != 'ok']
+
+    @classmethod
+    def table_sizes(cls, db):
+        """Return a dict of table name to (row count, bytes on disk including the table's indexes) for the tables in the database."""
+        table_names = {name : tbl_name for name, tbl_name in cls.__execute(db, "SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')")}
+        sizes = dict.fromkeys(set(table_names.values()), 0)
+        try:
+            for name, size in cls.__execute(db, 'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name'):
+                table_name = table_names.get(name)
+                if table_name is not None:
+                    sizes[table_name] += size
+        except sqlite3.OperationalError:
+            logger.info("%s: SQLite was built without dbstat, table sizes aren't available", db.db_name)
+            sizes = dict.fromkeys(sizes)
+        return {table_name : (cls.__execute(db, f'SELECT COUNT(*) FROM "{table_name}"')[0][0], size) for table_name, size in sizes.items()}
+
+    @classmethod
+    def report(cls, db):
+        """Log and return the page counts and the sizes of the tables in the database."""
+        page_size = cls.__pragma(db, 'page_size')
+        page_count = cls.__pragma(db, 'page_count')
+        freelist_count = cls.__pragma(db, 'freelist_count')
+        logger.info("%s: %d pages of %d bytes (%d bytes), %d free pages", db.db_name, page_count, page_size, page_count * page_size, freelist_count)
+        table_sizes = cls.table_sizes(db)
+        for table_name, (rows, size) in sorted(table_sizes.items(), key=lambda item: item[1][1] or 0, reverse=True):
+            logger.info("%s: %s %d rows %s bytes", db.db_name, table_name, rows, size)
+        return {'page_size' : page_size, 'page_count' : page_count, 'freelist_count' : freelist_count, 'tables' : table_sizes}
+
+    @classmethod
+    def maintain(cls, db, vacuum=False):
+        """Optimize, optionally vacuum, check, and report on a database. Return the report or None if the database isn't SQLite."""
+        if db.engine.dialect.name != 'sqlite':
+            logger.info("%s: maintenance is only supported for SQLite databases", db.db_name)
+            return None
+        logger.info("%s: optimizing", db.db_name)
+        cls.optimize(db)
+        if vacuum:
+            logger.info("%s: vacuuming", db.db_name)
+            cls.vacuum(db)
+        problems = cls.integrity_check(db)
+        for problem in problems:
+            logger.error("%s: integrity check: %s", db.db_name, problem)
+        report = cls.report(db)
+        report['integrity_problems'] = problems
+        return report
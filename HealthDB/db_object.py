@@ -0,0 +1,155 @@
+"""A database object base class with queries that compute many aggregates at once."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+from sqlalchemy import func, case, and_
+
+import utilities
+
+
+class DbObject(utilities.DbObject):
+    """Base class for database objects that adds multi-aggregate queries."""
+
+    @classmethod
+    def _stat_expression(cls, col, aggregate, where=None):
+        """
+        Return a SQL expression for one aggregate of a column.
+
+        Parameters:
+        ----------
+            col: the column or column expression to aggregate
+            aggregate (string): avg, min, max, sum, or count; or time_avg, time_min, time_max, or time_sum for time columns
+            where: None, True to ignore values less than or equal to zero, or a SQL expression that selects the rows to aggregate
+
+        """
+        if aggregate.startswith('time_'):
+            # Like the time column functions, time aggregates always ignore zero times.
+            value = cls._secs_from_time(col)
+            stat_func = getattr(func, aggregate[len('time_'):])
+            where = value > 0 if where is None or where is True else and_(where, value > 0)
+        else:
+            value = col
+            stat_func = getattr(func, aggregate)
+            if where is True:
+                where = value > 0
+        if where is not None:
+            # Rows that don't match contribute a NULL which the aggregate functions skip.
+            value = case([(where, value)])
+        expression = stat_func(value)
+        if aggregate.startswith('time_'):
+            expression = cls._time_from_secs(expression)
+        return expression
+
+    @classmethod
+    def _stat_value(cls, aggregate, value):
+        if aggregate == 'count' and value is None:
+            # The count of no rows, for days that don't have any.
+            return 0
+        if aggregate.startswith('time_'):
+            return datetime.datetime.strptime(value, '%H:%M:%S').time() if value is not None else datetime.time.min
+        return value
+
+    @classmethod
+    def s_get_col_stats(cls, session, stats_spec, start_ts=None, end_ts=None):
+        """
+        Return a dict of aggregate statistics computed with one SELECT over the rows in the time period.
+
+        Parameters:
+        ----------
+            stats_spec (dict): stat name to a (column, aggregate) or (column, aggregate, where) tuple, see _stat_expression
+            start_ts (datetime): the start of the time period
+            end_ts (datetime): the end of the time period, not included
+
+        """
+        expressions = [cls._stat_expression(*spec) for spec in stats_spec.values()]
+        query = session.query(*expressions)
+        if start_ts is not None:
+            query = query.filter(cls.time_col >= start_ts)
+        if end_ts is not None:
+            query = query.filter(cls.time_col < end_ts)
+        row = query.one()
+        return {name : cls._stat_value(spec[1], value) for (name, spec), value in zip(stats_spec.items(), row)}
+
+    @classmethod
+    def get_col_stats(cls, db, stats_spec, start_ts=None, end_ts=None):
+        """Return a dict of aggregate statistics computed with one SELECT over the rows in the time period."""
+        with db.managed_session() as session:
+            return cls.s_get_col_stats(session, stats_spec, start_ts, end_ts)
+
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dictionary of the aggregate statistics in the class's _stats_spec for the given time period."""
+        return cls.s_get_col_stats(session, cls._stats_spec(), start_ts, end_ts)
+
+    @classmethod
+    def s_get_col_stats_by(cls, session, stats_spec, group_col, start_ts=None, end_ts=None):
+        """
+        Return a dict of the values of a column to a dict of aggregate statistics of the rows with that value, computed with one SELECT ... GROUP BY.
+
+        Parameters:
+        ----------
+            stats_spec (dict): stat name to a (column, aggregate) or (column, aggregate, where) tuple, see _stat_expression
+            group_col: the column or column expression to group the rows by
+            start_ts (datetime): the start of the time period
+            end_ts (datetime): the end of the time period, not included
+
+        """
+        expressions = [cls._stat_expression(*spec) for spec in stats_spec.values()]
+        query = session.query(group_col, *expressions)
+        if start_ts is not None:
+            query = query.filter(cls.time_col >= start_ts)
+        if end_ts is not None:
+            query = query.filter(cls.time_col < end_ts)
+        return {row[0] : {name : cls._stat_value(spec[1], value) for (name, spec), value in zip(stats_spec.items(), row[1:])} for row in query.group_by(group_col).all()}
+
+    @classmethod
+    def get_col_stats_by(cls, db, stats_spec, group_col, start_ts=None, end_ts=None):
+        """Return a dict of the values of a column to a dict of aggregate statistics of the rows with that value, computed with one SELECT ... GROUP BY."""
+        with db.managed_session() as session:
+            return cls.s_get_col_stats_by(session, stats_spec, group_col, start_ts, end_ts)
+
+    @classmethod
+    def s_get_col_stats_per_day(cls, session, stats_spec, days):
+        """
+        Return a dict of day to a dict of aggregate statistics for each of the days computed with one SELECT ... GROUP BY day.
+
+        Parameters:
+        ----------
+            stats_spec (dict): stat name to a (column, aggregate) or (column, aggregate, where) tuple, see _stat_expression
+            days (list): the dates to return statistics for, days without rows get the statistics of no rows
+
+        """
+        days = sorted(days)
+        if not days:
+            return {}
+        days_stats = cls.s_get_col_stats_by(session, stats_spec, func.date(cls.time_col), days[0], days[-1] + datetime.timedelta(1))
+        days_stats = {datetime.date.fromisoformat(day) : stats for day, stats in days_stats.items()}
+        return {day : days_stats.get(day) or {name : cls._stat_value(spec[1], None) for name, spec in stats_spec.items()} for day in days}
+
+    @classmethod
+    def s_get_days_stats(cls, session, days):
+        """Return a dict of day to a dictionary of aggregate statistics for each of the days, computed with one query."""
+        days_stats = cls.s_get_col_stats_per_day(session, cls._stats_spec(), days)
+        for day, stats in days_stats.items():
+            stats['day'] = day
+        return days_stats
+
+    @classmethod
+    def s_get_day_runs(cls, session):
+        """Return a list of (first_day, last_day, days) tuples, in order, for the runs of consecutive days that have rows, computed with one windowed query."""
+        day_col = func.date(cls.time_col)
+        days = session.query(day_col.label('day')).filter(cls.time_col.isnot(None)).distinct().subquery()
+        # The days of a run are one apart as are their row numbers, so the difference between the two is the same for all of them.
+        run_col = (func.julianday(days.c.day) - func.row_number().over(order_by=days.c.day)).label('run')
+        numbered = session.query(days.c.day, run_col).subquery()
+        query = session.query(func.min(numbered.c.day), func.max(numbered.c.day), func.count(numbered.c.day)).group_by(numbered.c.run).order_by(func.min(numbered.c.day))
+        return [(datetime.date.fromisoformat(first_day), datetime.date.fromisoformat(last_day), days) for first_day, last_day, days in query.all()]
+
+    @classmethod
+    def get_day_runs(cls, db):
+        """Return a list of (first_day, last_day, days) tuples, in order, for the runs of consecutive days that have rows, computed with one windowed query."""
+        with db.managed_session() as session:
+            return cls.s_get_day_runs(session)
@@ -0,0 +1,105 @@
+"""A process wide registry that hands out one database instance per database class and database."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import threading
+import types
+
+import utilities
+from HealthDB.schema_migrations import SchemaMigrations
+from HealthDB.query_cache import QueryCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class DbRegistry(object):
+    """Holds one instance, and so one engine, connection pool and set of schema checks, per database class and database url."""
+
+    lock = threading.RLock()
+    instances = {}
+
+    @classmethod
+    def create(cls, name, version, doc=None, migrations=None):
+        """Create a dynamic database class whose instances are shared through the registry, migrations holds the database's upgrade steps."""
+        db_class = utilities.DB.create(name, version, doc)
+        registered_db_class = types.new_class(db_class.__name__, bases=(RegisteredDb, db_class))
+        registered_db_class.db_migrations = migrations if migrations is not None else {}
+        return registered_db_class
+
+    @classmethod
+    def key(cls, db_class, db_params):
+        """Return the registry key for a database class and its parameters."""
+        url_func = getattr(db_class, f'_{db_params.db_type}_url')
+        return (db_class, url_func(db_params))
+
+    @classmethod
+    def get(cls, db_class, db_params):
+        """Return the registered instance for a database class and parameters if there is one."""
+        with cls.lock:
+            return cls.instances.get(cls.key(db_class, db_params))
+
+    @classmethod
+    def add(cls, db):
+        """Register a fully initialized database instance."""
+        with cls.lock:
+            cls.instances[cls.key(db.__class__, db.db_params)] = db
+
+    @classmethod
+    def remove(cls, db_class, db_params):
+        """Remove a database from the registry and close its connections."""
+        with cls.lock:
+            db = cls.instances.pop(cls.key(db_class, db_params), None)
+        if db is not None:
+            db.engine.dispose()
+
+    @classmethod
+    def clear(cls):
+        """Remove all databases from the registry and close their connections."""
+        with cls.lock:
+            dbs = list(cls.instances.values())
+            cls.instances = {}
+        for db in dbs:
+            db.engine.dispose()
+
+    @classmethod
+    def forget(cls):
+        """Remove all databases from the registry without closing their connections, for child processes that inherited them."""
+        with cls.lock:
+            dbs = list(cls.instances.values())
+            cls.instances = {}
+        for db in dbs:
+            # The connections belong to the parent process, only drop the references to them.
+            db.engine.dispose(close=False)
+
+
+class RegisteredDb(object):
+    """Mixin for database classes that makes constructing a database that's already open nearly free."""
+
+    def __new__(cls, db_params, debug_level=0):
+        """Return the registered instance for the database or a new uninitialized one."""
+        db = DbRegistry.get(cls, db_params)
+        if db is None:
+            db = super().__new__(cls)
+            db._registered = False
+        return db
+
+    def __init__(self, db_params, debug_level=0):
+        """Upgrade the schema, create the engine and tables, and run the version checks, but only the first time for a database."""
+        if not self._registered:
+            with DbRegistry.lock:
+                if not self._registered:
+                    SchemaMigrations.migrate(self.__class__, db_params)
+                    super().__init__(db_params, debug_level)
+                    self._registered = True
+                    DbRegistry.add(self)
+
+    @classmethod
+    def delete_db(cls, db_params):
+        """Delete a database, dropping it from the registry first and the cached query results after."""
+        DbRegistry.remove(cls, db_params)
+        super().delete_db(db_params)
+        QueryCache.clear()
@@ -0,0 +1,100 @@
+"""Record the days that rows were written for so that summaries can be regenerated for only those days."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+import itertools
+import contextlib
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+
+class DirtyDayRecorder(object):
+    """
+    Collects the days of the rows written to tables that summaries are computed from.
+
+    Tables opt in by setting marks_dirty_days. Rows written with s_insert_or_update, s_insert_or_update_many, or added to a
+    session are recorded by the day of their time column. The recorded days are kept in memory until they are saved, while
+    save_on_commit is active they are saved each time a session commits.
+    """
+
+    __days = set()
+    __saver = None
+
+    @classmethod
+    def record(cls, timestamp):
+        """Record the day of a date or datetime as dirty."""
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.date()
+        cls.__days.add(timestamp)
+
+    @classmethod
+    def record_values(cls, table_object, values_dict):
+        """Record the day of a row to be written to a table if the table marks dirty days."""
+        if getattr(table_object, 'marks_dirty_days', False):
+            timestamp = values_dict.get(table_object.time_col_name)
+            if isinstance(timestamp, datetime.date):
+                cls.record(timestamp)
+
+    @classmethod
+    def days(cls):
+        """Return the recorded days in order."""
+        return sorted(cls.__days)
+
+    @classmethod
+    def clear(cls):
+        """Forget the recorded days."""
+        cls.__days.clear()
+
+    @classmethod
+    def __save(cls, saver):
+        days = cls.days()
+        if days:
+            # Forget the days first, saving them commits too.
+            cls.clear()
+            try:
+                saver(days)
+            except Exception:
+                cls.__days.update(days)
+                raise
+
+    @classmethod
+    @contextlib.contextmanager
+    def save_on_commit(cls, saver):
+        """Call saver with the recorded days after each commit while the context is active and once more when it ends, even if it fails."""
+        saved_saver = cls.__saver
+        cls.__saver = saver
+        try:
+            yield
+        finally:
+            cls.__saver = saved_saver
+            cls.__save(saver)
+
+    @classmethod
+    def _after_commit(cls, session):
+        if cls.__saver is not None:
+            cls.__save(cls.__saver)
+
+    @classmethod
+    def _before_flush(cls, session, flush_context, instances):
+        for instance in itertools.chain(session.new, session.dirty):
+            if getattr(instance, 'marks_dirty_days', False):
+                timestamp = getattr(instance, instance.time_col_name)
+                if isinstance(timestamp, datetime.date):
+                    cls.record(timestamp)
+
+
+@event.listens_for(Session, 'before_flush')
+def _on_before_flush(session, flush_context, instances):
+    DirtyDayRecorder._before_flush(session, flush_context, instances)
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_after_commit(session):
+    DirtyDayRecorder._after_commit(session)
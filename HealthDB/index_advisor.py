@@ -0,0 +1,77 @@
+"""Find queries that scan whole tables."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import re
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+
+class IndexAdvisor(object):
+    """Capture the queries run against SQLite databases and report the ones whose query plans scan whole tables."""
+
+    __query_re = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+    # Matches 'SCAN activities' and 'SCAN TABLE activities' but not scans that use an index.
+    __full_scan_re = re.compile(r'^SCAN (TABLE )?(?!CONSTANT ROW|SUBQUERY)(?P<table>\w+)(?!.*USING)')
+
+    def __init__(self):
+        """Return a new IndexAdvisor instance."""
+        self.statements = {}
+
+    def __before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if conn.engine.dialect.name == 'sqlite' and self.__query_re.match(statement):
+            if executemany:
+                parameters = parameters[0] if len(parameters) > 0 else ()
+            self.statements.setdefault((str(conn.engine.url), statement), (conn.engine, parameters))
+
+    def start(self):
+        """Start capturing the queries run against all databases."""
+        event.listen(Engine, 'before_cursor_execute', self.__before_cursor_execute)
+
+    def stop(self):
+        """Stop capturing queries."""
+        if event.contains(Engine, 'before_cursor_execute', self.__before_cursor_execute):
+            event.remove(Engine, 'before_cursor_execute', self.__before_cursor_execute)
+
+    @classmethod
+    def query_plan(cls, engine, statement, parameters=()):
+        """Return the details of the query plan SQLite chooses for a statement."""
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+    @classmethod
+    def full_scans(cls, engine, statement, parameters=()):
+        """Return the names of the tables a statement scans completely."""
+        scans = []
+        for detail in cls.query_plan(engine, statement, parameters):
+            match = cls.__full_scan_re.match(detail)
+            if match:
+                scans.append(match.group('table'))
+        return scans
+
+    def report(self):
+        """Stop capturing, log the captured queries that scan whole tables, and return them as (url, table, statement) tuples."""
+        self.stop()
+        findings = []
+        for (url, statement), (engine, parameters) in self.statements.items():
+            try:
+                tables = self.full_scans(engine, statement, parameters)
+            except Exception as e:
+                logger.debug("Failed to explain %s: %s", statement, e)
+                continue
+            for table in tables:
+                logger.info("Full scan of %s in %s by: %s", table, url, statement)
+                findings.append((url, table, statement))
+        logger.info("Index advisor: %d of %d captured queries scan whole tables", len(set(finding[2] for finding in findings)), len(self.statements))
+        return findings
@@ -0,0 +1,237 @@
+"""A cache of query results that is invalidated by per table change counters kept in each SQLite database."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import re
+import collections
+import hashlib
+import pickle
+import sqlite3
+import uuid
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache(object):
+    """
+    Caches the results of ORM queries that return columns, like the aggregate queries used for statistics, in memory and on disk.
+
+    While the cache is enabled, writers count the changes they commit to each table in a _table_changes table in the database.
+    The first count also writes a random generation id for the database, so a database that is deleted and rebuilt starts a
+    new generation. A cached result is used only if the generation and the counters of the tables the query reads are the same
+    as when the result was cached. Queries of databases without a generation aren't cached since their writes weren't counted.
+    Writes made with the cache disabled, or outside of SQLAlchemy, aren't counted, call clear() after making them. PRAGMA
+    data_version tells if another connection committed since the counters were last read so that cache hits don't have to
+    read them.
+    """
+
+    changes_table = '_table_changes'
+    generation_table = '_table_changes_generation'
+    # A write to the key table name is also a change to the value table name, for instance a partition of a view.
+    table_aliases = {}
+
+    enabled = False
+    max_entries = 4096
+    __memory = collections.OrderedDict()
+    __disk = None
+
+    __write_re = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM|DROP\s+(?:TABLE|VIEW)(?:\s+IF\s+EXISTS)?|'
+                            r'CREATE\s+VIEW(?:\s+IF\s+NOT\s+EXISTS)?|ALTER\s+TABLE)\s+(?:"?(?P<schema>\w+)"?\.)?"?(?P<table>\w+)"?', re.IGNORECASE)
+
+    @classmethod
+    def enable(cls, cache_file=None, max_entries=4096):
+        """Start counting changes and caching query results in memory and, if a file is given, on disk."""
+        for target, identifier, listener in _listeners:
+            if not event.contains(target, identifier, listener):
+                event.listen(target, identifier, listener)
+        cls.enabled = True
+        cls.max_entries = max_entries
+        if cache_file is not None:
+            cls.__disk = sqlite3.connect(cache_file, check_same_thread=False)
+            cls.__disk.execute('CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, changes BLOB, result BLOB)')
+            cls.__disk.commit()
+        logger.info("Query cache enabled: %s", cache_file)
+
+    @classmethod
+    def disable(cls, close=True):
+        """Stop counting changes and caching query results and drop the in memory results. Child processes that inherited the cache pass close=False."""
+        for target, identifier, listener in _listeners:
+            if event.contains(target, identifier, listener):
+                event.remove(target, identifier, listener)
+        cls.enabled = False
+        cls.__memory.clear()
+        if cls.__disk is not None:
+            if close:
+                cls.__disk.close()
+            cls.__disk = None
+
+    @classmethod
+    def clear(cls):
+        """Drop all cached results."""
+        cls.__memory.clear()
+        if cls.__disk is not None:
+            cls.__disk.execute('DELETE FROM query_cache')
+            cls.__disk.commit()
+
+    #
+    # Change counting on the writer side.
+    #
+    @classmethod
+    def _after_cursor_execute(cls, conn, cursor, statement, parameters, context, executemany):
+        if conn.engine.dialect.name != 'sqlite':
+            return
+        match = cls.__write_re.match(statement)
+        if match:
+            tables = conn.info.setdefault('pending_table_changes', set())
+            tables.add((match.group('schema'), match.group('table')))
+            alias = cls.table_aliases.get(match.group('table'))
+            if alias is not None:
+                tables.add((match.group('schema'), alias))
+
+    @classmethod
+    def __table_schema(cls, cursor, table_name):
+        databases = [row[1] for row in cursor.execute('PRAGMA database_list').fetchall()]
+        if len(databases) > 1:
+            # Resolve an unqualified name the way SQLite does, to the first database that has it.
+            for database in databases:
+                if cursor.execute(f'SELECT 1 FROM "{database}".sqlite_master WHERE name = ?', (table_name,)).fetchone():
+                    return database
+        return 'main'
+
+    @classmethod
+    def __create_changes_tables(cls, cursor, schema):
+        if not cursor.execute(f'SELECT 1 FROM "{schema}".sqlite_master WHERE name = ?', (cls.generation_table,)).fetchone():
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS "{schema}".{cls.changes_table} (table_name TEXT PRIMARY KEY, changes INTEGER NOT NULL)')
+            cursor.execute(f'CREATE TABLE "{schema}".{cls.generation_table} (generation TEXT NOT NULL)')
+            cursor.execute(f'INSERT INTO "{schema}".{cls.generation_table} VALUES (?)', (uuid.uuid4().hex,))
+
+    @classmethod
+    def _commit(cls, conn):
+        tables = conn.info.pop('pending_table_changes', None)
+        if not tables:
+            return
+        cursor = conn.connection.cursor()
+        try:
+            for schema, table_name in tables:
+                if schema is None:
+                    schema = cls.__table_schema(cursor, table_name)
+                cls.__create_changes_tables(cursor, schema)
+                cursor.execute(f'INSERT INTO "{schema}".{cls.changes_table} VALUES (?, 1) ON CONFLICT(table_name) DO UPDATE SET changes = changes + 1',
+                               (table_name,))
+        finally:
+            cursor.close()
+        conn.info.pop('table_changes', None)
+
+    @classmethod
+    def _rollback(cls, conn):
+        conn.info.pop('pending_table_changes', None)
+
+    #
+    # Caching on the reader side.
+    #
+    @classmethod
+    def table_changes(cls, conn):
+        """Return the generation, None if there isn't one, and a dict of table name to the number of committed changes for the database of a connection."""
+        cursor = conn.connection.cursor()
+        try:
+            data_version = cursor.execute('PRAGMA data_version').fetchone()[0]
+            cached = conn.info.get('table_changes')
+            if cached is not None and cached[0] == data_version:
+                return cached[1]
+            if cursor.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (cls.generation_table,)).fetchone():
+                generation = cursor.execute(f'SELECT generation FROM {cls.generation_table}').fetchone()[0]
+                changes = dict(cursor.execute(f'SELECT table_name, changes FROM {cls.changes_table}').fetchall())
+            else:
+                generation, changes = None, {}
+        finally:
+            cursor.close()
+        conn.info['table_changes'] = (data_version, (generation, changes))
+        return (generation, changes)
+
+    @classmethod
+    def __cacheable(cls, orm_execute_state, bind):
+        if not (cls.enabled and orm_execute_state.is_select and bind.dialect.name == 'sqlite' and bind.url.database):
+            return False
+        # Cache columns only, ORM instances belong to a session.
+        return not any(isinstance(description['expr'], type) for description in orm_execute_state.statement.column_descriptions)
+
+    @classmethod
+    def __get(cls, key):
+        entry = cls.__memory.get(key)
+        if entry is not None:
+            cls.__memory.move_to_end(key)
+        elif cls.__disk is not None:
+            row = cls.__disk.execute('SELECT changes, result FROM query_cache WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                entry = (pickle.loads(row[0]), pickle.loads(row[1]))
+        return entry
+
+    @classmethod
+    def __put(cls, key, changes, frozen_result):
+        cls.__memory[key] = (changes, frozen_result)
+        if len(cls.__memory) > cls.max_entries:
+            cls.__memory.popitem(last=False)
+        if cls.__disk is not None:
+            cls.__disk.execute('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?)', (key, pickle.dumps(changes), pickle.dumps(frozen_result)))
+            cls.__disk.commit()
+
+    @classmethod
+    def _do_orm_execute(cls, orm_execute_state):
+        bind = orm_execute_state.session.get_bind()
+        if not cls.__cacheable(orm_execute_state, bind):
+            return None
+        statement = orm_execute_state.statement
+        table_names = sorted({table.name for table in find_tables(statement) if hasattr(table, 'name')})
+        if not table_names:
+            return None
+        conn = orm_execute_state.session.connection()
+        pending = {table_name for schema, table_name in conn.info.get('pending_table_changes', ())}
+        if pending.intersection(table_names):
+            # This transaction changed the tables and hasn't committed the changes yet.
+            return None
+        compiled = statement.compile(dialect=bind.dialect)
+        params = dict(compiled.params, **orm_execute_state.parameters)
+        key = hashlib.sha1(repr((str(bind.url), str(compiled), sorted(params.items()))).encode()).hexdigest()
+        generation, table_changes = cls.table_changes(conn)
+        if generation is None:
+            return None
+        changes = (generation, {table_name : table_changes.get(table_name, 0) for table_name in table_names})
+        entry = cls.__get(key)
+        if entry is not None and entry[0] == changes:
+            return entry[1]()
+        frozen_result = orm_execute_state.invoke_statement().freeze()
+        cls.__put(key, changes, frozen_result)
+        return frozen_result()
+
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    QueryCache._after_cursor_execute(conn, cursor, statement, parameters, context, executemany)
+
+
+def _on_commit(conn):
+    QueryCache._commit(conn)
+
+
+def _on_rollback(conn):
+    QueryCache._rollback(conn)
+
+
+def _on_do_orm_execute(orm_execute_state):
+    return QueryCache._do_orm_execute(orm_execute_state)
+
+
+# Registered only while the cache is enabled so that databases aren't changed and statements aren't parsed otherwise.
+_listeners = [
+    (Engine, 'after_cursor_execute', _on_after_cursor_execute),
+    (Engine, 'commit', _on_commit),
+    (Engine, 'rollback', _on_rollback),
+    (Session, 'do_orm_execute', _on_do_orm_execute),
+]
@@ -0,0 +1,138 @@
+"""Upgrade database schemas in place when database and table versions change."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+from sqlalchemy import create_engine, event, inspect, MetaData, select, text
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaMigrations(object):
+    """
+    Runs upgrade steps for databases and tables whose stored version is older than the version in the code.
+
+    Tables list their steps in a table_migrations dict keyed by the version the step upgrades from and databases pass a
+    migrations dict to DbRegistry.create. A database step of None means the version bump only needs its table steps. All
+    of the steps for a database run in one transaction before the version checks. If any version can't be brought up to
+    date, nothing is changed and the version check asks for a rebuild as before.
+    """
+
+    @classmethod
+    def add_columns(cls, *col_names):
+        """Return a table step that adds columns, and their indexes, with ALTER TABLE ADD COLUMN."""
+        def step(connection, table_object):
+            table = table_object.__table__
+            for col_name in col_names:
+                column = table.columns[col_name]
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=connection.dialect)}'))
+            for index in table.indexes:
+                if any(column.name in col_names for column in index.columns):
+                    index.create(connection, checkfirst=True)
+        return step
+
+    @classmethod
+    def create_indexes(cls):
+        """Return a table step that creates the indexes of the table that the database doesn't have yet."""
+        def step(connection, table_object):
+            for index in table_object.__table__.indexes:
+                index.create(connection, checkfirst=True)
+        return step
+
+    @classmethod
+    def delete_rows(cls):
+        """Return a table step that deletes all rows, for tables of derived data that is regenerated."""
+        def step(connection, table_object):
+            connection.execute(table_object.__table__.delete())
+        return step
+
+    @classmethod
+    def copy_table(cls):
+        """Return a table step that recreates a table with the current schema and copies the rows for the columns both have."""
+        def step(connection, table_object):
+            table = table_object.__table__
+            # Copy the other tables too so that foreign keys resolve.
+            metadata = MetaData()
+            for other_table in table.metadata.tables.values():
+                other_table.tometadata(metadata)
+            new_table = table.tometadata(metadata, name=f'{table.name}_migrating')
+            old_col_names = [col['name'] for col in inspect(connection).get_columns(table.name)]
+            col_names = [col.name for col in table.columns if col.name in old_col_names]
+            connection.execute(CreateTable(new_table))
+            query = select([text(col_name) for col_name in col_names]).select_from(text(table.name))
+            connection.execute(new_table.insert().from_select(col_names, query))
+            connection.execute(text(f'DROP TABLE {table.name}'))
+            if connection.dialect.name == 'sqlite':
+                # Keep SQLite from rewriting or rejecting the views that use the table while it's renamed.
+                connection.execute(text('PRAGMA legacy_alter_table=ON'))
+            connection.execute(text(f'ALTER TABLE {new_table.name} RENAME TO {table.name}'))
+            if connection.dialect.name == 'sqlite':
+                connection.execute(text('PRAGMA legacy_alter_table=OFF'))
+            for index in table.indexes:
+                index.create(connection)
+        return step
+
+    @classmethod
+    def __migrate_version(cls, connection, attributes, key, stored_versions, version, migrations, step_arg):
+        """Run the steps for a version key and return if the stored version is, or is now, the version in the code."""
+        stored_version = stored_versions.get(key)
+        if stored_version is None:
+            return True
+        stored_version = int(stored_version)
+        start_version = stored_version
+        while stored_version < version and stored_version in migrations:
+            step = migrations[stored_version]
+            if step is not None:
+                step(connection, step_arg)
+            stored_version += 1
+        if stored_version != start_version:
+            logger.info("Migrating %s from version %d to %d", key, start_version, stored_version)
+            update = attributes.update().where(attributes.c.key == key).values(value=str(stored_version), timestamp=datetime.datetime.now())
+            connection.execute(update)
+        return stored_version == version
+
+    @classmethod
+    def __sqlite_connect(cls, dbapi_connection, connection_record):
+        # Let SQLAlchemy issue BEGIN so that DDL is part of the transaction, pysqlite only starts transactions for DML.
+        dbapi_connection.isolation_level = None
+
+    @classmethod
+    def __sqlite_begin(cls, connection):
+        connection.exec_driver_sql('BEGIN')
+
+    @classmethod
+    def migrate(cls, db_class, db_params):
+        """Upgrade an existing database to the versions in the code where there are steps to do so."""
+        url_func = getattr(db_class, f'_{db_params.db_type}_url')
+        engine = create_engine(url_func(db_params))
+        if db_params.db_type == 'sqlite':
+            event.listen(engine, 'connect', cls.__sqlite_connect)
+            event.listen(engine, 'begin', cls.__sqlite_begin)
+        try:
+            with engine.connect() as connection:
+                attributes = db_class._DbAttributes.__table__
+                if not inspect(connection).has_table(attributes.name):
+                    return
+                transaction = connection.begin()
+                stored_versions = dict(connection.execute(select([attributes.c.key, attributes.c.value])).fetchall())
+                up_to_date = cls.__migrate_version(connection, attributes, 'db.version', stored_versions, db_class.db_version,
+                                                   getattr(db_class, 'db_migrations', {}), db_class)
+                # Tables that were split up, like partitioned monitoring tables, are views that the steps can't change.
+                view_names = inspect(connection).get_view_names()
+                for table_object in db_class.db_tables.values():
+                    if table_object.__tablename__ in view_names:
+                        continue
+                    up_to_date &= cls.__migrate_version(connection, attributes, table_object.__tablename__ + '.version', stored_versions,
+                                                        table_object.table_version, getattr(table_object, 'table_migrations', {}), table_object)
+                if up_to_date:
+                    transaction.commit()
+                else:
+                    logger.warning("%s: no migration to the current schema, leaving the database as is", db_class.db_name)
+                    transaction.rollback()
+        finally:
+            engine.dispose()
@@ -0,0 +1,76 @@
+"""Apply a configured set of SQLite PRAGMAs to every SQLite database connection."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import sqlite3
+import contextlib
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteProfile(object):
+    """A named set of PRAGMAs applied to SQLite connections as they are opened or checked out of a pool."""
+
+    default_name = None
+    default_pragmas = {}
+    override_name = None
+    override_pragmas = None
+
+    @classmethod
+    def set_default(cls, db_params):
+        """Make the SQLite profile carried by a DbParams instance the default profile."""
+        cls.default_name = getattr(db_params, 'sqlite_profile', None)
+        cls.default_pragmas = getattr(db_params, 'sqlite_pragmas', None) or {}
+
+    @classmethod
+    @contextlib.contextmanager
+    def use(cls, db_params):
+        """Override the default SQLite profile with the profile carried by a DbParams instance while the context is active."""
+        saved = (cls.override_name, cls.override_pragmas)
+        cls.override_name = getattr(db_params, 'sqlite_profile', None)
+        cls.override_pragmas = getattr(db_params, 'sqlite_pragmas', None) or {}
+        logger.info("Using SQLite profile %s", cls.override_name)
+        try:
+            yield
+        finally:
+            (cls.override_name, cls.override_pragmas) = saved
+
+    @classmethod
+    def active(cls):
+        """Return the name and PRAGMAs of the profile currently in effect."""
+        if cls.override_pragmas is not None:
+            return (cls.override_name, cls.override_pragmas)
+        return (cls.default_name, cls.default_pragmas)
+
+    @classmethod
+    def apply(cls, dbapi_connection, connection_record):
+        """Apply the active profile to a DBAPI connection unless it has already been applied."""
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        (name, pragmas) = cls.active()
+        if connection_record.info.get('sqlite_profile') == name:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f'PRAGMA {pragma}={value}')
+        finally:
+            cursor.close()
+        connection_record.info['sqlite_profile'] = name
+
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    SqliteProfile.apply(dbapi_connection, connection_record)
+
+
+@event.listens_for(Engine, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    # Pooled connections outlive a profile switch, so re-apply if the profile changed since they were opened.
+    SqliteProfile.apply(dbapi_connection, connection_record)
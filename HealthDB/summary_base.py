@@ -9,10 +9,10 @@ from sqlalchemy import Column, Float, Time, Integer, func
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import Fit.conversions as conversions
-from utilities import DbObject
+from HealthDB.upsert_db_object import UpsertDbObject
 
 
-class SummaryBase(DbObject):
+class SummaryBase(UpsertDbObject):
     """Base class for implementing summary database objects."""
 
     view_version = 10
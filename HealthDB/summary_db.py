@@ -9,12 +9,15 @@ from sqlalchemy import Column, Date
 
 import utilities
 import HealthDB.summary_base as sb
+import HealthDB.db_registry as db_registry
+from HealthDB.upsert_db_object import UpsertKeyValueObject
+from HealthDB.schema_migrations import SchemaMigrations
 
 
 logger = logging.getLogger(__name__)
 
-SummaryDB = utilities.DB.create('summary', 7, "Database for storing summarizing health data.")
-Summary = utilities.DbObject.create('summary', SummaryDB, 1, base=utilities.KeyValueObject)
+SummaryDB = db_registry.DbRegistry.create('summary', 7, "Database for storing summarizing health data.")
+Summary = utilities.DbObject.create('summary', SummaryDB, 1, base=UpsertKeyValueObject)
 
 
 class YearsSummary(SummaryDB.Base, sb.SummaryBase):
@@ -57,7 +60,9 @@ class WeeksSummary(SummaryDB.Base, sb.SummaryBase):
     __tablename__ = 'weeks_summary'
 
     db = SummaryDB
-    table_version = 3
+    table_version = 4
+    # Weeks used to start on the day of the year, now they are ISO weeks.
+    table_migrations = {3 : SchemaMigrations.delete_rows()}
     view_version = sb.SummaryBase.view_version
 
     first_day = Column(Date, primary_key=True)
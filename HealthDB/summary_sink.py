@@ -0,0 +1,76 @@
+"""Write summaries that are computed once to every database that keeps a copy of them."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+class SummarySink(object):
+    """
+    Collects summary rows and key-value statistics and writes them to each of the databases that keep a copy of them.
+
+    A target is a database, its key-value table, and a dict of period name to the table holding the summaries of the period.
+    Rows are buffered until flush() writes them to every target with multi-row upserts, in one session per database. If the
+    databases are attached to one shared connection, like a UnifiedDB, only the first target is written and the rows are
+    copied to the others with INSERT ... SELECT.
+    """
+
+    def __init__(self, shared_db=None):
+        """Return a new SummarySink instance that writes over the shared database connection if one is given."""
+        self.shared_db = shared_db
+        self.targets = []
+        self.__rows = {}
+        self.__stats = {}
+
+    def add_target(self, db, key_value_table, tables):
+        """Add a database to write the summaries to, tables is a dict of period name to summary table."""
+        self.targets.append((db, key_value_table, tables))
+
+    def add_rows(self, period, rows):
+        """Buffer summary rows, dicts of column values, for a period."""
+        self.__rows.setdefault(period, []).extend(rows)
+
+    def set_stat(self, key, value):
+        """Buffer a key-value statistic."""
+        self.__stats[key] = {'timestamp' : datetime.datetime.now(), 'key' : key, 'value' : str(value)}
+
+    def __target_rows(self, key_value_table, tables):
+        # The tables of a target paired with the buffered rows for them.
+        target_rows = [(tables[period], rows) for period, rows in self.__rows.items() if rows]
+        if self.__stats:
+            target_rows.append((key_value_table, list(self.__stats.values())))
+        return target_rows
+
+    @classmethod
+    def __s_write(cls, session, table, rows):
+        # Tables of different databases may not have all of the same columns.
+        table.s_insert_or_update_many(session, [table.intersection(row) for row in rows])
+
+    def __flush_shared(self):
+        (_, first_key_value_table, first_tables), other_targets = self.targets[0], self.targets[1:]
+        with self.shared_db.managed_session() as session:
+            first_target_rows = self.__target_rows(first_key_value_table, first_tables)
+            for table, rows in first_target_rows:
+                self.__s_write(session, table, rows)
+            for _, key_value_table, tables in other_targets:
+                for (from_table, rows), (to_table, _) in zip(first_target_rows, self.__target_rows(key_value_table, tables)):
+                    key_col_name = from_table.primary_key_cols[0]
+                    self.shared_db.s_copy_table(session, from_table, to_table, [row[key_col_name] for row in rows])
+
+    def flush(self):
+        """Write the buffered rows and statistics to every target and clear the buffers."""
+        if self.shared_db is not None:
+            self.__flush_shared()
+        else:
+            for db, key_value_table, tables in self.targets:
+                with db.managed_session() as session:
+                    for table, rows in self.__target_rows(key_value_table, tables):
+                        self.__s_write(session, table, rows)
+        self.__rows.clear()
+        self.__stats.clear()
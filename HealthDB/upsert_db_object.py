@@ -0,0 +1,137 @@
+"""A database object base class that writes rows with native INSERT ... ON CONFLICT statements."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+from sqlalchemy import Integer, Float, Numeric, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import utilities
+from HealthDB.db_object import DbObject
+from HealthDB.dirty_day_recorder import DirtyDayRecorder
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpsertDbObject(DbObject):
+    """Base class for database objects that insert or update rows with one INSERT ... ON CONFLICT DO UPDATE statement on SQLite."""
+
+    # Stay under SQLITE_MAX_VARIABLE_NUMBER for older SQLite versions.
+    max_statement_variables = 999
+    # Tables that summaries are computed from record the days they are written for, see DirtyDayRecorder.
+    marks_dirty_days = False
+
+    @classmethod
+    def _primary_key_names(cls):
+        return [col.name for col in cls.__table__.primary_key.columns]
+
+    @classmethod
+    def _s_upsert_table(cls, session, values):
+        """Return the table a row should be written to, subclasses that split a table up override this."""
+        return cls.__table__
+
+    @classmethod
+    def _s_insert_or_update_fallback(cls, session, values_dict, ignore_none, ignore_zero):
+        """Write a row that can't be written with a native upsert through the ORM, subclasses that split a table up override this."""
+        return super().s_insert_or_update(session, values_dict, ignore_none, ignore_zero)
+
+    @classmethod
+    def _s_record_dirty_day(cls, session, values_dict):
+        # Rows updated without their time, like activity details, mark the day of the row that is already stored.
+        if cls.marks_dirty_days and values_dict.get(cls.time_col_name) is None:
+            primary_key_names = cls._primary_key_names()
+            if all(values_dict.get(name) is not None for name in primary_key_names):
+                query = session.query(getattr(cls, cls.time_col_name))
+                for name in primary_key_names:
+                    query = query.filter(getattr(cls, name) == values_dict[name])
+                DirtyDayRecorder.record_values(cls, {cls.time_col_name : query.scalar()})
+                return
+        DirtyDayRecorder.record_values(cls, values_dict)
+
+    @classmethod
+    def _required_col_names(cls):
+        return [col.name for col in cls.__table__.columns if col.primary_key or (not col.nullable and col.default is None and col.server_default is None)]
+
+    @classmethod
+    def _upsert_values(cls, session, values_dict, ignore_none):
+        # Return the values to insert natively, or None if the row needs the ORM. Like the ORM, leave out None values so that
+        # column defaults apply to new rows. Keys that aren't columns, like hybrid properties, and rows missing required columns need the ORM.
+        if session.get_bind().dialect.name != 'sqlite':
+            return None
+        columns = cls.__table__.columns
+        if not all(key in columns for key in values_dict):
+            return None
+        if ignore_none:
+            values = {key : value for key, value in values_dict.items() if value is not None}
+        elif any(value is None and (columns[key].default is not None or not columns[key].nullable) for key, value in values_dict.items()):
+            return None
+        else:
+            values = values_dict
+        # SQLite checks NOT NULL constraints before it looks for a conflicting row.
+        if not all(col_name in values for col_name in cls._required_col_names()):
+            return None
+        return values
+
+    @classmethod
+    def _update_value(cls, table, statement, col_name, ignore_zero):
+        # None values were left out of the rows, but zeros have to be ignored row by row by keeping the existing value.
+        column = table.columns[col_name]
+        new_value = statement.excluded[col_name]
+        if ignore_zero and isinstance(column.type, (Integer, Float, Numeric)):
+            return case([(new_value == 0, column)], else_=new_value)
+        return new_value
+
+    @classmethod
+    def s_insert_or_update(cls, session, values_dict, ignore_none=False, ignore_zero=False):
+        """Create a database record if it doesn't exist. Update it if does exist."""
+        cls._s_record_dirty_day(session, values_dict)
+        values = cls._upsert_values(session, values_dict, ignore_none)
+        if values is None:
+            return cls._s_insert_or_update_fallback(session, values_dict, ignore_none, ignore_zero)
+        primary_key_names = cls._primary_key_names()
+        update_values = {key : value for key, value in values.items() if key not in primary_key_names and (not ignore_zero or value != 0)}
+        # Pending ORM changes have to reach the database before the statement that may conflict with them.
+        session.flush()
+        statement = sqlite_insert(cls._s_upsert_table(session, values)).values(values)
+        if update_values:
+            statement = statement.on_conflict_do_update(index_elements=primary_key_names, set_=update_values)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=primary_key_names)
+        session.execute(statement)
+
+    @classmethod
+    def s_insert_or_update_many(cls, session, values_dicts, ignore_none=False, ignore_zero=False):
+        """Create or update a batch of database records using multi-row statements."""
+        batches = {}
+        for values_dict in values_dicts:
+            cls._s_record_dirty_day(session, values_dict)
+            values = cls._upsert_values(session, values_dict, ignore_none)
+            if values is None:
+                cls._s_insert_or_update_fallback(session, values_dict, ignore_none, ignore_zero)
+            else:
+                batches.setdefault((cls._s_upsert_table(session, values), tuple(sorted(values.keys()))), []).append(values)
+        session.flush()
+        for (table, keys), batch in batches.items():
+            primary_key_names = cls._primary_key_names()
+            rows_per_statement = max(1, cls.max_statement_variables // len(keys))
+            for start in range(0, len(batch), rows_per_statement):
+                statement = sqlite_insert(table).values(batch[start:start + rows_per_statement])
+                update_values = {key : cls._update_value(table, statement, key, ignore_zero) for key in keys if key not in primary_key_names}
+                if update_values:
+                    statement = statement.on_conflict_do_update(index_elements=primary_key_names, set_=update_values)
+                else:
+                    statement = statement.on_conflict_do_nothing(index_elements=primary_key_names)
+                session.execute(statement)
+
+    @classmethod
+    def insert_or_update_many(cls, db, values_dicts, ignore_none=False, ignore_zero=False):
+        """Create or update a batch of database records using multi-row statements."""
+        with db.managed_session() as session:
+            cls.s_insert_or_update_many(session, values_dicts, ignore_none, ignore_zero)
+
+
+class UpsertKeyValueObject(UpsertDbObject, utilities.KeyValueObject):
+    """Base class for key-value database objects that insert or update rows with INSERT ... ON CONFLICT DO UPDATE statements."""
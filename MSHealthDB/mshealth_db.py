@@ -9,12 +9,13 @@ import logging
 from sqlalchemy import Column, Integer, Date, DateTime, Float
 
 import Fit.conversions as conversions
+import HealthDB
 import utilities
 
 
 logger = logging.getLogger(__name__)
 
-MSHealthDB = utilities.DB.create('mshealth', 2, "Database for storing health data from Microsoft Health.")
+MSHealthDB = HealthDB.DbRegistry.create('mshealth', 2, "Database for storing health data from Microsoft Health.")
 Attributes = utilities.DbObject.create('attributes', MSHealthDB, 1, base=utilities.KeyValueObject, doc="key-value data from a Microsoft Health device.")
 
 
@@ -29,6 +29,9 @@ class ActivityFitFileProcessor(FitFileProcessor):
         self.garmin_act_db = GarminDB.ActivitiesDB(self.db_params, self.debug - 1)
         with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_act_db.managed_session() as self.garmin_act_db_session:
             self._write_message_types(fit_file, fit_file.message_types)
+            activity_id = GarminDB.File.id_from_path(fit_file.filename)
+            GarminDB.ActivitiesLocationIndex.s_update(self.garmin_act_db_session, activity_id)
+            GarminDB.ActivityRoutes.s_update(self.garmin_act_db_session, activity_id)
             # Now write a file's worth of data to the DB
             self.garmin_act_db_session.commit()
             self.garmin_db_session.commit()
@@ -50,6 +53,7 @@ class ActivityFitFileProcessor(FitFileProcessor):
         """Write all record messages to the database."""
         for record_num, message in enumerate(messages):
             self._write_record_entry(fit_file, message.fields, record_num)
+        GarminDB.ActivityTracks.s_create_from_records(self.garmin_act_db_session, GarminDB.File.id_from_path(fit_file.filename))
 
     def _write_record_entry(self, fit_file, message_fields, record_num):
         # We don't get record data from multiple sources so we don't need to coellesce data in the DB.
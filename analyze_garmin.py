@@ -7,13 +7,15 @@ __license__ = "GPL"
 import sys
 import logging
 import datetime
-import calendar
-from tqdm import tqdm
+import bisect
+import concurrent.futures
+import multiprocessing
 
 import Fit
 import Fit.conversions
 import HealthDB
 import GarminDB
+from garmin_db_config_manager import GarminDBConfigManager
 from garmin_connect_config_manager import GarminConnectConfigManager
 from utilities.list_and_dict import list_not_none
 
@@ -21,45 +23,67 @@ from utilities.list_and_dict import list_not_none
 logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 stat_logger = logging.getLogger('stats')
-stat_logger.addHandler(logging.FileHandler('stats.txt', 'w'))
 
 
 class Analyze(object):
     """Object for analyzing health data from Garmin devices."""
 
-    def __init__(self, db_params, debug):
-        """Return an instance of the Analyze class."""
+    # The stats file is opened when stats are first calculated, not on import, so that worker processes that import this module don't truncate it.
+    stats_handler = None
+
+    def __init__(self, db_params, debug, unified=False, max_hr=None):
+        """
+        Return an instance of the Analyze class.
+
+        If unified is True summaries are generated over one connection to all of the databases. max_hr is the user's configured
+        maximum heart rate for training loads.
+        """
         self.garmin_db = GarminDB.GarminDB(db_params, debug)
         self.garmin_mon_db = GarminDB.MonitoringDB(db_params, debug)
         self.garmin_sum_db = GarminDB.GarminSummaryDB(db_params, debug)
         self.sum_db = HealthDB.SummaryDB(db_params, debug)
         self.garmin_act_db = GarminDB.ActivitiesDB(db_params, debug)
+        self.unified_db = GarminDB.UnifiedDB(db_params, debug) if unified else None
+        self.db_params = db_params
+        self.debug = debug
+        self.max_hr = max_hr
         self.measurement_system = GarminDB.Attributes.measurements_type(self.garmin_db)
+        # Summaries are computed once and written to both the GarminDB and HealthDB summary databases.
+        self.summary_sink = HealthDB.SummarySink(self.unified_db)
+        self.summary_sink.add_target(self.garmin_sum_db, GarminDB.Summary, {
+            'days'      : GarminDB.DaysSummary,
+            'weeks'     : GarminDB.WeeksSummary,
+            'months'    : GarminDB.MonthsSummary,
+            'years'     : GarminDB.YearsSummary
+        })
+        self.summary_sink.add_target(self.sum_db, HealthDB.Summary, {
+            'days'      : HealthDB.DaysSummary,
+            'weeks'     : HealthDB.WeeksSummary,
+            'months'    : HealthDB.MonthsSummary,
+            'years'     : HealthDB.YearsSummary
+        })
         self.unit_strings = Fit.units.unit_strings[self.measurement_system]
 
     def __save_summary_stat(self, name, value):
-        GarminDB.Summary.set(self.garmin_sum_db, name, value)
-        HealthDB.Summary.set(self.sum_db, name, value)
-
-    def __report_file_type(self, file_type):
-        records = GarminDB.File.row_count(self.garmin_db, GarminDB.File.type, file_type)
-        if records > 0:
-            stat_logger.info("%s files: %d", file_type, records)
-            self.__save_summary_stat(file_type + '_files', records)
+        self.summary_sink.set_stat(name, value)
 
     def __get_files_stats(self):
-        records = GarminDB.File.row_count(self.garmin_db)
+        # One query for the number of files of each type.
+        files_by_type = GarminDB.File.get_col_stats_by(self.garmin_db, {'records' : (GarminDB.File.id, 'count')}, GarminDB.File.type)
+        records = sum([stats['records'] for stats in files_by_type.values()])
         stat_logger.info("File records: %d" % records)
         self.__save_summary_stat('files', records)
-        for file_type_name in [file_type.name for file_type in GarminDB.File.FileType]:
-            self.__report_file_type(file_type_name)
+        for file_type in GarminDB.File.FileType:
+            records = files_by_type.get(file_type, {}).get('records', 0)
+            if records > 0:
+                stat_logger.info("%s files: %d", file_type.name, records)
+                self.__save_summary_stat(file_type.name + '_files', records)
 
-    def __report_sport(self, sport_col, sport):
-        Fit.units.unit_strings[self.measurement_system]
-        records = GarminDB.Activities.row_count(self.garmin_act_db, sport_col, sport)
+    def __report_sport(self, sport, sport_stats):
+        records = sport_stats['records']
         if records > 0:
             sport_title = sport.title().replace('_', ' ')
-            total_distance = GarminDB.Activities.get_col_sum_for_value(self.garmin_act_db, GarminDB.Activities.distance, sport_col, sport)
+            total_distance = sport_stats['distance']
             if total_distance is None:
                 total_distance = 0
                 average_distance = 0
@@ -73,7 +97,13 @@ class Analyze(object):
 
     def __get_activities_stats(self):
         stat_logger.info("___Activities Statistics___")
-        activities = GarminDB.Activities.row_count(self.garmin_act_db)
+        # One query for the number of activities and distance of each sport and one for the number of each type.
+        sports_stats = GarminDB.Activities.get_col_stats_by(self.garmin_act_db, {
+            'records'   : (GarminDB.Activities.activity_id, 'count'),
+            'distance'  : (GarminDB.Activities.distance, 'sum')
+        }, GarminDB.Activities.sport)
+        types_stats = GarminDB.Activities.get_col_stats_by(self.garmin_act_db, {'records' : (GarminDB.Activities.activity_id, 'count')}, GarminDB.Activities.type)
+        activities = sum([stats['records'] for stats in sports_stats.values()])
         stat_logger.info("Total activities: %d", activities)
         self.__save_summary_stat('Activities', activities)
         laps = GarminDB.ActivityLaps.row_count(self.garmin_act_db)
@@ -85,39 +115,35 @@ class Analyze(object):
         years = GarminDB.Activities.get_years(self.garmin_act_db)
         stat_logger.info("Years with activities: %d: %s", len(years), years)
         self.__save_summary_stat('Activity_Years', len(years))
-        fitness_activities = GarminDB.Activities.row_count(self.garmin_act_db, GarminDB.Activities.type, 'fitness')
+        fitness_activities = types_stats.get('fitness', {}).get('records', 0)
         stat_logger.info("Fitness activities: %d", fitness_activities)
         self.__save_summary_stat('Fitness_activities', fitness_activities)
-        recreation_activities = GarminDB.Activities.row_count(self.garmin_act_db, GarminDB.Activities.type, 'recreation')
+        recreation_activities = types_stats.get('recreation', {}).get('records', 0)
         stat_logger.info("Recreation activities: %d", recreation_activities)
         self.__save_summary_stat('Recreation_activities', recreation_activities)
-        sports = list_not_none(GarminDB.Activities.get_col_distinct(self.garmin_act_db, GarminDB.Activities.sport))
+        sports = list_not_none(sports_stats.keys())
         stat_logger.info("Sports: %s", ', '.join(sports))
         sub_sports = list_not_none(GarminDB.Activities.get_col_distinct(self.garmin_act_db, GarminDB.Activities.sub_sport))
         stat_logger.info("SubSports: %s", ', '.join(sub_sports))
         for sport_name in [sport.name for sport in Fit.Sport]:
-            self.__report_sport(GarminDB.Activities.sport, sport_name)
+            self.__report_sport(sport_name, sports_stats.get(sport_name, {'records' : 0, 'distance' : None}))
 
     def __get_col_stats(self, table, col, name, ignore_le_zero=False, time_col=False):
-        records = table.row_count(self.garmin_db)
-        self.__save_summary_stat('%s_Records' % name, records)
-        if time_col:
-            maximum = table.get_time_col_max(self.garmin_db, col)
-        else:
-            maximum = table.get_col_max(self.garmin_db, col)
-        self.__save_summary_stat('Max_%s' % name, maximum)
-        if time_col:
-            minimum = table.get_time_col_min(self.garmin_db, col)
-        else:
-            minimum = table.get_col_min(self.garmin_db, col, None, None, ignore_le_zero)
-        self.__save_summary_stat('Min_%s' % name, minimum)
-        if time_col:
-            average = table.get_time_col_avg(self.garmin_db, col)
-        else:
-            average = table.get_col_avg(self.garmin_db, col, None, None, ignore_le_zero)
-        self.__save_summary_stat('Avg_%s' % name, average)
+        # The count and aggregates in one query, time aggregates always ignore zero times.
+        aggregate_prefix = 'time_' if time_col else ''
+        where = True if ignore_le_zero else None
+        stats = table.get_col_stats(self.garmin_db, {
+            'records'   : (table.time_col, 'count'),
+            'maximum'   : (col, aggregate_prefix + 'max'),
+            'minimum'   : (col, aggregate_prefix + 'min', where),
+            'average'   : (col, aggregate_prefix + 'avg', where)
+        })
+        self.__save_summary_stat('%s_Records' % name, stats['records'])
+        self.__save_summary_stat('Max_%s' % name, stats['maximum'])
+        self.__save_summary_stat('Min_%s' % name, stats['minimum'])
+        self.__save_summary_stat('Avg_%s' % name, stats['average'])
         latest = table.get_col_latest(self.garmin_db, col)
-        stat_logger.info("%s records: %s max: %s min: %s avg: %s latest: %s", name, records, maximum, minimum, average, latest)
+        stat_logger.info("%s records: %s max: %s min: %s avg: %s latest: %s", name, stats['records'], stats['maximum'], stats['minimum'], stats['average'], latest)
 
     def __get_monitoring_stats(self):
         stat_logger.info("___Monitoring Statistics___")
@@ -127,29 +153,27 @@ class Analyze(object):
         self.__get_col_stats(GarminDB.Sleep, GarminDB.Sleep.total_sleep, 'Sleep', True, True)
         self.__get_col_stats(GarminDB.Sleep, GarminDB.Sleep.rem_sleep, 'REM Sleep', True, True)
 
-    def __get_monitoring_days(self, year):
-        days = GarminDB.Monitoring.get_days(self.garmin_mon_db, year)
-        days_count = len(days)
-        if days_count > 0:
-            first_day = days[0]
-            last_day = days[-1]
-            span = last_day - first_day + 1
-        else:
-            span = 0
+    def __update_coverage(self):
+        # One windowed query per table finds the runs of days with data, reports read them from the coverage table.
+        for db, table in [(self.garmin_mon_db, GarminDB.Monitoring), (self.garmin_db, GarminDB.Sleep), (self.garmin_db, GarminDB.RestingHeartRate),
+                          (self.garmin_db, GarminDB.Weight)]:
+            GarminDB.Coverage.update(self.garmin_sum_db, db, table)
+
+    def __get_monitoring_days(self, year, month_days):
+        days_count = sum([days for month, days in month_days.items() if month.year == year])
+        runs = GarminDB.Coverage.get_runs(self.garmin_sum_db, GarminDB.Monitoring, year)
+        span = (runs[-1][1] - runs[0][0]).days + 1 if runs else 0
         self.__save_summary_stat(str(year) + '_days', days_count)
         self.__save_summary_stat(str(year) + '_days_span', span)
-        stat_logger.info("%d Days with data (%d count vs %d span): %s", year, days_count, span, days)
-        for index in range(days_count - 1):
-            day = int(days[index])
-            next_day = int(days[index + 1])
-            if next_day != day + 1:
-                day_str = str(Fit.conversions.day_of_the_year_to_datetime(year, day))
-                next_day_str = str(Fit.conversions.day_of_the_year_to_datetime(year, next_day))
-                stat_logger.info("Days gap between %d (%s) and %d (%s)", day, day_str, next_day, next_day_str)
+        stat_logger.info("%d Days with data (%d count vs %d span): %s", year, days_count, span, ', '.join([f'{first_day} - {last_day}' for first_day, last_day in runs]))
+        for first_day, last_day in GarminDB.Coverage.get_gaps(self.garmin_sum_db, GarminDB.Monitoring, year):
+            day = first_day - datetime.timedelta(1)
+            next_day = last_day + datetime.timedelta(1)
+            stat_logger.info("Days gap between %d (%s) and %d (%s)", day.timetuple().tm_yday, day, next_day.timetuple().tm_yday, next_day)
         return days_count
 
-    def __get_monitoring_months(self, year):
-        months = GarminDB.Monitoring.get_month_names(self.garmin_mon_db, year)
+    def __get_monitoring_months(self, year, month_days):
+        months = [month.strftime("%b") for month in month_days if month.year == year]
         self.__save_summary_stat(str(year) + '_months', len(months))
         stat_logger.info("%s Months with data (%s): %s", year, len(months), months)
 
@@ -158,168 +182,206 @@ class Analyze(object):
         stat_logger.info("This shows periods that data has been downloaded for. "
                          "Not seeing data for days you know Garmin has data? "
                          "Change the starting day and the number of days in GarminConnectConfig.json and do a full download.")
-        years = GarminDB.Monitoring.get_years(self.garmin_mon_db)
+        month_days = GarminDB.Coverage.get_month_days(self.garmin_sum_db, GarminDB.Monitoring)
+        years = sorted({month.year for month in month_days})
         self.__save_summary_stat('Monitoring_Years', len(years))
         stat_logger.info("Monitoring records: %d", GarminDB.Monitoring.row_count(self.garmin_mon_db))
         stat_logger.info("Monitoring Years with data (%d): %s", len(years), years)
         total_days = 0
         for year in years:
-            self.__get_monitoring_months(year)
-            total_days += self.__get_monitoring_days(year)
+            self.__get_monitoring_months(year, month_days)
+            total_days += self.__get_monitoring_days(year, month_days)
         stat_logger.info("Total days with monitoring data: %d", total_days)
 
     def get_stats(self):
         """Calculate summary statistics."""
+        if Analyze.stats_handler is None:
+            Analyze.stats_handler = logging.FileHandler('stats.txt', 'w')
+            stat_logger.addHandler(Analyze.stats_handler)
         self.__get_files_stats()
         self.__get_activities_stats()
         self.__get_monitoring_stats()
+        self.__update_coverage()
         self.__get_monitoring_years()
+        self.summary_sink.flush()
 
-    def __populate_hr_intensity(self, day_date, garmin_mon_session, garmin_sum_session, overwrite=False):
-        if GarminDB.IntensityHR.s_row_count_for_day(garmin_sum_session, day_date) == 0 or overwrite:
-            monitoring_rows = GarminDB.Monitoring._get_for_day(garmin_mon_session, day_date, not_none_col=GarminDB.Monitoring.intensity)
-            previous_ts = None
-            for monitoring in monitoring_rows:
-                # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
-                # measurement period falls within the activity period.
-                if previous_ts is not None and (monitoring.timestamp - previous_ts).total_seconds() > 60:
-                    hr_rows = GarminDB.MonitoringHeartRate.s_get_for_period(garmin_mon_session, previous_ts, previous_ts + datetime.timedelta(seconds=60),
-                                                                            not_none_col=monitoring.timestamp)
-                    for hr in hr_rows:
-                        entry = {
-                            'timestamp'     : hr.timestamp,
-                            'intensity'     : monitoring.intensity,
-                            'heart_rate'    : hr.heart_rate
-                        }
-                        GarminDB.IntensityHR.s_insert_or_update(garmin_sum_session, entry, ignore_none=True)
-                previous_ts = monitoring.timestamp
-
-    def __calculate_day_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_daily_stats(garmin_session, day_date)
-        # prefer getting stats from the daily summary.
-        if stats.get('rhr_avg') is None:
-            stats.update(GarminDB.RestingHeartRate.get_daily_stats(garmin_session, day_date))
-        if stats.get('stress_avg') is None:
-            stats.update(GarminDB.Stress.get_daily_stats(garmin_session, day_date))
-        if stats.get('intensity_time') is None:
-            stats.update(GarminDB.MonitoringIntensity.get_daily_stats(garmin_mon_session, day_date))
-        if stats.get('floors') is None:
-            stats.update(GarminDB.MonitoringClimb.get_daily_stats(garmin_mon_session, day_date, self.measurement_system))
-        if stats.get('steps') is None:
-            stats.update(GarminDB.Monitoring.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.MonitoringHeartRate.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.IntensityHR.get_daily_stats(garmin_sum_session, day_date))
-        stats.update(GarminDB.Weight.get_daily_stats(garmin_session, day_date))
-        stats.update(GarminDB.Sleep.get_daily_stats(garmin_session, day_date))
-        stats.update(GarminDB.Activities.get_daily_stats(garmin_act_session, day_date))
-        # save it to the db
-        GarminDB.DaysSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.DaysSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_days(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        days = GarminDB.Monitoring.s_get_days(garmin_mon_session, year)
-        for day in tqdm(days, unit='days'):
-            day_date = datetime.date(year, 1, 1) + datetime.timedelta(day - 1)
-            self.__populate_hr_intensity(day_date, garmin_mon_session, garmin_sum_session)
-            self.__calculate_day_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def __calculate_week_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_weekly_stats(garmin_session, day_date)
-        # prefer getting stats from the daily summary.
-        if stats.get('rhr_avg') is None:
-            stats.update(GarminDB.RestingHeartRate.get_weekly_stats(garmin_session, day_date))
-        if stats.get('stress_avg') is None:
-            stats.update(GarminDB.Stress.get_weekly_stats(garmin_session, day_date))
-        if stats.get('intensity_time') is None:
-            stats.update(GarminDB.MonitoringIntensity.get_weekly_stats(garmin_mon_session, day_date))
-        if stats.get('floors') is None:
-            stats.update(GarminDB.MonitoringClimb.get_weekly_stats(garmin_mon_session, day_date, self.measurement_system))
-        if stats.get('steps') is None:
-            stats.update(GarminDB.Monitoring.get_weekly_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.MonitoringHeartRate.get_weekly_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.IntensityHR.get_weekly_stats(garmin_sum_session, day_date))
-        stats.update(GarminDB.Weight.get_weekly_stats(garmin_session, day_date))
-        stats.update(GarminDB.Sleep.get_weekly_stats(garmin_session, day_date))
-        stats.update(GarminDB.Activities.get_weekly_stats(garmin_act_session, day_date))
-        # save it to the db
-        GarminDB.WeeksSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.WeeksSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_weeks(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        for week_starting_day in tqdm(range(1, 365, 7), unit='weeks'):
-            day_date = datetime.date(year, 1, 1) + datetime.timedelta(week_starting_day - 1)
-            if day_date < datetime.datetime.now().date():
-                self.__calculate_week_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def __calculate_month_stats(self, start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_monthly_stats(garmin_session, start_day_date, end_day_date)
-        # prefer getting stats from the daily summary.
-        if 'rhr_avg' in stats:
-            stats.update(GarminDB.RestingHeartRate.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        if 'stress_avg' in stats:
-            stats.update(GarminDB.Stress.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        if 'intensity_time' in stats:
-            stats.update(GarminDB.MonitoringIntensity.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        if 'floors' in stats:
-            stats.update(GarminDB.MonitoringClimb.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date, self.measurement_system))
-        if 'steps' in stats:
-            stats.update(GarminDB.Monitoring.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        stats.update(GarminDB.MonitoringHeartRate.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        stats.update(GarminDB.IntensityHR.get_monthly_stats(garmin_sum_session, start_day_date, end_day_date))
-        stats.update(GarminDB.Weight.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        stats.update(GarminDB.Sleep.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        stats.update(GarminDB.Activities.get_monthly_stats(garmin_act_session, start_day_date, end_day_date))
-        # save it to the db
-        GarminDB.MonthsSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.MonthsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_months(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        months = GarminDB.Monitoring.s_get_months(garmin_mon_session, year)
-        for month in tqdm(months, unit='months'):
-            start_day_date = datetime.date(year, month, 1)
-            end_day_date = datetime.date(year, month, calendar.monthrange(year, month)[1])
-            self.__calculate_month_stats(start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def __calculate_year_stats(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_yearly_stats(garmin_session, year)
+    def __populate_hr_intensity(self, days, garmin_mon_session, garmin_sum_session, overwrite=False):
+        if not overwrite:
+            rows_per_day = GarminDB.IntensityHR.s_get_col_stats_per_day(garmin_sum_session, {'rows' : (GarminDB.IntensityHR.timestamp, 'count')}, days)
+            days = [day for day in days if rows_per_day[day]['rows'] == 0]
+        if len(days) == 0:
+            return
+        start_ts = datetime.datetime.combine(days[0], datetime.time.min)
+        end_ts = datetime.datetime.combine(days[-1], datetime.time.min) + datetime.timedelta(1)
+        # Read the monitoring rows and heart rates for all of the days once and merge them by timestamp.
+        hr_rows = GarminDB.MonitoringHeartRate.s_get_heart_rates(garmin_mon_session, start_ts, end_ts)
+        hr_timestamps = [hr_row[0] for hr_row in hr_rows]
+        days = set(days)
+        entries = []
+        previous_ts = None
+        for timestamp, intensity in GarminDB.Monitoring.s_get_intensities(garmin_mon_session, start_ts, end_ts):
+            # Intensity periods don't span days.
+            if previous_ts is not None and previous_ts.date() != timestamp.date():
+                previous_ts = None
+            # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
+            # measurement period falls within the activity period.
+            if previous_ts is not None and (timestamp - previous_ts).total_seconds() > 60 and timestamp.date() in days:
+                first = bisect.bisect_left(hr_timestamps, previous_ts)
+                last = bisect.bisect_left(hr_timestamps, previous_ts + datetime.timedelta(seconds=60))
+                entries.extend([{'timestamp' : hr_ts, 'intensity' : intensity, 'heart_rate' : heart_rate} for hr_ts, heart_rate in hr_rows[first:last]])
+            previous_ts = timestamp
+        GarminDB.IntensityHR.s_insert_or_update_many(garmin_sum_session, entries, ignore_none=True)
+
+    def __fill_days_stats(self, days_stats, stat_name, get_days_stats):
+        # prefer the stats already gathered, only query the source for the days that are missing the stat.
+        days = [day for day, stats in days_stats.items() if stats.get(stat_name) is None]
+        if days:
+            for day, stats in get_days_stats(days).items():
+                days_stats[day].update(stats)
+
+    def __calculate_days_stats(self, days, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session):
+        # One query per source table for all of the days, merged day by day.
+        days_stats = GarminDB.DailySummary.s_get_days_stats(garmin_session, days)
         # prefer getting stats from the daily summary.
-        if 'rhr_avg' in stats:
-            stats.update(GarminDB.RestingHeartRate.get_yearly_stats(garmin_session, year))
-        if 'stress_avg' in stats:
-            stats.update(GarminDB.Stress.get_yearly_stats(garmin_session, year))
-        if 'intensity_time' in stats:
-            stats.update(GarminDB.MonitoringIntensity.get_yearly_stats(garmin_mon_session, year))
-        if 'floors' in stats:
-            stats.update(GarminDB.MonitoringClimb.get_yearly_stats(garmin_mon_session, year, self.measurement_system))
-        if 'steps' in stats:
-            stats.update(GarminDB.Monitoring.get_yearly_stats(garmin_mon_session, year))
-        stats.update(GarminDB.MonitoringHeartRate.get_yearly_stats(garmin_mon_session, year))
-        stats.update(GarminDB.IntensityHR.get_yearly_stats(garmin_sum_session, year))
-        stats.update(GarminDB.Weight.get_yearly_stats(garmin_session, year))
-        stats.update(GarminDB.Sleep.get_yearly_stats(garmin_session, year))
-        stats.update(GarminDB.Activities.get_yearly_stats(garmin_act_session, year))
-        # save it to the db
-        GarminDB.YearsSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.YearsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_year(self, year):
+        self.__fill_days_stats(days_stats, 'rhr_avg', lambda days: GarminDB.RestingHeartRate.s_get_days_stats(garmin_session, days))
+        self.__fill_days_stats(days_stats, 'stress_avg', lambda days: GarminDB.Stress.s_get_days_stats(garmin_session, days))
+        self.__fill_days_stats(days_stats, 'intensity_time', lambda days: GarminDB.MonitoringIntensity.s_get_days_stats(garmin_mon_session, days))
+        self.__fill_days_stats(days_stats, 'floors', lambda days: GarminDB.MonitoringClimb.s_get_days_stats(garmin_mon_session, days, self.measurement_system))
+        self.__fill_days_stats(days_stats, 'steps', lambda days: GarminDB.Monitoring.s_get_days_stats(garmin_mon_session, days))
+        for table_days_stats in [
+            GarminDB.MonitoringHeartRate.s_get_days_stats(garmin_mon_session, days),
+            GarminDB.IntensityHR.s_get_days_stats(garmin_sum_session, days),
+            GarminDB.Weight.s_get_days_stats(garmin_session, days),
+            GarminDB.Sleep.s_get_days_stats(garmin_session, days),
+            GarminDB.Activities.s_get_days_stats(garmin_act_session, days)
+        ]:
+            for day, stats in table_days_stats.items():
+                days_stats[day].update(stats)
+        return list(days_stats.values())
+
+    def __get_days(self, year, dirty_days, garmin_mon_session):
+        # Return the days of the year to summarize. All of them, or if dirty days are given, only the dirty ones.
+        days = [datetime.date(year, 1, 1) + datetime.timedelta(day - 1) for day in GarminDB.Monitoring.s_get_days(garmin_mon_session, year)]
+        if dirty_days is not None:
+            days = [day for day in days if day in dirty_days]
+        return days
+
+    def __populate_year_hr_intensity(self, year, dirty_days, garmin_mon_session, garmin_sum_session):
+        self.__populate_hr_intensity(self.__get_days(year, dirty_days, garmin_mon_session), garmin_mon_session, garmin_sum_session)
+
+    def __calculate_year_summaries(self, year, dirty_days, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session):
+        days = self.__get_days(year, dirty_days, garmin_mon_session)
+        return {'days' : self.__calculate_days_stats(days, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session)}
+
+    def get_year_summaries(self, year, dirty_days=None):
+        """Return a dict of period to the summary rows of the days of a year, for all days or only the dirty days, without writing them."""
+        if self.unified_db:
+            with self.unified_db.managed_session() as session:
+                return self.__calculate_year_summaries(year, dirty_days, session, session, session, session)
         with self.garmin_db.managed_session() as garmin_session, self.garmin_mon_db.managed_session() as garmin_mon_session, \
-                self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session, \
-                self.sum_db.managed_session() as sum_session:
-            # calculate part of the years
-            self.__calculate_days(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_weeks(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_months(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            # now calculate the year itself
-            self.__calculate_year_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def summary(self):
-        """Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated."""
+                self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session:
+            return self.__calculate_year_summaries(year, dirty_days, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session)
+
+    def __save_year_summaries(self, summaries):
+        for period, rows in summaries.items():
+            self.summary_sink.add_rows(period, rows)
+        self.summary_sink.flush()
+
+    def __rollup_summaries(self, dirty_days):
+        # Weeks, months, and years are rolled up from the saved day summaries once the days of every year are saved, so that
+        # the ISO weeks that span two years are complete. The periods come from the calendar table.
+        period_tables = {'weeks' : GarminDB.WeeksSummary, 'months' : GarminDB.MonthsSummary, 'years' : GarminDB.YearsSummary}
+        # Roll up the periods with dirty days, or all periods when there are no dirty days or the table has no rows yet.
+        all_periods = {period : dirty_days is None or table.row_count(self.garmin_sum_db) == 0 for period, table in period_tables.items()}
+        with self.garmin_sum_db.managed_session() as session:
+            first_day = GarminDB.DaysSummary.s_get_col_min(session, GarminDB.DaysSummary.day)
+            last_day = GarminDB.DaysSummary.s_get_col_max(session, GarminDB.DaysSummary.day)
+            if first_day is None:
+                return
+            GarminDB.Calendar.s_update(session, first_day, last_day)
+            days_query = session.query(GarminDB.DaysSummary.day)
+            dirty_days_query = days_query.filter(GarminDB.DaysSummary.day.in_(session.query(GarminDB.DirtyDays.day)))
+            periods = {period : GarminDB.Calendar.s_get_periods(session, period, days_query if all_periods[period] else dirty_days_query) for period in period_tables}
+            bounds = [bound for period_bounds in periods.values() for bound in period_bounds]
+            if not bounds:
+                return
+            days_values = GarminDB.DaysSummary.s_get_days_values(session, min(bounds)[0], max(end_day for _, end_day in bounds))
+        for period, period_bounds in periods.items():
+            logger.info("Rolling up %d %s", len(period_bounds), period)
+            self.summary_sink.add_rows(period, [GarminDB.DaysSummary.rollup(days_values, first_day, end_day) for first_day, end_day in period_bounds])
+        self.summary_sink.flush()
+
+    def __get_dirty_days(self, full):
+        # Summarize everything when asked to or when the summaries haven't been generated before.
+        if full or GarminDB.DaysSummary.row_count(self.garmin_sum_db) == 0:
+            return None
+        return set(GarminDB.DirtyDays.get_dirty_days(self.garmin_sum_db))
+
+    def get_training_load_hr(self):
+        """
+        Return the resting and maximum heart rates that activity training loads are computed with.
+
+        The resting heart rate is the average daily resting heart rate. The maximum heart rate is the configured max_hr, or the
+        highest heart rate recorded in an activity if it isn't configured. The GarminDBConfig values are used when there is no data.
+        """
+        default_resting_hr, default_max_hr = GarminDBConfigManager.get_training_load_hr()
+        resting_hr = (GarminDB.RestingHeartRate.get_col_avg(self.garmin_db, GarminDB.RestingHeartRate.resting_heart_rate, ignore_le_zero=True)
+                      or GarminDB.DailySummary.get_col_avg(self.garmin_db, GarminDB.DailySummary.rhr, ignore_le_zero=True)
+                      or default_resting_hr)
+        max_hr = self.max_hr or GarminDB.Activities.get_col_max(self.garmin_act_db, GarminDB.Activities.max_hr) or default_max_hr
+        return (resting_hr, max_hr)
+
+    def __update_training_load(self, dirty_days):
+        # Activities mark the days they start on dirty, so the earliest dirty day is the first day whose training load changed.
+        if dirty_days is None or len(dirty_days) > 0:
+            logger.info("Updating training load")
+            resting_hr, max_hr = self.get_training_load_hr()
+            logger.info("Training load resting heart rate %.1f max heart rate %d", resting_hr, max_hr)
+            first_day = None if dirty_days is None else min(dirty_days)
+            GarminDB.TrainingLoad.update(self.garmin_sum_db, self.garmin_act_db, first_day, resting_hr=resting_hr, max_hr=max_hr)
+
+    def summary(self, full=False, processes=1):
+        """
+        Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated.
+
+        Summaries are generated for the days with new data or, if full is True, for all days. With more than one process
+        the days of the years are summarized in parallel by worker processes and the rows they return are written by this
+        one. The weeks, months, and years with new days are then rolled up from the day summaries.
+        """
         logger.info("Summary Tables Generation:")
-        years = GarminDB.Monitoring.get_years(self.garmin_mon_db)
-        for year in years:
-            logger.info("Generating table entries for %s", year)
-            self.__calculate_year(year)
+        # Save days recorded by imports run in this process.
+        GarminDB.DirtyDays.save(self.garmin_sum_db)
+        dirty_days = self.__get_dirty_days(full)
+        years = []
+        for year in GarminDB.Monitoring.get_years(self.garmin_mon_db):
+            year_dirty_days = None if dirty_days is None else {day for day in dirty_days if day.year == year}
+            if year_dirty_days is None or len(year_dirty_days) > 0:
+                years.append((year, year_dirty_days))
+        # The day summaries read IntensityHR, so fill it in before any summaries are computed.
+        for year, year_dirty_days in years:
+            logger.info("Generating intensity heart rate entries for %s", year)
+            if self.unified_db:
+                with self.unified_db.managed_session() as session:
+                    self.__populate_year_hr_intensity(year, year_dirty_days, session, session)
+            else:
+                with self.garmin_mon_db.managed_session() as garmin_mon_session, self.garmin_sum_db.managed_session() as garmin_sum_session:
+                    self.__populate_year_hr_intensity(year, year_dirty_days, garmin_mon_session, garmin_sum_session)
+        if processes > 1 and len(years) > 1:
+            with concurrent.futures.ProcessPoolExecutor(min(processes, len(years)), mp_context=_summary_worker_context(), initializer=_init_summary_worker) as executor:
+                futures = {
+                    executor.submit(_get_year_summaries, self.db_params, self.debug, self.unified_db is not None, year, year_dirty_days) : year
+                    for year, year_dirty_days in years
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    logger.info("Saving table entries for %s", futures[future])
+                    self.__save_year_summaries(future.result())
+        else:
+            for year, year_dirty_days in years:
+                logger.info("Generating table entries for %s", year)
+                self.__save_year_summaries(self.get_year_summaries(year, year_dirty_days))
+        self.__rollup_summaries(dirty_days)
+        self.__update_training_load(dirty_days)
+        GarminDB.DirtyDays.delete_days(self.garmin_sum_db, dirty_days)
 
     def create_dynamic_views(self):
         """Create database views specific to the data in this database."""
@@ -328,3 +390,20 @@ class Analyze(object):
         if course_ids:
             for course_id in course_ids:
                 GarminDB.StepsActivities.create_course_view(self.garmin_act_db, course_id)
+        for auto_course in GarminDB.AutoCourses.get_with_activities(self.garmin_act_db, ['walking', 'running', 'hiking']):
+            GarminDB.StepsActivities.create_auto_course_view(self.garmin_act_db, auto_course.auto_course_id)
+
+
+def _summary_worker_context():
+    # Fork where it's available so that workers don't import the main script again, the inherited databases are reopened in _init_summary_worker.
+    return multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
+
+def _init_summary_worker():
+    # Connections inherited from the parent process can't be used by the worker, it opens its own.
+    HealthDB.DbRegistry.forget()
+    HealthDB.QueryCache.disable(close=False)
+
+
+def _get_year_summaries(db_params, debug, unified, year, dirty_days):
+    return Analyze(db_params, debug, unified).get_year_summaries(year, dirty_days)
@@ -12,6 +12,7 @@ import argparse
 from datetime import datetime, time, timedelta
 
 import Fit
+import HealthDB
 import GarminDB
 from garmin_db_config_manager import GarminDBConfigManager
 from version import format_version
@@ -29,7 +30,10 @@ class CheckUp(object):
     def __init__(self, debug):
         """Return an instance of the CheckUp class."""
         self.db_params = GarminDBConfigManager.get_db_params()
+        HealthDB.SqliteProfile.set_default(self.db_params)
         self.debug = debug
+        if GarminDBConfigManager.get_query_cache():
+            HealthDB.QueryCache.enable(GarminDBConfigManager.get_query_cache_file())
         self.garmin_db = GarminDB.GarminDB(self.db_params)
         self.measurement_system = GarminDB.Attributes.measurements_type(self.garmin_db)
         self.unit_strings = Fit.units.unit_strings[self.measurement_system]
@@ -94,19 +98,38 @@ class CheckUp(object):
                      self.unit_strings[Fit.units.UnitTypes.speed]))
         return '%s: "%s" %s in %s (%s)' % (activity.start_time, activity.name, activity.distance, activity.elapsed_time, activity.avg_speed)
 
-    def activity_course(self, course_id):
-        """Run a checkup on all activities matching the course_id."""
-        activity_db = GarminDB.ActivitiesDB(self.db_params, self.debug)
-        activities = GarminDB.Activities.get_by_course_id(activity_db, course_id)
+    def __activity_course(self, activity_db, activities, fastest_activity, slowest_activity):
         activities_count = len(activities)
-        fastest_activity = GarminDB.Activities.get_fastest_by_course_id(activity_db, course_id)
-        slowest_activity = GarminDB.Activities.get_slowest_by_course_id(activity_db, course_id)
         logger.info('Matching Activities: %d', activities_count)
+        if activities_count == 0:
+            return
         logger.info('  first: %s', self.__activity_string(activity_db, activities[0]))
         logger.info('  lastest: %s', self.__activity_string(activity_db, activities[-1]))
         logger.info('  fastest: %s', self.__activity_string(activity_db, fastest_activity))
         logger.info('  slowest: %s', self.__activity_string(activity_db, slowest_activity))
 
+    def activity_course(self, course_id):
+        """Run a checkup on all activities matching the course_id."""
+        activity_db = GarminDB.ActivitiesDB(self.db_params, self.debug)
+        activities = GarminDB.Activities.get_by_course_id(activity_db, course_id)
+        fastest_activity = GarminDB.Activities.get_fastest_by_course_id(activity_db, course_id)
+        slowest_activity = GarminDB.Activities.get_slowest_by_course_id(activity_db, course_id)
+        self.__activity_course(activity_db, activities, fastest_activity, slowest_activity)
+
+    def activity_auto_course(self, auto_course_id):
+        """Run a checkup on all activities on the auto course found by route clustering."""
+        activity_db = GarminDB.ActivitiesDB(self.db_params, self.debug)
+        activities = GarminDB.Activities.get_by_auto_course_id(activity_db, auto_course_id)
+        fastest_activity = GarminDB.Activities.get_fastest_by_auto_course_id(activity_db, auto_course_id)
+        slowest_activity = GarminDB.Activities.get_slowest_by_auto_course_id(activity_db, auto_course_id)
+        self.__activity_course(activity_db, activities, fastest_activity, slowest_activity)
+
+    def auto_courses(self):
+        """List the auto courses found by route clustering that have more than one activity."""
+        activity_db = GarminDB.ActivitiesDB(self.db_params, self.debug)
+        for auto_course in GarminDB.AutoCourses.get_with_activities(activity_db):
+            logger.info('Auto course %d: %s with %d activities', auto_course.auto_course_id, auto_course.sport, auto_course.activities)
+
     def battery_status(self):
         """Check for devices with low battery status."""
         devices = GarminDB.Device.get_all(self.garmin_db)
@@ -126,6 +149,8 @@ def main(argv):
     checks_group = parser.add_argument_group('Checks')
     checks_group.add_argument("-b", "--battery", help="Check for low battery levels.", action="store_true", default=False)
     checks_group.add_argument("-c", "--course", help="Show statistics from all workouts for a single course.", type=int, default=None)
+    checks_group.add_argument("-C", "--auto-course", help="Show statistics from all workouts for a single auto course found by route clustering.", type=int, default=None)
+    checks_group.add_argument("-l", "--auto-courses", help="List the auto courses found by route clustering.", action="store_true", default=False)
     checks_group.add_argument("-g", "--goals", help="Run a checkup on the user\'s goals.", action="store_true", default=False)
     args = parser.parse_args()
 
@@ -134,6 +159,10 @@ def main(argv):
         checkup.battery_status()
     if args.course:
         checkup.activity_course(args.course)
+    if args.auto_course:
+        checkup.activity_auto_course(args.auto_course)
+    if args.auto_courses:
+        checkup.auto_courses()
     if args.goals:
         checkup.goals()
 
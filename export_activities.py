@@ -14,12 +14,13 @@ from garmin_db_tcx import GarminDbTcx
 class ActivityExporter(object):
     """Export activities as TCX files from database data."""
 
-    def __init__(self, directory, activity_id, measurement_system, debug):
-        """Return a instance of ActivityExporter ready to write a TCX file."""
+    def __init__(self, directory, activity_id, measurement_system, debug, track_level=None):
+        """Return a instance of ActivityExporter ready to write a TCX file. If track_level is set, only export the points of that simplified track level."""
         self.directory = directory
         self.activity_id = activity_id
         self.measurement_system = measurement_system
         self.debug = debug
+        self.track_level = track_level
 
     def process(self, db_params):
         """Process database data for an activity into a an XML tree in TCX format."""
@@ -29,7 +30,11 @@ class ActivityExporter(object):
             self.tcx = GarminDbTcx()
             self.tcx.create(activity.sport, activity.start_time)
             laps = GarminDB.ActivityLaps.s_get_activity(garmin_act_db_session, self.activity_id)
-            records = GarminDB.ActivityRecords.s_get_activity(garmin_act_db_session, self.activity_id)
+            records = None
+            if self.track_level is not None:
+                records = GarminDB.ActivityTracks.s_get_track_records(garmin_act_db_session, self.activity_id, self.track_level)
+            if records is None:
+                records = GarminDB.ActivityRecords.s_get_activity(garmin_act_db_session, self.activity_id)
             for lap in laps:
                 distance = Distance.from_meters_or_feet(lap.distance, self.measurement_system)
                 track = self.tcx.add_lap(lap.start_time, lap.stop_time, distance, lap.calories)
@@ -44,7 +44,8 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 gc_config = GarminConnectConfigManager()
-db_params_dict = GarminDBConfigManager.get_db_params()
+db_params_dict = GarminDBConfigManager.get_db_params(sqlite_profile=gc_config.sqlite_profile())
+HealthDB.SqliteProfile.set_default(db_params_dict)
 plugin_manager = GarminDbPluginManager(GarminDBConfigManager.get_or_create_plugins_dir(), db_params_dict)
 
 
@@ -195,13 +196,17 @@ def import_data(debug, latest, stats):
         if ghd.file_count() > 0:
             ghd.process()
 
+        if GarminDBConfigManager.get_monitoring_partitions():
+            GarminDB.MonitoringPartitions.create(GarminDB.MonitoringDB(db_params_dict))
+        # Create rollups for monitoring data imported before rollups were supported, the import keeps them up to date after that.
+        GarminDB.MonitoringRollups.create_missing(GarminDB.MonitoringDB(db_params_dict))
         gfd = GarminMonitoringFitData(monitoring_dir, latest, measurement_system, debug)
         if gfd.file_count() > 0:
             gfd.process_files(MonitoringFitFileProcessor(db_params_dict, plugin_manager, ignore_dev_fields, debug))
 
     if Statistics.sleep in stats:
         sleep_dir = GarminDBConfigManager.get_or_create_sleep_dir()
-        gsd = GarminSleepData(db_params_dict, sleep_dir, latest, debug)
+        gsd = GarminSleepData(db_params_dict, sleep_dir, latest, debug, gc_config.sleep_hypnogram())
         if gsd.file_count() > 0:
             gsd.process()
 
@@ -230,13 +235,29 @@ def import_data(debug, latest, stats):
         if gfd.file_count() > 0:
             gfd.process_files(ActivityFitFileProcessor(db_params_dict, plugin_manager, ignore_dev_fields, debug))
 
+        # Create simplified tracks and route signatures for activities imported before they were supported.
+        garmin_act_db = GarminDB.ActivitiesDB(db_params_dict)
+        GarminDB.ActivityTracks.create_missing(garmin_act_db)
+        GarminDB.ActivityRoutes.create_missing(garmin_act_db)
 
-def analyze_data(debug):
-    """Analyze the downloaded and imported Garmin data and create summary tables."""
+
+def rebuild_monitoring_year(debug, year):
+    """Delete a year of monitoring data and import it again from the year's monitoring FIT files."""
+    logger.info("___Rebuilding %d Monitoring Data___", year)
+    garmindb = GarminDB.GarminDB(db_params_dict)
+    measurement_system = GarminDB.Attributes.measurements_type(garmindb)
+    GarminDB.MonitoringPartitions.delete_year(GarminDB.MonitoringDB(db_params_dict), year)
+    gfd = GarminMonitoringFitData(GarminDBConfigManager.get_monitoring_dir(year), False, measurement_system, debug)
+    if gfd.file_count() > 0:
+        gfd.process_files(MonitoringFitFileProcessor(db_params_dict, plugin_manager, gc_config.ignore_dev_fields(), debug))
+
+
+def analyze_data(debug, full=False):
+    """Analyze the downloaded and imported Garmin data and create summary tables for the days with new data, or all days if full is True."""
     logger.info("___Analyzing Data___")
-    analyze = Analyze(db_params_dict, debug - 1)
+    analyze = Analyze(db_params_dict, debug - 1, GarminDBConfigManager.get_db_unified(), gc_config.max_hr())
     analyze.get_stats()
-    analyze.summary()
+    analyze.summary(full, GarminDBConfigManager.get_analyze_processes())
     analyze.create_dynamic_views()
 
 
@@ -248,25 +269,32 @@ def delete_dbs(delete_db_list=[]):
         db.delete_db(db_params_dict)
 
 
-def export_activity(debug, directory, export_activity_id):
+def maintain_dbs(vacuum):
+    """Optimize, check, and report on the size of the GarminDB databases, optionally vacuuming them."""
+    logger.info("___Maintaining Databases___")
+    for db_class in [GarminDB.GarminDB, GarminDB.MonitoringDB, GarminDB.ActivitiesDB, GarminDB.GarminSummaryDB, HealthDB.SummaryDB]:
+        HealthDB.DbMaintenance.maintain(db_class(db_params_dict), vacuum)
+
+
+def export_activity(debug, directory, export_activity_id, track_level=None):
     """Export an activity given its database id."""
     garmindb = GarminDB.GarminDB(db_params_dict)
     measurement_system = GarminDB.Attributes.measurements_type(garmindb)
-    ae = ActivityExporter(directory, export_activity_id, measurement_system, debug)
+    ae = ActivityExporter(directory, export_activity_id, measurement_system, debug, track_level)
     ae.process(db_params_dict)
     return ae.write('activity_%s.tcx' % export_activity_id)
 
 
-def basecamp_activity(debug, export_activity_id):
+def basecamp_activity(debug, export_activity_id, track_level=None):
     """Export an activity given its database id."""
-    file_with_path = export_activity(debug, tempfile.mkdtemp(), export_activity_id)
+    file_with_path = export_activity(debug, tempfile.mkdtemp(), export_activity_id, track_level)
     logger.info("Opening activity %d (%s) in BaseCamp", export_activity_id, file_with_path)
     OpenWithBaseCamp.open(file_with_path)
 
 
-def google_earth_activity(debug, export_activity_id):
+def google_earth_activity(debug, export_activity_id, track_level=None):
     """Export an activity given its database id."""
-    file_with_path = export_activity(debug, tempfile.mkdtemp(), export_activity_id)
+    file_with_path = export_activity(debug, tempfile.mkdtemp(), export_activity_id, track_level)
     logger.info("Opening activity %d (%s) in GoogleEarth", export_activity_id, file_with_path)
     OpenWithGoogleEarth.open(file_with_path)
 
@@ -283,7 +311,10 @@ def main(argv):
     modes_group.add_argument("-c", "--copy", help="copy data from a connected device", dest='copy_data', action="store_true", default=False)
     modes_group.add_argument("-i", "--import", help="Import data for the chosen stats", dest='import_data', action="store_true", default=False)
     modes_group.add_argument("--analyze", help="Analyze data in the db and create summary and derived tables.", dest='analyze_data', action="store_true", default=False)
+    modes_group.add_argument("--maintain", help="Optimize, check, and report on the size of the databases.", action="store_true", default=False)
     modes_group.add_argument("--delete_db", help="Delete Garmin DB db files for the selected activities.", action="store_true", default=False)
+    modes_group.add_argument("--rebuild-monitoring-year", help="Delete a year of monitoring data and import it again from the year's FIT files.",
+                             type=int, metavar='YEAR')
     modes_group.add_argument("-e", "--export-activity", help="Export an activity to a TCX file based on the activity\'s id", type=int)
     modes_group.add_argument("-b", "--basecamp-activity", help="Export an activity to Garmin BaseCamp", type=int)
     modes_group.add_argument("-g", "--google-earth-activity", help="Export an activity to Google Earth", type=int)
@@ -300,6 +331,14 @@ def main(argv):
     modifiers_group.add_argument("-l", "--latest", help="Only download and/or import the latest data.", action="store_true", default=False)
     modifiers_group.add_argument("-o", "--overwrite", help="Overwite existing files when downloading. The default is to only download missing files.",
                                  action="store_true", default=False)
+    modifiers_group.add_argument("--track-level", help="Export only the points of a simplified track: 0 (most detail) to %d (least detail)." %
+                                 (len(GarminDB.ActivityTracks.level_tolerances) - 1), type=int, default=None)
+    modifiers_group.add_argument("--vacuum", help="Return the unused space in the databases to the file system when maintaining them.", action="store_true",
+                                 default=False)
+    modifiers_group.add_argument("--full", help="Regenerate the summaries for all days when analyzing. The default is to only regenerate them for days with new data.",
+                                 action="store_true", default=False)
+    modifiers_group.add_argument("--index-advisor", help="Report the database queries run by the selected modes that scan whole tables.",
+                                 action="store_true", default=False)
     args = parser.parse_args()
 
     log_version(sys.argv[0])
@@ -311,30 +350,55 @@ def main(argv):
 
     root_logger.info("Enabled statistics: %r", args.stats)
 
+    # Enable the cache for every mode, the writes of imports have to be counted for the cached results to be invalidated.
+    if GarminDBConfigManager.get_query_cache():
+        HealthDB.QueryCache.enable(GarminDBConfigManager.get_query_cache_file())
+
     if args.delete_db:
         delete_dbs([stats_to_db_map[stat] for stat in args.stats] + summary_dbs)
         sys.exit()
 
+    if args.index_advisor:
+        index_advisor = HealthDB.IndexAdvisor()
+        index_advisor.start()
+
     if args.copy_data:
         copy_data(args.overwrite, args.latest, args.stats)
 
     if args.download_data:
         download_data(args.overwrite, args.latest, args.stats)
 
+    # Remember which days have new data, as it's committed, so that analyze only regenerates their summaries.
     if args.import_data:
-        import_data(args.trace, args.latest, args.stats)
+        with GarminDB.DirtyDays.saving(GarminDB.GarminSummaryDB(db_params_dict)):
+            if args.latest:
+                import_data(args.trace, args.latest, args.stats)
+            else:
+                # A full import rebuilds the databases, trade durability for speed while it runs.
+                with HealthDB.SqliteProfile.use(GarminDBConfigManager.get_db_params(sqlite_profile='bulk_import')):
+                    import_data(args.trace, args.latest, args.stats)
+
+    if args.rebuild_monitoring_year:
+        with GarminDB.DirtyDays.saving(GarminDB.GarminSummaryDB(db_params_dict)):
+            rebuild_monitoring_year(args.trace, args.rebuild_monitoring_year)
 
     if args.analyze_data:
-        analyze_data(args.trace)
+        analyze_data(args.trace, args.full)
+
+    if args.maintain:
+        maintain_dbs(args.vacuum)
 
     if args.export_activity:
-        export_activity(args.trace, os.getcwd(), args.export_activity)
+        export_activity(args.trace, os.getcwd(), args.export_activity, args.track_level)
 
     if args.basecamp_activity:
-        basecamp_activity(args.trace, args.basecamp_activity)
+        basecamp_activity(args.trace, args.basecamp_activity, args.track_level)
 
     if args.google_earth_activity:
-        google_earth_activity(args.trace, args.google_earth_activity)
+        google_earth_activity(args.trace, args.google_earth_activity, args.track_level)
+
+    if args.index_advisor:
+        index_advisor.report()
 
 
 if __name__ == "__main__":
@@ -96,6 +96,18 @@ class GarminConnectConfigManager(JsonConfig):
             self.enabled_statistics = [Statistics.from_string(stat_name) for stat_name, stat_enabled in json_enabled_stats_dict.items() if stat_enabled]
         return self.enabled_statistics
 
+    def max_hr(self):
+        """Return the user's maximum heart rate, None if it isn't configured."""
+        return self.__get_node_value('profile', 'max_hr')
+
+    def sqlite_profile(self):
+        """Return the SQLite profile (bulk_import, interactive, safe) to open databases with, None for the GarminDB config default."""
+        return self.__get_node_value('db', 'sqlite_profile')
+
     def ignore_dev_fields(self):
         """Return all enabled statistics as a list of string names."""
         return self.__get_node_value_default('modes', 'ignore_dev_fields', False)
+
+    def sleep_hypnogram(self):
+        """Return whether each night's sleep events should also be saved as a single compact hypnogram row."""
+        return self.__get_node_value_default('modes', 'sleep_hypnogram', False)
@@ -9,7 +9,19 @@ class GarminDBConfig(object):
     """Class that encapsilates config data for the application."""
 
     db = {
-        'type'                  : 'sqlite'
+        'type'                  : 'sqlite',
+        'sqlite_profile'        : 'interactive',
+        'unified'               : False,
+        'monitoring_partitions' : False,
+        'query_cache'           : False,
+        'analyze_processes'     : 1
+    }
+
+    # PRAGMAs applied to every SQLite connection, cache_size is negative to express it in KiB.
+    sqlite_profiles = {
+        'bulk_import'           : {'journal_mode' : 'WAL', 'synchronous' : 'OFF', 'cache_size' : -262144, 'mmap_size' : 1073741824, 'temp_store' : 'MEMORY'},
+        'interactive'           : {'journal_mode' : 'WAL', 'synchronous' : 'NORMAL', 'cache_size' : -65536, 'mmap_size' : 268435456, 'temp_store' : 'MEMORY'},
+        'safe'                  : {'journal_mode' : 'WAL', 'synchronous' : 'FULL', 'cache_size' : -2000, 'mmap_size' : 0, 'temp_store' : 'DEFAULT'}
     }
 
     directories = {
@@ -51,3 +63,11 @@ class GarminDBConfig(object):
     checkup = {
         'look_back_days'        : 90
     }
+
+    # Fallback heart rates for computing the training load (TRIMP) of activities. The resting heart rate is the average of the
+    # resting heart rate data and the max heart rate comes from GarminConnectConfig.json or the highest activity heart rate,
+    # these are only used when there is no such data.
+    training_load = {
+        'resting_hr'            : 60,
+        'max_hr'                : 185
+    }
@@ -42,6 +42,46 @@ class GarminDBConfigManager(GarminDBConfig):
         """Return the configured hostname of the database."""
         return cls.db['host']
 
+    @classmethod
+    def get_sqlite_profile(cls):
+        """Return the name of the configured SQLite performance profile."""
+        return cls.db.get('sqlite_profile', 'interactive')
+
+    @classmethod
+    def get_sqlite_pragmas(cls, sqlite_profile=None):
+        """Return the PRAGMAs for a SQLite performance profile, the configured one if not specified."""
+        if sqlite_profile is None:
+            sqlite_profile = cls.get_sqlite_profile()
+        if sqlite_profile not in cls.sqlite_profiles:
+            raise ValueError(f'Unknown SQLite profile {sqlite_profile}: expected one of {list(cls.sqlite_profiles)}')
+        return cls.sqlite_profiles[sqlite_profile]
+
+    @classmethod
+    def get_db_unified(cls):
+        """Return if analysis should run over one connection with all of the SQLite databases attached."""
+        return cls.db.get('unified', False) and cls.get_db_type() == 'sqlite'
+
+    @classmethod
+    def get_monitoring_partitions(cls):
+        """Return if the minute level monitoring tables should be split into one table per year."""
+        return cls.db.get('monitoring_partitions', False) and cls.get_db_type() == 'sqlite'
+
+    @classmethod
+    def get_query_cache(cls):
+        """Return if the results of statistics queries should be cached between runs."""
+        return cls.db.get('query_cache', False) and cls.get_db_type() == 'sqlite'
+
+    @classmethod
+    def get_analyze_processes(cls):
+        """Return the number of processes that generate summaries in parallel, a configured value of 0 means one per CPU."""
+        processes = cls.db.get('analyze_processes', 1)
+        return processes if processes > 0 else os.cpu_count()
+
+    @classmethod
+    def get_query_cache_file(cls, test_db=False):
+        """Return the file where query results are cached."""
+        return cls.get_db_dir(test_db) + os.sep + 'query_cache.db'
+
     @classmethod
     def _create_dir_if_needed(cls, dir):
         if not os.path.exists(dir):
@@ -169,14 +209,16 @@ class GarminDBConfigManager(GarminDBConfig):
         return cls._create_dir_if_needed(base + os.sep + cls.directories['db_dir'])
 
     @classmethod
-    def get_db_params(cls, test_db=False):
-        """Return the database configuration."""
+    def get_db_params(cls, test_db=False, sqlite_profile=None):
+        """Return the database configuration, sqlite_profile overrides the configured SQLite profile."""
         db_type = cls.get_db_type()
         db_params = {
             'db_type' : db_type
         }
         if db_type == 'sqlite':
             db_params['db_path'] = cls.get_db_dir(test_db)
+            db_params['sqlite_profile'] = sqlite_profile if sqlite_profile is not None else cls.get_sqlite_profile()
+            db_params['sqlite_pragmas'] = cls.get_sqlite_pragmas(db_params['sqlite_profile'])
         elif db_type == "mysql":
             db_params['db_type'] = 'mysql'
             db_params['db_username'] = cls.get_db_user()
@@ -189,6 +231,11 @@ class GarminDBConfigManager(GarminDBConfig):
         """Return the unit system (metric, statute) that is configured."""
         return cls.config['metric']
 
+    @classmethod
+    def get_training_load_hr(cls):
+        """Return the fallback resting and maximum heart rates for computing activity training loads when there is no data."""
+        return (cls.training_load['resting_hr'], cls.training_load['max_hr'])
+
     @classmethod
     def device_settings_dir(cls, mount_dir):
         """Return the full path to the settings file on a mounted device."""
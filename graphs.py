@@ -75,6 +75,8 @@ class Graph(object):
         """Return an instance of the Graph class."""
         self.debug = debug
         self.save = save
+        if GarminDBConfigManager.get_query_cache():
+            HealthDB.QueryCache.enable(GarminDBConfigManager.get_query_cache_file())
 
     @classmethod
     def __remove_discontinuities(cls, data):
@@ -193,7 +195,8 @@ class Graph(object):
             period = GarminDBConfigManager.graphs_activity_config(activity, 'period')
         if days is None:
             days = GarminDBConfigManager.graphs_activity_config(activity, 'days')
-        db_params = GarminDBConfigManager.get_db_params()
+        db_params = GarminDBConfigManager.get_db_params(sqlite_profile=gc_config.sqlite_profile())
+        HealthDB.SqliteProfile.set_default(db_params)
         sum_db = HealthDB.SummaryDB(db_params, self.debug)
         end_ts = datetime.datetime.now()
         start_ts = end_ts - datetime.timedelta(days=days)
@@ -224,7 +227,8 @@ class Graph(object):
         """Generate a graph for the given date."""
         if date is None:
             date = (datetime.datetime.now() - datetime.timedelta(days=1)).date()
-        db_params = GarminDBConfigManager.get_db_params()
+        db_params = GarminDBConfigManager.get_db_params(sqlite_profile=gc_config.sqlite_profile())
+        HealthDB.SqliteProfile.set_default(db_params)
         mon_db = GarminDB.MonitoringDB(db_params, self.debug)
         start_ts = datetime.datetime.combine(date, datetime.datetime.min.time())
         end_ts = datetime.datetime.combine(date, datetime.datetime.max.time())
@@ -114,7 +114,7 @@ class RemSleepActivityLevels(enum.Enum):
 class GarminSleepData(JsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect sleep data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, debug):
+    def __init__(self, db_params, input_dir, latest, debug, hypnogram=False):
         """
         Return an instance of GarminSleepData.
 
@@ -124,11 +124,13 @@ class GarminSleepData(JsonFileProcessor):
         input_dir (string): directory (full path) to check for sleep data files
         latest (Boolean): check for latest files only
         debug (Boolean): enable debug logging
+        hypnogram (Boolean): also save each night's sleep events as a single compact hypnogram row
 
         """
         logger.info("Processing sleep data")
         super().__init__(r'sleep_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.garmin_db = GarminDB.GarminDB(db_params)
+        self.hypnogram = hypnogram
         self.conversions = {
             'calendarDate': self._parse_date,
             'sleepTimeSeconds': Fit.conversions.secs_to_dt_time,
@@ -166,25 +168,34 @@ class GarminSleepData(JsonFileProcessor):
             'rem_sleep': daily_sleep.get('remSleepSeconds'),
             'awake': daily_sleep.get('awakeSleepSeconds')
         }
-        GarminDB.Sleep.insert_or_update(
-            self.garmin_db, day_data, ignore_none=True)
+        GarminDB.Sleep.s_insert_or_update(self.garmin_db_session, day_data, ignore_none=True)
         sleep_levels = json_data.get('sleepLevels')
         if sleep_levels is None:
+            self.garmin_db_session.commit()
             return 0
+        events = []
         for sleep_level in sleep_levels:
             start = sleep_level['startGMT']
             end = sleep_level['endGMT']
             event = sleep_activity_levels(sleep_level['activityLevel'])
             duration = (datetime.datetime.min + (end - start)).time()
-            level_data = {
+            events.append({
                 'timestamp': start,
                 'event': event.name,
                 'duration': duration
-            }
-            GarminDB.SleepEvents.insert_or_update(
-                self.garmin_db, level_data, ignore_none=True)
+            })
+        events.sort(key=lambda event: event['timestamp'])
+        GarminDB.SleepEvents.s_insert_or_update_many(self.garmin_db_session, events, ignore_none=True)
+        if self.hypnogram:
+            GarminDB.SleepHypnogram.s_insert_or_update(self.garmin_db_session, GarminDB.SleepHypnogram.from_events(day, events))
+        self.garmin_db_session.commit()
         return len(sleep_levels)
 
+    def process(self):
+        """Import sleep data from files into the database."""
+        with self.garmin_db.managed_session() as self.garmin_db_session:
+            self._process_files()
+
 
 class GarminRhrData(JsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect resting heart rate data into a database."""
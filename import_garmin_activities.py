@@ -155,6 +155,9 @@ class GarminTcxData(object):
         GarminDB.Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True, ignore_zero=True)
         for lap_number, lap in enumerate(tcx.laps):
             self.__process_lap(tcx, file_id, lap_number, lap)
+        GarminDB.ActivityTracks.s_create_from_records(self.garmin_act_db_session, file_id)
+        GarminDB.ActivityRoutes.s_update(self.garmin_act_db_session, file_id)
+        GarminDB.ActivitiesLocationIndex.s_update(self.garmin_act_db_session, file_id)
 
     def process_files(self, db_params):
         """Import data from TCX files into the database."""
@@ -356,6 +359,7 @@ class GarminJsonSummaryData(GarminJsonActivityData):
         }
         activity.update(self._process_common(json_data))
         GarminDB.Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True)
+        GarminDB.ActivitiesLocationIndex.s_update(self.garmin_act_db_session, activity_id)
         self._call_process_func(sport.name, sub_sport, activity_id, json_data)
         return 1
 
@@ -451,5 +455,6 @@ class GarminJsonDetailsData(GarminJsonActivityData):
         }
         activity.update(self._process_common(summary_dto))
         GarminDB.Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True)
+        GarminDB.ActivitiesLocationIndex.s_update(self.garmin_act_db_session, activity_id)
         self._call_process_func(sport.name, sub_sport, activity_id, json_data)
         return 1
@@ -38,8 +38,11 @@ class MonitoringFitFileProcessor(FitFileProcessor):
 
     def write_file(self, fit_file):
         """Given a Fit File object, write all of its messages to the DB."""
+        self.monitoring_days = set()
         with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_mon_db.managed_session() as self.garmin_mon_db_session:
             self._write_message_types(fit_file, fit_file.message_types)
+            # Only the rollup buckets for days that this file has data for need to be recomputed.
+            GarminDB.MonitoringRollups.s_update(self.garmin_mon_db_session, self.monitoring_days)
             # Now write a file's worth of data to the DB
             self.garmin_mon_db_session.commit()
             self.garmin_db_session.commit()
@@ -66,6 +69,7 @@ class MonitoringFitFileProcessor(FitFileProcessor):
         if timestamp.time() == datetime.time.min:
             timestamp = timestamp - datetime.timedelta(seconds=1)
         entry['timestamp'] = timestamp
+        self.monitoring_days.add(timestamp.date())
         logger.debug("monitoring entry: %r", entry)
         try:
             intersection = GarminDB.MonitoringHeartRate.intersection(entry)
@@ -7,9 +7,13 @@ __license__ = "GPL"
 
 import unittest
 import logging
+import datetime
 
 from test_db_base import TestDBBase
+import utilities
+import HealthDB
 import GarminDB
+import GarminDB.track_geometry as track_geometry
 import Fit
 from import_garmin_activities import GarminActivitiesFitData, GarminTcxData, GarminJsonSummaryData, GarminJsonDetailsData
 from activity_fit_file_processor import ActivityFitFileProcessor
@@ -38,6 +42,7 @@ class TestActivitiesDb(TestDBBase, unittest.TestCase):
             'activities_table' : GarminDB.Activities,
             'activity_laps_table' : GarminDB.ActivityLaps,
             'activity_records_table' : GarminDB.ActivityRecords,
+            'activity_tracks_table' : GarminDB.ActivityTracks,
             'run_activities_table' : GarminDB.StepsActivities,
             'paddle_activities_table' : GarminDB.PaddleActivities,
             'cycle_activities_table' : GarminDB.CycleActivities,
@@ -58,6 +63,79 @@ class TestActivitiesDb(TestDBBase, unittest.TestCase):
         self.assertGreater(GarminDB.PaddleActivities.row_count(self.garmin_act_db), 0)
         self.assertGreater(GarminDB.CycleActivities.row_count(self.garmin_act_db), 0)
 
+    def test_track_simplify(self):
+        lats = [45.0 + (0.0001 * index) for index in range(100)]
+        longs = [-71.0] * 50 + [-71.0 + (0.0001 * index) for index in range(50)]
+        indices = track_geometry.simplify(lats, longs, 1.0)
+        self.assertEqual(list(indices), [0, 50, 99])
+        positions = track_geometry.unpack_positions(track_geometry.pack_positions([lats[index] for index in indices], [longs[index] for index in indices]))
+        self.assertAlmostEqual(positions[1][0], lats[50], places=4)
+        self.assertEqual(track_geometry.unpack_indices(track_geometry.pack_indices(indices)), [0, 50, 99])
+
+    def test_route_signature(self):
+        self.assertEqual(track_geometry.geohashes([57.64911, 42.6], [10.40744, -5.6], 5), ['u4pru', 'ezs42'])
+        self.assertEqual(track_geometry.route_signature([42.6, 42.6, 57.64911], [-5.6, -5.6, 10.40744], 5), ['ezs42', 'u4pru'])
+        self.assertEqual(track_geometry.jaccard_similarity(['a', 'b', 'c'], ['b', 'c', 'd']), 0.5)
+
+    def test_location_index(self):
+        activity_id = 'location_index_test'
+        start, stop = (42.5, -71.5), (42.6, -71.4)
+        GarminDB.Activities.insert_or_update(self.test_act_db, {
+            'activity_id'   : activity_id,
+            'start_time'    : datetime.datetime(2020, 1, 1, 8),
+            'start_lat'     : start[0],
+            'start_long'    : start[1],
+            'stop_lat'      : stop[0],
+            'stop_long'     : stop[1]
+        })
+        with self.test_act_db.managed_session() as session:
+            GarminDB.ActivitiesLocationIndex.s_update(session, activity_id)
+            session.commit()
+        kind = GarminDB.ActivitiesLocationIndex.Kind
+        near_start = GarminDB.Activities.get_near(self.test_act_db, utilities.Location(*start), 10)
+        self.assertIn(activity_id, [activity.activity_id for activity in near_start])
+        near_stop = GarminDB.Activities.get_near(self.test_act_db, utilities.Location(*stop), 10, kind.stop)
+        self.assertIn(activity_id, [activity.activity_id for activity in near_stop])
+        near_middle = GarminDB.Activities.get_near(self.test_act_db, utilities.Location(42.55, -71.45), 10, kind.bounds)
+        self.assertIn(activity_id, [activity.activity_id for activity in near_middle])
+        starts_near_stop = GarminDB.Activities.get_near(self.test_act_db, utilities.Location(*stop), 10)
+        self.assertNotIn(activity_id, [activity.activity_id for activity in starts_near_stop])
+
+    def test_auto_courses(self):
+        first_ts = datetime.datetime(2020, 6, 1, 8)
+        activity_ids = {'auto_course_run_1' : 'running', 'auto_course_run_2' : 'running', 'auto_course_walk' : 'walking'}
+        with self.test_act_db.managed_session() as session:
+            for index, (activity_id, sport) in enumerate(activity_ids.items()):
+                GarminDB.Activities.s_insert_or_update(session, {'activity_id' : activity_id, 'sport' : sport, 'start_time' : first_ts + datetime.timedelta(index)})
+                GarminDB.ActivityRecords.s_insert_or_update_many(session, [
+                    {'activity_id' : activity_id, 'record' : record, 'position_lat' : 44.0 + record * 0.0002, 'position_long' : -72.0 + (record % 40) * 0.0003}
+                    for record in range(200)
+                ])
+                GarminDB.ActivityTracks.s_create_from_records(session, activity_id)
+                GarminDB.ActivityRoutes.s_update(session, activity_id)
+            session.commit()
+        # activities on the same route share a course only if they are of the same sport
+        routes = {activity_id : GarminDB.ActivityRoutes.get(self.test_act_db, activity_id).auto_course_id for activity_id in activity_ids}
+        self.assertEqual(routes['auto_course_run_1'], routes['auto_course_run_2'])
+        self.assertNotEqual(routes['auto_course_run_1'], routes['auto_course_walk'])
+        self.assertEqual(GarminDB.AutoCourses.get(self.test_act_db, routes['auto_course_run_1']).sport, 'running')
+        self.assertEqual(GarminDB.AutoCourses.get(self.test_act_db, routes['auto_course_walk']).sport, 'walking')
+
+    def test_index_advisor(self):
+        sport_index = next(index for index in GarminDB.Activities.__table__.indexes if index.name == 'ix_activities_sport')
+        sport_index.drop(self.test_act_db.engine, checkfirst=True)
+        try:
+            index_advisor = HealthDB.IndexAdvisor()
+            index_advisor.start()
+            GarminDB.Activities.row_count(self.test_act_db, GarminDB.Activities.sport, 'running')
+            self.assertIn('activities', [table for _, table, _ in index_advisor.report()])
+        finally:
+            sport_index.create(self.test_act_db.engine)
+        index_advisor = HealthDB.IndexAdvisor()
+        index_advisor.start()
+        GarminDB.Activities.row_count(self.test_act_db, GarminDB.Activities.sport, 'running')
+        self.assertNotIn('activities', [table for _, table, _ in index_advisor.report()])
+
     def check_activities_fields(self, fields_list):
         self.check_not_none_cols(self.test_act_db, {GarminDB.Activities : fields_list})
 
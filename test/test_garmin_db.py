@@ -7,9 +7,13 @@ __license__ = "GPL"
 import unittest
 import logging
 import datetime
+import math
+import sqlite3
+import sqlalchemy
 
 from test_db_base import TestDBBase
 import Fit
+import HealthDB
 import GarminDB
 from garmin_db_config_manager import GarminDBConfigManager
 
@@ -27,6 +31,7 @@ class TestGarminDb(TestDBBase, unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         db_params = GarminDBConfigManager.get_db_params()
+        HealthDB.SqliteProfile.set_default(db_params)
         cls.garmin_db = GarminDB.GarminDB(db_params)
         table_dict = {
             'attributes_table' : GarminDB.Attributes,
@@ -116,6 +121,289 @@ class TestGarminDb(TestDBBase, unittest.TestCase):
         measurement_system = GarminDB.Attributes.measurements_type(self.garmin_db, Fit.field_enums.DisplayMeasure.metric)
         self.assertIn(measurement_system, Fit.field_enums.DisplayMeasure)
 
+    def check_sqlite_pragmas(self, sqlite_pragmas):
+        with self.garmin_db.managed_session() as session:
+            self.assertEqual(session.execute('PRAGMA journal_mode').scalar().upper(), sqlite_pragmas['journal_mode'])
+            self.assertEqual(session.execute('PRAGMA cache_size').scalar(), sqlite_pragmas['cache_size'])
+
+    def test_sqlite_profile(self):
+        self.check_sqlite_pragmas(GarminDBConfigManager.get_sqlite_pragmas())
+        db_params = GarminDBConfigManager.get_db_params(sqlite_profile='bulk_import')
+        # building db params does not change the profile in use
+        self.assertEqual(HealthDB.SqliteProfile.active()[0], GarminDBConfigManager.get_sqlite_profile())
+        with HealthDB.SqliteProfile.use(db_params):
+            self.check_sqlite_pragmas(db_params.sqlite_pragmas)
+        self.check_sqlite_pragmas(GarminDBConfigManager.get_sqlite_pragmas())
+
+    def test_insert_or_update(self):
+        test_db = GarminDB.GarminDB(GarminDBConfigManager.get_db_params(test_db=True))
+        day = datetime.date(2000, 1, 1)
+        GarminDB.Weight.insert_or_update(test_db, {'day' : day, 'weight' : 100.0})
+        with test_db.managed_session() as session:
+            GarminDB.Weight.s_insert_or_update(session, {'day' : day, 'weight' : None}, ignore_none=True)
+            GarminDB.Weight.s_insert_or_update(session, {'day' : day, 'weight' : 0.0}, ignore_zero=True)
+        self.assertEqual(GarminDB.Weight.get(test_db, day).weight, 100.0)
+        # by default None values clear the stored value
+        GarminDB.DailySummary.insert_or_update(test_db, {'day' : day, 'rhr' : 50})
+        with test_db.managed_session() as session:
+            GarminDB.DailySummary.s_insert_or_update(session, {'day' : day, 'rhr' : None})
+        self.assertIsNone(GarminDB.DailySummary.get(test_db, day).rhr)
+        GarminDB.DailySummary.insert_or_update_many(test_db, [{'day' : day, 'rhr' : 50}])
+        GarminDB.DailySummary.insert_or_update_many(test_db, [{'day' : day, 'rhr' : None}])
+        self.assertIsNone(GarminDB.DailySummary.get(test_db, day).rhr)
+        values_dicts = [{'day' : day + datetime.timedelta(days), 'weight' : 100.0 + days} for days in range(2000)]
+        GarminDB.Weight.insert_or_update_many(test_db, values_dicts + [{'day' : day, 'weight' : 0.0}], ignore_zero=True)
+        self.assertEqual(GarminDB.Weight.row_count_for_period(test_db, day, day + datetime.timedelta(2000)), 2000)
+        self.assertEqual(GarminDB.Weight.get(test_db, day + datetime.timedelta(1999)).weight, 2099.0)
+        self.assertEqual(GarminDB.Weight.get(test_db, day).weight, 100.0)
+
+    def test_col_stats(self):
+        test_db = GarminDB.GarminDB(GarminDBConfigManager.get_db_params(test_db=True))
+        start_day = datetime.date(1997, 1, 1)
+        for days, weight in enumerate([0.0, 70.0, 72.0]):
+            GarminDB.Weight.insert_or_update(test_db, {'day' : start_day + datetime.timedelta(days), 'weight' : weight})
+        end_day = start_day + datetime.timedelta(3)
+        stats_spec = {
+            'weight_avg'    : (GarminDB.Weight.weight, 'avg', True),
+            'weight_min'    : (GarminDB.Weight.weight, 'min'),
+            'weight_count'  : (GarminDB.Weight.weight, 'count', GarminDB.Weight.weight > 70.0),
+        }
+        stats = GarminDB.Weight.get_col_stats(test_db, stats_spec, start_day, end_day)
+        self.assertEqual(stats, {'weight_avg' : 71.0, 'weight_min' : 0.0, 'weight_count' : 1})
+        self.assertEqual(stats['weight_avg'], GarminDB.Weight.get_col_avg(test_db, GarminDB.Weight.weight, start_day, end_day, True))
+
+    def test_col_stats_by(self):
+        test_db = GarminDB.GarminDB(GarminDBConfigManager.get_db_params(test_db=True))
+        start_ts = datetime.datetime(1990, 1, 1)
+        for minutes, stress in enumerate([10, 20, 20, 30]):
+            GarminDB.Stress.insert_or_update(test_db, {'timestamp' : start_ts + datetime.timedelta(minutes=minutes), 'stress' : stress})
+        stats_spec = {'readings' : (GarminDB.Stress.timestamp, 'count')}
+        stats = GarminDB.Stress.get_col_stats_by(test_db, stats_spec, GarminDB.Stress.stress, start_ts, start_ts + datetime.timedelta(minutes=4))
+        self.assertEqual(stats, {10 : {'readings' : 1}, 20 : {'readings' : 2}, 30 : {'readings' : 1}})
+
+    def test_days_stats(self):
+        test_db = GarminDB.GarminDB(GarminDBConfigManager.get_db_params(test_db=True))
+        start_day = datetime.date(1995, 1, 1)
+        GarminDB.Weight.insert_or_update(test_db, {'day' : start_day, 'weight' : 70.0})
+        GarminDB.Weight.insert_or_update(test_db, {'day' : start_day + datetime.timedelta(2), 'weight' : 72.0})
+        days = [start_day + datetime.timedelta(day) for day in range(3)]
+        with test_db.managed_session() as session:
+            days_stats = GarminDB.Weight.s_get_days_stats(session, days)
+            self.assertEqual(list(days_stats.keys()), days)
+            for day in days:
+                self.assertEqual(days_stats[day], GarminDB.Weight.get_daily_stats(session, day))
+        self.assertEqual(days_stats[start_day + datetime.timedelta(1)]['weight_max'], None)
+
+    def test_dirty_days(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_db = GarminDB.GarminDB(db_params)
+        summary_db = GarminDB.GarminSummaryDB(db_params)
+        day = datetime.date(1994, 1, 1)
+        HealthDB.DirtyDayRecorder.clear()
+        GarminDB.Weight.insert_or_update(test_db, {'day' : day, 'weight' : 80.0})
+        GarminDB.Stress.insert_or_update(test_db, {'timestamp' : datetime.datetime.combine(day, datetime.time(12)), 'stress' : 20})
+        self.assertEqual(HealthDB.DirtyDayRecorder.days(), [day])
+        GarminDB.DirtyDays.save(summary_db)
+        self.assertEqual(HealthDB.DirtyDayRecorder.days(), [])
+        self.assertIn(day, GarminDB.DirtyDays.get_dirty_days(summary_db))
+        GarminDB.DirtyDays.delete_days(summary_db, [day])
+        self.assertNotIn(day, GarminDB.DirtyDays.get_dirty_days(summary_db))
+
+    def test_dirty_days_saving(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        act_db = GarminDB.ActivitiesDB(db_params)
+        summary_db = GarminDB.GarminSummaryDB(db_params)
+        day = datetime.date(1994, 2, 1)
+        GarminDB.Activities.insert_or_update(act_db, {'activity_id' : 'dirty_days_test', 'start_time' : datetime.datetime.combine(day, datetime.time(12))})
+        GarminDB.DirtyDays.delete_days(summary_db)
+        HealthDB.DirtyDayRecorder.clear()
+        with self.assertRaises(RuntimeError):
+            with GarminDB.DirtyDays.saving(summary_db):
+                # activity details are written without the start time, the stored start time marks the day
+                GarminDB.Activities.insert_or_update(act_db, {'activity_id' : 'dirty_days_test', 'calories' : 100})
+                # days are saved when the data is committed
+                self.assertEqual(GarminDB.DirtyDays.get_dirty_days(summary_db), [day])
+                HealthDB.DirtyDayRecorder.record(day + datetime.timedelta(1))
+                raise RuntimeError('import failed')
+        # and the rest when the import fails
+        self.assertEqual(GarminDB.DirtyDays.get_dirty_days(summary_db), [day, day + datetime.timedelta(1)])
+        self.assertEqual(HealthDB.DirtyDayRecorder.days(), [])
+
+    def test_monitoring_rows_for_period(self):
+        mon_db = GarminDB.MonitoringDB(GarminDBConfigManager.get_db_params(test_db=True))
+        start_ts = datetime.datetime(1993, 1, 1, 12)
+        hr_values = [{'timestamp' : start_ts + datetime.timedelta(minutes=minute), 'heart_rate' : 60 + minute} for minute in range(3)]
+        GarminDB.MonitoringHeartRate.insert_or_update_many(mon_db, hr_values)
+        GarminDB.Monitoring.insert_or_update_many(mon_db, [
+            {'timestamp' : start_ts, 'activity_type' : Fit.field_enums.ActivityType.walking, 'intensity' : 1},
+            {'timestamp' : start_ts + datetime.timedelta(minutes=1), 'activity_type' : Fit.field_enums.ActivityType.walking}
+        ])
+        end_ts = start_ts + datetime.timedelta(minutes=2)
+        with mon_db.managed_session() as session:
+            self.assertEqual([tuple(row) for row in GarminDB.MonitoringHeartRate.s_get_heart_rates(session, start_ts, end_ts)],
+                             [(start_ts, 60), (start_ts + datetime.timedelta(minutes=1), 61)])
+            self.assertEqual([tuple(row) for row in GarminDB.Monitoring.s_get_intensities(session, start_ts, end_ts)], [(start_ts, 1)])
+
+    def test_days_summary_rollup(self):
+        first_day = datetime.date(1992, 1, 1)
+        days_values = {
+            first_day : {'hr_avg' : 60.0, 'hr_count' : 1, 'stress_avg' : 20, 'steps' : 1000, 'sleep_avg' : datetime.time(8)},
+            first_day + datetime.timedelta(1) : {'hr_avg' : 90.0, 'hr_count' : 2, 'stress_avg' : 50, 'steps' : 2000, 'sleep_avg' : datetime.time.min},
+            first_day + datetime.timedelta(7) : {'hr_avg' : 200.0, 'hr_count' : 1, 'steps' : 4000, 'sleep_avg' : datetime.time(6)}
+        }
+        stats = GarminDB.DaysSummary.rollup(days_values, first_day, first_day + datetime.timedelta(7))
+        self.assertEqual(stats['first_day'], first_day)
+        self.assertEqual(stats['hr_avg'], 80.0)
+        self.assertEqual(stats['hr_max'], None)
+        # stress averages are weighted by days
+        self.assertEqual(stats['stress_avg'], 35.0)
+        self.assertEqual(stats['steps'], 3000)
+        self.assertEqual(stats['sleep_avg'], datetime.time(8))
+        self.assertEqual(stats['activities'], 0)
+
+    def test_summary_sink(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        garmin_sum_db = GarminDB.GarminSummaryDB(db_params)
+        sum_db = HealthDB.SummaryDB(db_params)
+        day = datetime.date(1991, 1, 1)
+        summary_sink = HealthDB.SummarySink()
+        summary_sink.add_target(garmin_sum_db, GarminDB.Summary, {'days' : GarminDB.DaysSummary})
+        summary_sink.add_target(sum_db, HealthDB.Summary, {'days' : HealthDB.DaysSummary})
+        summary_sink.add_rows('days', [{'day' : day, 'hr_avg' : 60.0, 'hr_count' : 10}])
+        summary_sink.set_stat('test_stat', 5)
+        summary_sink.flush()
+        for table, key_value_table, db in [(GarminDB.DaysSummary, GarminDB.Summary, garmin_sum_db), (HealthDB.DaysSummary, HealthDB.Summary, sum_db)]:
+            self.assertEqual(table.get(db, day).hr_avg, 60.0)
+            self.assertEqual(key_value_table.get_int(db, 'test_stat'), 5)
+        self.assertEqual(GarminDB.DaysSummary.get(garmin_sum_db, day).hr_count, 10)
+
+    def test_coverage(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_db = GarminDB.GarminDB(db_params)
+        summary_db = GarminDB.GarminSummaryDB(db_params)
+        start_day = datetime.date(1989, 1, 30)
+        for days in [0, 1, 2, 5]:
+            GarminDB.RestingHeartRate.insert_or_update(test_db, {'day' : start_day + datetime.timedelta(days), 'resting_heart_rate' : 50.0})
+        GarminDB.Coverage.update(summary_db, test_db, GarminDB.RestingHeartRate)
+        runs = [run for run in GarminDB.Coverage.get_runs(summary_db, GarminDB.RestingHeartRate) if run[0].year == 1989]
+        self.assertEqual(runs, [(start_day, start_day + datetime.timedelta(2)), (start_day + datetime.timedelta(5), start_day + datetime.timedelta(5))])
+        self.assertEqual(GarminDB.Coverage.get_gaps(summary_db, GarminDB.RestingHeartRate, 1989), [(datetime.date(1989, 2, 2), datetime.date(1989, 2, 3))])
+        month_days = GarminDB.Coverage.get_month_days(summary_db, GarminDB.RestingHeartRate)
+        self.assertEqual(month_days[datetime.date(1989, 1, 1)], 2)
+        self.assertEqual(month_days[datetime.date(1989, 2, 1)], 2)
+
+    def test_training_load(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        act_db = GarminDB.ActivitiesDB(db_params)
+        summary_db = GarminDB.GarminSummaryDB(db_params)
+        start_time = datetime.datetime(1989, 1, 30, 7, 0, 0)
+        hr_records = [(start_time + datetime.timedelta(seconds=(10 * record)), 150) for record in range(361)]
+        GarminDB.Activities.insert_or_update(act_db, {'activity_id' : 'training_load', 'start_time' : start_time, 'training_effect' : 3.0})
+        GarminDB.ActivityRecords.insert_or_update_many(act_db, [
+            {'activity_id' : 'training_load', 'record' : record, 'timestamp' : timestamp, 'hr' : hr} for record, (timestamp, hr) in enumerate(hr_records)
+        ])
+        load = GarminDB.TrainingLoad.trimp(hr_records, 60, 185)
+        self.assertAlmostEqual(load, 60 * 0.72 * 0.64 * math.exp(1.92 * 0.72))
+        GarminDB.TrainingLoad.update(summary_db, act_db, end_day=datetime.date(1989, 2, 1))
+        with summary_db.managed_session() as session:
+            days = session.query(GarminDB.TrainingLoad).filter(GarminDB.TrainingLoad.day < datetime.date(1989, 2, 2)).order_by(GarminDB.TrainingLoad.day).all()
+        self.assertEqual([day.activities for day in days], [1, 0, 0])
+        self.assertAlmostEqual(days[0].atl, load * (1.0 - math.exp(-1.0 / 7)))
+        self.assertAlmostEqual(days[2].ctl, load * (1.0 - math.exp(-1.0 / 42)) * math.exp(-2.0 / 42))
+        self.assertAlmostEqual(days[2].tsb, days[2].ctl - days[2].atl)
+
+    def test_calendar(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        summary_db = GarminDB.GarminSummaryDB(db_params)
+        with summary_db.managed_session() as session:
+            GarminDB.Calendar.s_update(session, datetime.date(2020, 2, 1), datetime.date(2020, 3, 1))
+            last_day = session.query(GarminDB.Calendar).filter(GarminDB.Calendar.day == datetime.date(2020, 12, 31)).one()
+            self.assertEqual((last_day.day_of_year, last_day.quarter, last_day.iso_year, last_day.iso_week), (366, 4, 2020, 53))
+            days_query = session.query(GarminDB.Calendar.day).filter(GarminDB.Calendar.day == datetime.date(2020, 12, 31))
+            self.assertEqual(GarminDB.Calendar.s_get_periods(session, 'weeks', days_query), [(datetime.date(2020, 12, 28), datetime.date(2021, 1, 4))])
+            self.assertEqual(GarminDB.Calendar.s_get_periods(session, 'months', days_query), [(datetime.date(2020, 12, 1), datetime.date(2021, 1, 1))])
+            self.assertEqual(GarminDB.Calendar.s_get_periods(session, 'years', days_query), [(datetime.date(2020, 1, 1), datetime.date(2021, 1, 1))])
+
+    def test_db_registry_forget(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_db = GarminDB.GarminDB(db_params)
+        HealthDB.DbRegistry.forget()
+        self.assertIsNone(HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params))
+        self.assertIsNot(GarminDB.GarminDB(db_params), test_db)
+        # the forgotten instance still works, its connections weren't closed
+        self.assertIsNotNone(GarminDB.Weight.row_count(test_db))
+
+    def test_query_cache(self):
+        test_db = GarminDB.GarminDB(GarminDBConfigManager.get_db_params(test_db=True))
+        day = datetime.date(1996, 1, 1)
+        GarminDB.Weight.insert_or_update(test_db, {'day' : day, 'weight' : 80.0})
+        HealthDB.QueryCache.enable(GarminDBConfigManager.get_query_cache_file(test_db=True))
+        try:
+            with test_db.managed_session() as session:
+                self.assertEqual(GarminDB.Weight.get_stats(session, day, day + datetime.timedelta(1))['weight_max'], 80.0)
+            with test_db.managed_session() as session:
+                self.assertEqual(GarminDB.Weight.get_stats(session, day, day + datetime.timedelta(1))['weight_max'], 80.0)
+            GarminDB.Weight.insert_or_update(test_db, {'day' : day, 'weight' : 81.0})
+            with test_db.managed_session() as session:
+                self.assertEqual(GarminDB.Weight.get_stats(session, day, day + datetime.timedelta(1))['weight_max'], 81.0)
+            # a rebuilt database starts a new generation, the counters may match but the cached results don't
+            connection = sqlite3.connect(test_db.engine.url.database)
+            connection.execute(f'UPDATE {HealthDB.QueryCache.generation_table} SET generation = ?', ('rebuilt',))
+            connection.execute('UPDATE weight SET weight = 82.0 WHERE day = ?', (str(day),))
+            connection.commit()
+            connection.close()
+            with test_db.managed_session() as session:
+                self.assertEqual(GarminDB.Weight.get_stats(session, day, day + datetime.timedelta(1))['weight_max'], 82.0)
+        finally:
+            HealthDB.QueryCache.disable()
+        self.assertFalse(sqlalchemy.event.contains(sqlalchemy.engine.Engine, 'commit', HealthDB.query_cache._on_commit))
+
+    def test_schema_migrations(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_db = GarminDB.GarminDB(db_params)
+        day = datetime.date(1999, 1, 1)
+        GarminDB.Weight.insert_or_update(test_db, {'day' : day, 'weight' : 100.0})
+        table_version = GarminDB.Weight.table_version
+        attributes = GarminDB.GarminDB._DbAttributes
+        with test_db.managed_session() as session:
+            session.query(attributes).filter(attributes.key == 'weight.version').update({'value' : str(table_version - 1)})
+        HealthDB.DbRegistry.remove(GarminDB.GarminDB, db_params)
+        GarminDB.Weight.table_migrations = {table_version - 1 : HealthDB.SchemaMigrations.copy_table()}
+        try:
+            test_db = GarminDB.GarminDB(db_params)
+        finally:
+            del GarminDB.Weight.table_migrations
+        self.assertEqual(attributes.get_int(test_db, 'weight.version'), table_version)
+        self.assertEqual(GarminDB.Weight.get(test_db, day).weight, 100.0)
+
+    def test_schema_migrations_create_indexes(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_db = GarminDB.GarminDB(db_params)
+        type_index = next(index for index in GarminDB.File.__table__.indexes if index.name == 'ix_files_type')
+        type_index.drop(test_db.engine)
+        attributes = GarminDB.GarminDB._DbAttributes
+        with test_db.managed_session() as session:
+            session.query(attributes).filter(attributes.key == 'files.version').update({'value' : str(GarminDB.File.table_version - 1)})
+        HealthDB.DbRegistry.remove(GarminDB.GarminDB, db_params)
+        test_db = GarminDB.GarminDB(db_params)
+        self.assertEqual(attributes.get_int(test_db, 'files.version'), GarminDB.File.table_version)
+        self.assertIn('ix_files_type', [index['name'] for index in sqlalchemy.inspect(test_db.engine).get_indexes('files')])
+
+    def test_db_maintenance(self):
+        test_db = GarminDB.GarminDB(GarminDBConfigManager.get_db_params(test_db=True))
+        GarminDB.Weight.insert_or_update(test_db, {'day' : datetime.date(1998, 1, 1), 'weight' : 100.0})
+        report = HealthDB.DbMaintenance.maintain(test_db, vacuum=True)
+        self.assertIsNotNone(report)
+        self.assertEqual(report['integrity_problems'], [])
+        self.assertGreater(report['page_size'], 0)
+        self.assertGreater(report['page_count'], 0)
+        # vacuuming leaves no free pages
+        self.assertEqual(report['freelist_count'], 0)
+        rows, size = report['tables']['weight']
+        self.assertEqual(rows, GarminDB.Weight.row_count(test_db))
+        if size is not None:
+            self.assertGreater(size, 0)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
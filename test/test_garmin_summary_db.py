@@ -35,6 +35,12 @@ class TestGarminSummaryDB(TestSummaryDBBase, unittest.TestCase):
         }
         super().setUpClass(db, table_dict)
 
+    def test_unified_db(self):
+        db_params = GarminDBConfigManager.get_db_params()
+        unified_db = GarminDB.UnifiedDB(db_params)
+        for table in [GarminDB.File, GarminDB.Monitoring, GarminDB.Activities, GarminDB.DaysSummary]:
+            self.assertEqual(table.row_count(unified_db), table.row_count(table.db(db_params)))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -9,6 +9,7 @@ import logging
 import datetime
 
 from test_db_base import TestDBBase
+import HealthDB
 import GarminDB
 import Fit
 from garmin_db_config_manager import GarminDBConfigManager
@@ -39,6 +40,9 @@ class TestMonitoringDB(TestDBBase, unittest.TestCase):
             'monitoring_intensity_table'    : GarminDB.MonitoringIntensity,
             'monitoring_climb_table'        : GarminDB.MonitoringClimb,
             'monitoring_table'              : GarminDB.Monitoring,
+            'monitoring_rollup_15min_table' : GarminDB.MonitoringRollup15Min,
+            'monitoring_rollup_hour_table'  : GarminDB.MonitoringRollupHour,
+            'monitoring_rollup_day_table'   : GarminDB.MonitoringRollupDay,
         }
         super().setUpClass(cls.garmin_mon_db, table_dict)
 
@@ -56,6 +60,13 @@ class TestMonitoringDB(TestDBBase, unittest.TestCase):
         self.assertGreater(max, 0)
         self.assertLess(max, 100000)
 
+    def test_garmin_mon_db_rollup_bounds(self):
+        max = GarminDB.MonitoringRollupDay.get_col_max(self.db, GarminDB.MonitoringRollupDay.steps)
+        self.assertGreater(max, 0)
+        self.assertLess(max, 100000)
+        self.assertLessEqual(GarminDB.MonitoringRollup15Min.get_col_max(self.db, GarminDB.MonitoringRollup15Min.hr_max),
+                             GarminDB.MonitoringHeartRate.get_col_max(self.db, GarminDB.MonitoringHeartRate.heart_rate))
+
     def test_garmin_mon_db_uptodate(self):
         uptodate_tables = {
             'monitoring_hr_table'   : GarminDB.MonitoringHeartRate,
@@ -91,6 +102,44 @@ class TestMonitoringDB(TestDBBase, unittest.TestCase):
         }
         self.check_not_none_cols(GarminDB.GarminDB(db_params), table_not_none_cols_dict)
 
+    def test_monitoring_partitions(self):
+        test_mon_db = GarminDB.MonitoringDB(GarminDBConfigManager.get_db_params(test_db=True))
+        start_ts = datetime.datetime(1990, 12, 31, 23, 0)
+        values_dicts = [{'timestamp' : start_ts + datetime.timedelta(minutes=(minutes * 30)), 'pulse_ox' : 90.0 + minutes} for minutes in range(4)]
+        GarminDB.MonitoringPulseOx.insert_or_update_many(test_mon_db, values_dicts)
+        GarminDB.MonitoringPartitions.create(test_mon_db, [GarminDB.MonitoringPulseOx])
+        with test_mon_db.managed_session() as session:
+            self.assertTrue(GarminDB.MonitoringPartitions.s_is_partitioned(session, GarminDB.MonitoringPulseOx))
+        self.assertEqual(GarminDB.MonitoringPulseOx.row_count_for_period(test_mon_db, start_ts, datetime.datetime(1992, 1, 1)), 4)
+        GarminDB.MonitoringPulseOx.insert_or_update(test_mon_db, {'timestamp' : datetime.datetime(1991, 6, 1), 'pulse_ox' : 99.0})
+        self.assertEqual(GarminDB.MonitoringPulseOx.get_col_max(test_mon_db, GarminDB.MonitoringPulseOx.pulse_ox, start_ts, datetime.datetime(1992, 1, 1)), 99.0)
+        # rows that can't be upserted natively, like ones with keys that aren't columns, are written to the partition too
+        GarminDB.MonitoringPulseOx.insert_or_update(test_mon_db, {'timestamp' : datetime.datetime(1991, 6, 1), 'pulse_ox' : 98.0, 'device' : 1})
+        GarminDB.MonitoringPulseOx.insert_or_update(test_mon_db, {'timestamp' : datetime.datetime(1991, 7, 1), 'pulse_ox' : 97.0, 'device' : 1})
+        self.assertEqual(GarminDB.MonitoringPulseOx.get_col_max(test_mon_db, GarminDB.MonitoringPulseOx.pulse_ox, start_ts, datetime.datetime(1992, 1, 1)), 98.0)
+        self.assertEqual(GarminDB.MonitoringPulseOx.row_count_for_period(test_mon_db, start_ts, datetime.datetime(1992, 1, 1)), 6)
+        # migrations skip the tables that are now views
+        HealthDB.SchemaMigrations.migrate(GarminDB.MonitoringDB, GarminDBConfigManager.get_db_params(test_db=True))
+        GarminDB.MonitoringPartitions.delete_year(test_mon_db, 1991)
+        self.assertEqual(GarminDB.MonitoringPulseOx.row_count_for_period(test_mon_db, start_ts, datetime.datetime(1992, 1, 1)), 2)
+        GarminDB.MonitoringPartitions.delete_year(test_mon_db, 1990)
+        with test_mon_db.managed_session() as session:
+            self.assertFalse(GarminDB.MonitoringPartitions.s_is_partitioned(session, GarminDB.MonitoringPulseOx))
+
+    def test_monitoring_rollups_create_missing(self):
+        test_mon_db = GarminDB.MonitoringDB(GarminDBConfigManager.get_db_params(test_db=True))
+        day = datetime.date(2099, 1, 2)
+        day_ts = datetime.datetime.combine(day, datetime.time(12))
+        GarminDB.MonitoringHeartRate.insert_or_update(test_mon_db, {'timestamp' : day_ts, 'heart_rate' : 60})
+        GarminDB.MonitoringRollups.create_missing(test_mon_db)
+        self.assertEqual(GarminDB.MonitoringRollupDay.get(test_mon_db, datetime.datetime.combine(day, datetime.time.min)).hr_max, 60)
+        # only days after the last rolled up day are looked for, imports keep the days before that rolled up
+        for days in [-1, 1]:
+            GarminDB.MonitoringHeartRate.insert_or_update(test_mon_db, {'timestamp' : day_ts + datetime.timedelta(days), 'heart_rate' : 70})
+        GarminDB.MonitoringRollups.create_missing(test_mon_db)
+        self.assertIsNone(GarminDB.MonitoringRollupDay.get(test_mon_db, datetime.datetime.combine(day, datetime.time.min) - datetime.timedelta(1)))
+        self.assertEqual(GarminDB.MonitoringRollupDay.get(test_mon_db, datetime.datetime.combine(day, datetime.time.min) + datetime.timedelta(1)).hr_max, 70)
+
     def check_day_steps(self, data):
         last_steps = {}
         last_steps_timestamp = None